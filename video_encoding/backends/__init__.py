@@ -15,6 +15,11 @@ def get_backend_class():
     return cls
 
 
-def get_backend():
+def get_backend(**kwargs):
+    """
+    Returns an instance of the configured backend. `kwargs` override
+    `VIDEO_ENCODING_BACKEND_PARAMS`.
+    """
     cls = get_backend_class()
-    return cls(**settings.VIDEO_ENCODING_BACKEND_PARAMS)
+    params = dict(settings.VIDEO_ENCODING_BACKEND_PARAMS, **kwargs)
+    return cls(**params)
@@ -1,32 +1,104 @@
 import abc
+from collections import namedtuple
+from contextlib import closing
+
 import six
 
+# Reported while encoding. `percent` is between 0 and 100, `out_time` is
+# the encoded time in seconds and `speed` the factor of realtime.
+Progress = namedtuple('Progress', ['percent', 'frame', 'fps', 'speed',
+                                   'out_time'])
+
+
 @six.add_metaclass(abc.ABCMeta)
 class BaseEncodingBackend:
     # used as key to get all defined formats from `VIDEO_ENCODING_FORMATS`
     name = 'undefined'
+    # whether `__init__` takes a `threads` argument which limits the
+    # threads of an encode, e.g. to its share of the core budget
+    supports_threads = False
 
     @classmethod
     def check(cls):
         return []
 
     @abc.abstractmethod
-    def encode(self, source_path, target_path, params):  # pragma: no cover
+    def encode(self, source_path, target_path, params,
+               media_info=None):  # pragma: no cover
         """
         Encodes a video to a specified file. All encoder specific options
         are passed in using `params`.
+
+        `media_info` may contain the already probed information of the
+        source, otherwise the backend probes it itself.
+
+        Yields a `Progress` until the encoding is finished.
         """
         pass
 
+    def can_remux(self, media_info, params):
+        """
+        Returns whether `encode` would copy the streams of a source with
+        the given media info instead of encoding them.
+        """
+        return False
+
+    def get_complexity(self, video_path, media_info=None, samples=5,
+                       sample_duration=2):
+        """
+        Returns an estimate of how hard the video is to compress, in bits
+        per pixel, or `None` if the backend cannot estimate it.
+        """
+        return None
+
+    def encode_multiple(self, source_path, outputs, media_info=None):
+        """
+        Encodes a video into several files at once. `outputs` is a list of
+        `(target_path, params)` tuples. Progress is reported for all outputs
+        together.
+
+        Backends without support encode the outputs one after another.
+        """
+        for index, (target_path, params) in enumerate(outputs):
+            encoding = self.encode(source_path, target_path, params,
+                                   media_info=media_info)
+            with closing(encoding):
+                for progress in encoding:
+                    percent = (index * 100 + progress.percent) / len(outputs)
+                    yield progress._replace(percent=percent)
+
+    def encode_hls(self, source_path, target_dir, renditions,
+                   media_info=None, segment_duration=6):
+        """
+        Encodes a video for HTTP live streaming into `target_dir`, which
+        afterwards contains `master.m3u8` referencing a variant playlist
+        for each of the `(name, params)` tuples in `renditions`.
+        """
+        raise NotImplementedError(
+            "{} does not support HLS.".format(self.__class__.__name__))
+
+    def encode_segmented(self, source_path, target_path, params,
+                         media_info=None, segment_duration=60, workers=None):
+        """
+        Encodes a video in segments which are processed in parallel.
+        Backends without support encode the whole file at once.
+        """
+        return self.encode(source_path, target_path, params,
+                           media_info=media_info)
+
     @abc.abstractmethod
     def get_media_info(self, video_path):  # pragma: no cover
         """
         Returns duration, width and height of the video as dict.
+
+        Backends should also provide `video_codec`, `audio_codec`,
+        `frame_rate`, `bit_rate` and `has_audio` where possible.
         """
         pass
 
     @abc.abstractmethod
-    def get_thumbnail(self, video_path):  # pragma: no cover
+    def get_thumbnail(self, video_path, at_time=0.5,
+                      media_info=None):  # pragma: no cover
         """
         Extracts an image of a video and returns its path.
 
@@ -34,3 +106,29 @@ class BaseEncodingBackend:
         an `InvalidTimeError` is thrown.
         """
         pass
+
+    def get_thumbnails(self, video_path, count=10, times=None,
+                       media_info=None):
+        """
+        Extracts `count` evenly spaced images, or the images at `times`,
+        and returns their paths.
+        """
+        if media_info is None:
+            media_info = self.get_media_info(video_path)
+        if times is None:
+            times = [media_info['duration'] * (index + 0.5) / count
+                     for index in range(count)]
+        return [self.get_thumbnail(video_path, at_time=time,
+                                   media_info=media_info)
+                for time in times]
+
+    def get_storyboard(self, video_path, interval=10, width=160, columns=10,
+                       rows=10, media_info=None):
+        """
+        Extracts an image every `interval` seconds, tiled into sprites of
+        `columns` x `rows` images. Returns the sprite paths and the path of
+        a WebVTT file referencing the areas of the sprites.
+        """
+        raise NotImplementedError(
+            "{} does not support storyboards.".format(
+                self.__class__.__name__))
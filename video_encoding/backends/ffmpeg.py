@@ -1,33 +1,169 @@
+import csv
 import json
 import locale
 import logging
+import math
 import os
-import re
+import shutil
 import tempfile
-from subprocess import PIPE, Popen
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextlib import closing
+from subprocess import PIPE, Popen, TimeoutExpired
 
 import six
 from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
 
-from .. import exceptions
+from .. import exceptions, headers, metrics
+from .. import params as params_utils
+from .. import planning
 from ..compat import which
 from ..config import settings
-from .base import BaseEncodingBackend
+from .base import BaseEncodingBackend, Progress
 
 logger = logging.getLogger(__name__)
-RE_TIMECODE = re.compile(r'time=(\d+:\d+:\d+.\d+) ')
 
 console_encoding = locale.getdefaultlocale()[1] or 'UTF-8'
 
+# codecs produced by encoders, used to detect if a stream can be copied
+ENCODER_CODECS = {
+    'libx264': 'h264', 'h264': 'h264', 'libx265': 'hevc', 'hevc': 'hevc',
+    'libvpx': 'vp8', 'libvpx-vp9': 'vp9',
+    'aac': 'aac', 'libfdk_aac': 'aac', 'libvorbis': 'vorbis',
+    'libopus': 'opus', 'libmp3lame': 'mp3',
+}
+# containers which support moving the index to the front
+FASTSTART_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+
+# the only options of formats which can be remuxed, a stream copy honours
+# them if `can_remux` accepts their values or they only tune the encoder
+REMUX_OPTIONS = (
+    '-codec:v', '-c:v', '-vcodec', '-codec:a', '-c:a', '-acodec',
+    '-vf', '-filter:v', '-pix_fmt', '-r',
+    '-b:v', '-maxrate', '-bufsize', '-b:a',
+    '-crf', '-preset', '-tune', '-qmin', '-qmax', '-strict',
+)
+# muxer options, which are passed on to the remux
+REMUX_MUXER_OPTIONS = ('-f', '-movflags')
+
+# number of stderr lines kept for error messages
+STDERR_MAX_LINES = 50
+
+# inputs of each ffmpeg process extracting the images of a storyboard,
+# every input has its own decoder
+STORYBOARD_BATCH_SIZE = 10
+
+# scheduling classes of `ionice`
+IONICE_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+
+
+def _format_timestamp(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return '{:02d}:{:02d}:{:06.3f}'.format(hours, minutes, seconds)
+
+
+def _parse_number(value, type_=float):
+    try:
+        return type_(value)
+    except (TypeError, ValueError):
+        # ffmpeg reports `N/A` for unknown values
+        return None
+
+
+class StderrCollector(threading.Thread):
+    """
+    Drains the stderr pipe of a process in the background and keeps only
+    its last lines.
+    """
+
+    def __init__(self, stream, max_lines=STDERR_MAX_LINES):
+        super(StderrCollector, self).__init__(daemon=True)
+        self.stream = stream
+        self.lines = deque(maxlen=max_lines)
+
+    def run(self):
+        for line in iter(self.stream.readline, b''):
+            self.lines.append(line)
+
+    def get_output(self):
+        return b''.join(self.lines).decode(console_encoding, 'replace')
+
+
+class Watchdog(threading.Thread):
+    """
+    Kills a process whose output position does not advance for
+    `stall_timeout` seconds or which runs longer than `time_limit` seconds.
+    The reason is kept in `error`.
+    """
+
+    def __init__(self, process, stall_timeout=None, time_limit=None):
+        super(Watchdog, self).__init__(daemon=True)
+        self.process = process
+        self.stall_timeout = stall_timeout
+        self.time_limit = time_limit
+        self.error = None
+        self._out_time = None
+        self._started_at = self._advanced_at = time.monotonic()
+        self._stopped = threading.Event()
+
+    def update(self, out_time):
+        if out_time is not None and (self._out_time is None or
+                                     out_time > self._out_time):
+            self._out_time = out_time
+            self._advanced_at = time.monotonic()
+
+    def check(self):
+        """
+        Returns the reason to kill the process or `None`.
+        """
+        now = time.monotonic()
+        if self.time_limit and now - self._started_at > self.time_limit:
+            return "exceeded the time limit of {:.0f}s".format(
+                self.time_limit)
+        if (self.stall_timeout and
+                now - self._advanced_at > self.stall_timeout):
+            return "made no progress for {:.0f}s".format(self.stall_timeout)
+        return None
+
+    def run(self):
+        while not self._stopped.wait(1):
+            self.error = self.check()
+            if self.error is not None:
+                self.process.kill()
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
 
 class FFmpegBackend(BaseEncodingBackend):
     name = 'FFmpeg'
+    supports_threads = True
 
-    def __init__(self):
+    def __init__(self, threads=None, nice=None, ionice=None,
+                 cpu_affinity=None, memory_limit=None):
+        """
+        Spawned processes can be deprioritized to protect other services on
+        the same host:
+
+        * `nice`: increment of the CPU niceness, e.g. `10`, requires `nice`
+        * `ionice`: IO scheduling class `'idle'`, `'best-effort'` or
+          `'realtime'`, or a `(class, level)` tuple, requires `ionice`
+        * `cpu_affinity`: CPUs the processes may run on, e.g. `{2, 3}`,
+          requires `taskset`
+        * `memory_limit`: limit of the address space in bytes, requires
+          `prlimit`
+        """
+        self.threads = threads
         # This will fix errors in tests
         self.params = [
             '-threads',
-            str(settings.VIDEO_ENCODING_THREADS),
+            str(threads or settings.VIDEO_ENCODING_THREADS),
             '-y',  # overwrite temporary created file
             '-strict', '-2',  # support aac codec (which is experimental)
         ]
@@ -45,6 +181,16 @@ class FFmpegBackend(BaseEncodingBackend):
             raise exceptions.FFmpegError("ffprobe binary not found: {}".format(
                 self.ffmpeg_path or ''))
 
+        self.nice = nice
+        self.cpu_affinity = set(cpu_affinity) if cpu_affinity else None
+        self.memory_limit = memory_limit
+        # the limits are applied by wrapping the commands, running Python
+        # in the forked child of a process with threads may deadlock
+        self.command_prefix = (self._get_nice_prefix(nice) +
+                               self._get_ionice_prefix(ionice) +
+                               self._get_taskset_prefix(self.cpu_affinity) +
+                               self._get_prlimit_prefix(memory_limit))
+
     @classmethod
     def check(cls):
         errors = super(FFmpegBackend, cls).check()
@@ -59,10 +205,56 @@ class FFmpegBackend(BaseEncodingBackend):
             ))
         return errors
 
+    def _get_binary_path(self, name):
+        """
+        Returns the path of a helper binary, which can be set with
+        `VIDEO_ENCODING_<NAME>_PATH`.
+        """
+        path = getattr(settings,
+                       'VIDEO_ENCODING_{}_PATH'.format(name.upper()),
+                       which(name))
+        if not path:
+            raise ImproperlyConfigured("{} binary not found.".format(name))
+        return path
+
+    def _get_nice_prefix(self, nice):
+        if not nice:
+            return []
+        return [self._get_binary_path('nice'), '-n', str(nice)]
+
+    def _get_ionice_prefix(self, ionice):
+        if ionice is None:
+            return []
+        if isinstance(ionice, six.string_types):
+            ionice = (ionice, None)
+        io_class, level = ionice
+        if io_class not in IONICE_CLASSES:
+            raise ImproperlyConfigured(
+                "Unknown ionice class '{}'.".format(io_class))
+
+        prefix = [self._get_binary_path('ionice'),
+                  '-c', str(IONICE_CLASSES[io_class])]
+        if level is not None:
+            prefix.extend(['-n', str(level)])
+        return prefix
+
+    def _get_taskset_prefix(self, cpu_affinity):
+        if not cpu_affinity:
+            return []
+        return [self._get_binary_path('taskset'), '--cpu-list',
+                ','.join(str(cpu) for cpu in sorted(cpu_affinity))]
+
+    def _get_prlimit_prefix(self, memory_limit):
+        if not memory_limit:
+            return []
+        return [self._get_binary_path('prlimit'),
+                '--as={:d}'.format(memory_limit)]
+
     def _spawn(self, cmds):
+        metrics.increment('subprocesses', binary=os.path.basename(cmds[0]))
         try:
             return Popen(
-                cmds, shell=False,
+                self.command_prefix + cmds, shell=False,
                 stdin=PIPE, stdout=PIPE, stderr=PIPE,
                 close_fds=True,
             )
@@ -70,8 +262,29 @@ class FFmpegBackend(BaseEncodingBackend):
             raise six.raise_from(
                 exceptions.FFmpegError('Error while running ffmpeg binary'), e)
 
-    def _check_returncode(self, process):
-        stdout, stderr = process.communicate()
+    def _get_time_limit(self, duration):
+        """
+        Returns the wall-clock limit of processes working on a video of the
+        given duration or `None` for no limit.
+        """
+        factor = settings.VIDEO_ENCODING_TIMEOUT_FACTOR
+        minimum = settings.VIDEO_ENCODING_TIMEOUT_MIN
+        if factor is None:
+            return minimum
+        return max(minimum or 0, (duration or 0) * factor) or None
+
+    def _check_returncode(self, process, timeout=None):
+        """
+        Waits for the process, which is killed after `timeout` seconds.
+        """
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise exceptions.FFmpegTimeoutError(
+                "`{}` exceeded the time limit of {:.0f}s".format(
+                    ' '.join(process.args), timeout))
         if process.returncode != 0:
             raise exceptions.FFmpegError("`{}` exited with code {:d}".format(
                 ' '.join(process.args), process.returncode))
@@ -79,63 +292,507 @@ class FFmpegBackend(BaseEncodingBackend):
         self.stderr = stderr.decode(console_encoding)
         return self.stdout, self.stderr
 
-    # TODO reduce complexity
-    def encode(self, source_path, target_path, params):  # NOQA: C901
+    def encode(self, source_path, target_path, params, media_info=None):
         """
         Encodes a video to a specified file. All encoder specific options
         are passed in using `params`.
         """
-        total_time = self.get_media_info(source_path)['duration']
+        if media_info is None:
+            media_info = self.get_media_info(source_path)
+        cmds = self._get_encode_cmds(source_path, target_path, params,
+                                     media_info)
+        return self._encode(cmds, media_info['duration'], [target_path])
+
+    def _get_encode_cmds(self, source_path, target_path, params, media_info):
+        if self.can_remux(media_info, params):
+            return self._get_remux_cmds(source_path, target_path, params)
 
         cmds = [self.ffmpeg_path, '-i', source_path]
         cmds.extend(self.params)
         cmds.extend(params)
         cmds.extend([target_path])
+        return cmds
 
-        process = self._spawn(cmds)
-
-        buf = output = ''
-        # update progress
-        while True:
-            # any more data?
-            out = process.stderr.read(10)
-            if not out:
-                break
-
-            out = out.decode(console_encoding)
-            output += out
-            buf += out
+    def can_remux(self, media_info, params):
+        """
+        Returns whether the source already satisfies the codecs, size,
+        frame rate and bitrate of `params`, so the streams can be copied.
+        Formats with other options, e.g. filters, profiles or audio
+        settings, are always encoded.
+        """
+        if not settings.VIDEO_ENCODING_REMUX:
+            return False
+
+        allowed = REMUX_OPTIONS + REMUX_MUXER_OPTIONS
+        if any(name not in allowed for name in params[::2]):
+            return False
+
+        video_codec = params_utils.get_option(
+            params, '-codec:v', '-c:v', '-vcodec')
+        audio_codec = params_utils.get_option(
+            params, '-codec:a', '-c:a', '-acodec')
+        if ENCODER_CODECS.get(video_codec) != media_info.get('video_codec'):
+            return False
+        if media_info.get('has_audio') and (
+                ENCODER_CODECS.get(audio_codec) !=
+                media_info.get('audio_codec')):
+            return False
+
+        pix_fmt = params_utils.get_option(params, '-pix_fmt') or 'yuv420p'
+        if media_info.get('pix_fmt') != pix_fmt:
+            return False
+
+        video_filter = params_utils.get_video_filter(params)
+        if video_filter is not None:
+            # only a scale to the size of the source
+            scale = planning.get_scale(params)
+            if (scale is None or
+                    planning.RE_SCALE.fullmatch(video_filter) is None):
+                return False
+            width, height = scale
+            if ((width > 0 and width != media_info['width']) or
+                    (height > 0 and height != media_info['height'])):
+                return False
+
+        frame_rate = params_utils.get_option(params, '-r')
+        try:
+            if frame_rate and float(frame_rate) < (
+                    media_info.get('frame_rate') or float('inf')):
+                return False
+        except ValueError:
+            return False
+
+        max_bit_rate = sum(params_utils.parse_bitrate(
+            params_utils.get_option(params, *options)) or 0
+            for options in (('-maxrate', '-b:v'), ('-b:a',)))
+        if max_bit_rate and (
+                not media_info.get('bit_rate') or
+                media_info['bit_rate'] > max_bit_rate):
+            return False
+
+        return True
+
+    def remux(self, source_path, target_path, media_info=None):
+        """
+        Copies the first video and audio stream into a new container.
+        """
+        if media_info is None:
+            media_info = self.get_media_info(source_path)
+        cmds = self._get_remux_cmds(source_path, target_path)
+        return self._encode(cmds, media_info['duration'], [target_path])
+
+    def _get_remux_cmds(self, source_path, target_path, params=()):
+        cmds = [self.ffmpeg_path, '-i', source_path,
+                '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', '-y']
+        for name in REMUX_MUXER_OPTIONS:
+            value = params_utils.get_option(params, name)
+            if value is not None:
+                cmds.extend([name, value])
+        if (not params_utils.has_option(params, '-movflags') and
+                os.path.splitext(target_path)[1].lower() in
+                FASTSTART_EXTENSIONS):
+            cmds.extend(['-movflags', '+faststart'])
+        cmds.append(target_path)
+        return cmds
+
+    def get_complexity(self, video_path, media_info=None, samples=5,
+                       sample_duration=2, width=320):
+        """
+        Encodes `samples` evenly spaced parts of `sample_duration` seconds
+        at a low resolution with a constant quality and returns the bits
+        per pixel of the result. Detailed or fast moving content needs more
+        bits than e.g. screen recordings.
+        """
+        if media_info is None:
+            media_info = self.get_media_info(video_path)
+        duration = media_info['duration']
+        if not duration:
+            return None
+        sample_duration = min(sample_duration, duration / samples)
+        aspect = media_info['height'] / float(media_info['width'])
+        height = max(2, int(round(width * aspect / 2)) * 2)
+
+        cmds = [self.ffmpeg_path, '-y']
+        filters = []
+        for index in range(samples):
+            start = max(0, duration * (index + 0.5) / samples -
+                        sample_duration / 2)
+            cmds.extend(['-ss', '{:.3f}'.format(start),
+                         '-t', '{:.3f}'.format(sample_duration),
+                         '-i', video_path])
+            filters.append('[{0:d}:v:0]scale={1:d}:{2:d},setsar=1[v{0:d}]'
+                           .format(index, width, height))
+        graph = '{};{}concat=n={:d}:v=1:a=0[out]'.format(
+            ';'.join(filters),
+            ''.join('[v{:d}]'.format(index) for index in range(samples)),
+            samples)
+
+        fd, target_path = tempfile.mkstemp(suffix='_complexity.mkv')
+        os.close(fd)
+        cmds.extend(['-filter_complex', graph, '-map', '[out]', '-an',
+                     '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '23',
+                     '-f', 'matroska', target_path])
+        try:
+            with metrics.timer('complexity'):
+                self._check_returncode(
+                    self._spawn(cmds),
+                    timeout=self._get_time_limit(samples * sample_duration))
+            size = os.path.getsize(target_path)
+        finally:
+            os.unlink(target_path)
+
+        frames = (media_info.get('frame_rate') or 25) * samples * \
+            sample_duration
+        return size * 8.0 / (width * height * frames)
+
+    def encode_multiple(self, source_path, outputs, media_info=None):
+        """
+        Encodes a video into several files with a single ffmpeg process, so
+        the source is demuxed and decoded only once. `outputs` is a list of
+        `(target_path, params)` tuples.
 
+        The video filters (`-vf`) of all outputs are combined into one
+        filter graph which splits the decoded video.
+        """
+        if media_info is None:
+            media_info = self.get_media_info(source_path)
+
+        filters = []
+        for index, (__, params) in enumerate(outputs):
+            video_filter = params_utils.get_video_filter(params) or 'null'
+            filters.append('[s{0:d}]{1}[v{0:d}]'.format(index, video_filter))
+        graph = '[0:v]split={count:d}{labels};{filters}'.format(
+            count=len(outputs),
+            labels=''.join('[s{:d}]'.format(i) for i in range(len(outputs))),
+            filters=';'.join(filters))
+
+        cmds = [self.ffmpeg_path, '-i', source_path, '-filter_complex', graph]
+        for index, (target_path, params) in enumerate(outputs):
+            cmds.extend(['-map', '[v{:d}]'.format(index)])
+            if media_info.get('has_audio', True):
+                cmds.extend(['-map', '0:a:0?'])
+            # output options only apply to the following output
+            cmds.extend(self.params)
+            cmds.extend(params_utils.remove_video_filter(params))
+            cmds.append(target_path)
+
+        return self._encode(
+            cmds, media_info['duration'],
+            [target_path for target_path, __ in outputs])
+
+    def encode_hls(self, source_path, target_dir, renditions,
+                   media_info=None, segment_duration=6):
+        """
+        Encodes a video for HLS into `target_dir`. Each rendition in
+        `renditions`, a list of `(name, params)` tuples, becomes a variant
+        playlist `<name>.m3u8` with fragmented MP4 init and media segments.
+        All variants are encoded with a single decode and referenced by
+        `master.m3u8`.
+        """
+        if media_info is None:
+            media_info = self.get_media_info(source_path)
+
+        outputs = []
+        for name, params in renditions:
+            params = self._get_keyframe_params(params, media_info,
+                                               segment_duration)
+            params = params_utils.remove_option(params, '-f')
+            params.extend([
+                '-f', 'hls', '-hls_time', str(segment_duration),
+                '-hls_playlist_type', 'vod',
+                '-hls_segment_type', 'fmp4',
+                '-hls_fmp4_init_filename', '{}_init.mp4'.format(name),
+                '-hls_segment_filename',
+                os.path.join(target_dir, '{}_%05d.m4s'.format(name)),
+            ])
+            outputs.append(
+                (os.path.join(target_dir, '{}.m3u8'.format(name)), params))
+
+        progress = None
+        with closing(self.encode_multiple(source_path, outputs,
+                                          media_info=media_info)) as encoding:
+            for progress in encoding:
+                if progress.percent < 100:
+                    yield progress
+
+        self._write_master_playlist(
+            os.path.join(target_dir, 'master.m3u8'), renditions)
+        yield progress
+
+    def _get_keyframe_params(self, params, media_info, segment_duration):
+        """
+        Forces keyframes at every segment boundary. Segments end at the
+        first keyframe after `-hls_time`, so without aligned keyframes
+        their duration follows the GOP of the source and the segments of
+        the variants do not line up for switching.
+        """
+        params = params_utils.set_option(
+            params, '-force_key_frames',
+            'expr:gte(t,n_forced*{})'.format(segment_duration))
+        # no additional keyframes at scene changes
+        params = params_utils.set_option(params, '-sc_threshold', '0')
+        try:
+            frame_rate = float(params_utils.get_option(params, '-r') or
+                               media_info.get('frame_rate'))
+        except (TypeError, ValueError):
+            # e.g. `ntsc`, the forced keyframes keep the segments aligned
+            return params
+        # the GOP is never cut short before the next boundary
+        gop_size = str(int(math.ceil(frame_rate * segment_duration)))
+        params = params_utils.set_option(params, '-g', gop_size)
+        return params_utils.set_option(params, '-keyint_min', gop_size)
+
+    def _write_master_playlist(self, path, renditions):
+        target_dir = os.path.dirname(path)
+        lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-INDEPENDENT-SEGMENTS']
+        for name, params in renditions:
+            playlist = '{}.m3u8'.format(name)
+            info = self.get_media_info(os.path.join(target_dir, playlist))
+            bandwidth = sum(params_utils.parse_bitrate(
+                params_utils.get_option(params, *options)) or 0
+                for options in (('-maxrate', '-b:v'), ('-b:a',)))
+            attributes = 'BANDWIDTH={:d},RESOLUTION={:d}x{:d}'.format(
+                bandwidth or 1, info['width'], info['height'])
+
+            # players pick the variants they can decode by their codecs
+            with open(os.path.join(target_dir, '{}_init.mp4'.format(name)),
+                      'rb') as init_file:
+                codecs = headers.read_codecs(init_file)
+            if codecs:
+                attributes += ',CODECS="{}"'.format(','.join(codecs))
+            else:
+                logger.warning("Codecs of HLS variant %s are unknown.", name)
+
+            lines.append('#EXT-X-STREAM-INF:' + attributes)
+            lines.append(playlist)
+
+        with open(path, 'w') as playlist_file:
+            playlist_file.write('\n'.join(lines) + '\n')
+
+    def encode_segmented(self, source_path, target_path, params,
+                         media_info=None, segment_duration=60, workers=None):
+        """
+        Splits the video at keyframes into segments of about
+        `segment_duration` seconds, encodes the segments in parallel and
+        concatenates them without reencoding. The audio is encoded in one
+        piece while concatenating, to avoid gaps at segment boundaries.
+
+        The segments share the `threads` of the backend, e.g. the share of
+        an encode of the core budget of `EncodingScheduler`, so at most
+        that many `workers` run at once. Without `threads` they share
+        `VIDEO_ENCODING_CORE_BUDGET`.
+        """
+        if media_info is None:
+            media_info = self.get_media_info(source_path)
+        total_threads = (self.threads or
+                         settings.VIDEO_ENCODING_CORE_BUDGET or
+                         os.cpu_count() or 1)
+        workers = min(workers or os.cpu_count() or 1, total_threads)
+        threads = max(1, total_threads // workers)
+
+        temp_dir = tempfile.mkdtemp(prefix='video_encoding_')
+        try:
+            segments = self._split(source_path, temp_dir, segment_duration,
+                                   media_info['duration'])
+            yield Progress(0, None, None, None, 0)
+
+            # closing stops the segment encodes before the segments are
+            # removed
+            with closing(self._encode_segments(
+                    segments, params, threads, workers,
+                    media_info['duration'])) as encoding:
+                for progress in encoding:
+                    # concatenating takes the remaining percent
+                    yield progress._replace(percent=progress.percent * 0.99)
+
+            list_path = os.path.join(temp_dir, 'segments.txt')
+            with open(list_path, 'w') as list_file:
+                for __, segment_target, __ in segments:
+                    list_file.write("file '{}'\n".format(segment_target))
+
+            cmds = [self.ffmpeg_path, '-f', 'concat', '-safe', '0',
+                    '-i', list_path, '-i', source_path,
+                    '-map', '0:v:0', '-map', '1:a:0?']
+            cmds.extend(self.params)
+            cmds.extend(params_utils.remove_video_options(params))
+            cmds.extend(['-c:v', 'copy', target_path])
+            for progress in self._encode(cmds, media_info['duration'],
+                                         [target_path]):
+                pass
+            yield progress
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _split(self, source_path, temp_dir, segment_duration, total_time):
+        """
+        Copies the video stream of the source into segments, which start at
+        keyframes. Returns a list of `(source, target, duration)`.
+        """
+        list_path = os.path.join(temp_dir, 'split.csv')
+        cmds = [self.ffmpeg_path, '-i', source_path, '-map', '0:v:0',
+                '-c', 'copy', '-f', 'segment',
+                '-segment_time', str(segment_duration),
+                '-segment_list', list_path, '-segment_list_type', 'csv',
+                '-reset_timestamps', '1', '-y',
+                os.path.join(temp_dir, 'source_%05d.mkv')]
+        self._check_returncode(self._spawn(cmds),
+                               timeout=self._get_time_limit(total_time))
+
+        segments = []
+        with open(list_path) as list_file:
+            for row in csv.reader(list_file):
+                name, start, end = row[0], float(row[1]), float(row[2])
+                segments.append((
+                    os.path.join(temp_dir, name),
+                    os.path.join(temp_dir, 'encoded_' + name),
+                    end - start,
+                ))
+        return segments
+
+    def _encode_segments(self, segments, params, threads, workers,
+                         total_time):
+        """
+        Encodes the video of all segments in a thread pool and yields the
+        aggregated progress about once per second.
+        """
+        segment_params = params_utils.set_option(
+            self.params, '-threads', str(threads))
+        # segments are joined with the concat demuxer, use a neutral muxer
+        params = params_utils.set_option(params, '-f', 'matroska')
+        encoded = [0.0] * len(segments)
+        cancelled = threading.Event()
+
+        def encode_segment(index):
+            segment_source, segment_target, duration = segments[index]
+            cmds = [self.ffmpeg_path, '-i', segment_source]
+            cmds.extend(segment_params)
+            cmds.extend(params)
+            cmds.extend(['-an', segment_target])
+            encoding = self._encode(cmds, duration, [segment_target])
             try:
-                line, buf = buf.split('\r', 1)
-            except ValueError:
-                continue
-
+                for progress in encoding:
+                    if cancelled.is_set():
+                        break
+                    encoded[index] = duration * progress.percent / 100.0
+            finally:
+                # kills ffmpeg if the segment was cancelled
+                encoding.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(encode_segment, index)
+                       for index in range(len(segments))]
             try:
-                time_str = RE_TIMECODE.findall(line)[0]
-            except IndexError:
-                continue
-
-            # convert progress to percent
-            time = 0
-            for part in time_str.split(':'):
-                time = 60 * time + float(part)
-
-            percent = time / total_time
-            logger.debug('yield {}%'.format(percent))
-            yield percent
-
-        if os.path.getsize(target_path) == 0:
-            raise exceptions.FFmpegError("File size of generated file is 0")
-
-        # wait for process to exit
-        self._check_returncode(process)
-
-        logger.debug(output)
-        if not output:
-            raise exceptions.FFmpegError("No output from FFmpeg.")
+                pending = futures
+                while pending:
+                    __, pending = wait(pending, timeout=1,
+                                       return_when=FIRST_EXCEPTION)
+                    for future in futures:
+                        if future.done() and future.exception():
+                            raise future.exception()
+                    out_time = sum(encoded)
+                    percent = 0
+                    if total_time:
+                        percent = min(100.0, 100.0 * out_time / total_time)
+                    yield Progress(percent, None, None, None, out_time)
+            finally:
+                cancelled.set()
+
+    def _encode(self, cmds, total_time, target_paths):
+        # machine readable progress is written to stdout, stderr is only
+        # kept for error reporting
+        cmds = cmds[:1] + ['-nostats', '-progress', 'pipe:1'] + cmds[1:]
+        process = self._spawn(cmds)
+        stderr = StderrCollector(process.stderr)
+        stderr.start()
+        watchdog = Watchdog(
+            process, stall_timeout=settings.VIDEO_ENCODING_STALL_TIMEOUT,
+            time_limit=self._get_time_limit(total_time))
+        watchdog.start()
+
+        progress = None
+        try:
+            for progress in self._iter_progress(process.stdout, total_time):
+                watchdog.update(progress.out_time)
+                logger.debug('yield {:.1f}%'.format(progress.percent))
+                yield progress
+        except BaseException:
+            # also stops ffmpeg if the generator is closed early
+            process.kill()
+            raise
+        finally:
+            process.wait()
+            watchdog.stop()
+            process.stdout.close()
+            stderr.join()
+
+        self._check_encode_result(process.args, process.returncode,
+                                  watchdog.error, stderr.get_output(),
+                                  target_paths)
+
+        if progress is None:
+            progress = Progress(None, None, None, None, None)
+        yield progress._replace(percent=100, out_time=total_time)
+
+    def _check_encode_result(self, args, returncode, watchdog_error,
+                             stderr_output, target_paths):
+        if watchdog_error is not None:
+            raise exceptions.FFmpegTimeoutError("`{}` {}: {}".format(
+                ' '.join(args), watchdog_error, stderr_output))
+
+        if returncode != 0:
+            raise exceptions.FFmpegError(
+                "`{}` exited with code {:d}: {}".format(
+                    ' '.join(args), returncode, stderr_output))
+
+        for target_path in target_paths:
+            if os.path.getsize(target_path) == 0:
+                raise exceptions.FFmpegError(
+                    "File size of generated file is 0")
+
+        logger.debug(stderr_output)
+
+    def _iter_progress(self, stream, total_time):
+        """
+        Parses the key value blocks written by `-progress` and yields a
+        `Progress` at the end of each block.
+        """
+        values = {}
+        for line in stream:
+            progress = self._parse_progress_line(line, values, total_time)
+            if progress is not None:
+                yield progress
 
-        yield 100
+    def _parse_progress_line(self, line, values, total_time):
+        """
+        Collects a line of a `-progress` block in `values` and returns a
+        `Progress` at the end of the block.
+        """
+        key, sep, value = line.partition(b'=')
+        if not sep:
+            return None
+        key = key.strip().decode('ascii', 'replace')
+        value = value.strip().decode('ascii', 'replace')
+        if key != 'progress':
+            values[key] = value
+            return None
+
+        out_time = _parse_number(
+            values.get('out_time_us', values.get('out_time_ms')))
+        if out_time is not None:
+            out_time /= 1000000.0
+        percent = 0
+        if out_time and total_time:
+            percent = min(100.0, max(0.0, 100.0 * out_time / total_time))
+
+        progress = Progress(
+            percent=percent,
+            frame=_parse_number(values.get('frame'), int),
+            fps=_parse_number(values.get('fps')),
+            speed=_parse_number(values.get('speed', '').rstrip('x')),
+            out_time=out_time,
+        )
+        values.clear()
+        return progress
 
     def _parse_media_info(self, data):
         media_info = json.loads(data)
@@ -152,46 +809,209 @@ class FFmpegBackend(BaseEncodingBackend):
         """
         Returns information about the given video as dict.
         """
+        with metrics.timer('probe'):
+            process = self._spawn(self._get_probe_cmds(video_path))
+            stdout, __ = self._check_returncode(
+                process, timeout=settings.VIDEO_ENCODING_PROBE_TIMEOUT)
+        return self._make_media_info(stdout)
+
+    def _get_probe_cmds(self, video_path):
         cmds = [self.ffprobe_path, '-i', video_path]
         cmds.extend(['-print_format', 'json'])
         cmds.extend(['-show_format', '-show_streams'])
+        return cmds
 
-        process = self._spawn(cmds)
-        stdout, __ = self._check_returncode(process)
-
+    def _make_media_info(self, stdout):
         media_info = self._parse_media_info(stdout)
+        video = media_info['video'][0]
+        audio = media_info['audio'][0] if media_info['audio'] else {}
+        bit_rate = media_info['format'].get('bit_rate')
 
         return {
             'duration': float(media_info['format']['duration']),
-            'width': int(media_info['video'][0]['width']),
-            'height': int(media_info['video'][0]['height']),
+            'width': int(video['width']),
+            'height': int(video['height']),
+            'video_codec': video.get('codec_name'),
+            'audio_codec': audio.get('codec_name'),
+            'frame_rate': self._parse_frame_rate(
+                video.get('avg_frame_rate') or video.get('r_frame_rate')),
+            'bit_rate': int(bit_rate) if bit_rate else None,
+            'pix_fmt': video.get('pix_fmt'),
+            'has_audio': bool(audio),
         }
 
-    def get_thumbnail(self, video_path, at_time=0.5):
+    def _parse_frame_rate(self, value):
+        # ffprobe reports rates as fraction, e.g. `30000/1001`
+        try:
+            numerator, denominator = value.split('/')
+            return float(numerator) / float(denominator)
+        except (AttributeError, ValueError, ZeroDivisionError):
+            return None
+
+    def get_thumbnail(self, video_path, at_time=0.5, media_info=None):
         """
         Extracts an image of a video and returns its path.
 
         If the requested thumbnail is not within the duration of the video
         an `InvalidTimeError` is thrown.
         """
-        filename = os.path.basename(video_path)
-        filename, __ = os.path.splitext(filename)
-        _, image_path = tempfile.mkstemp(suffix='_{}.jpg'.format(filename))
-
-        video_duration = self.get_media_info(video_path)['duration']
+        if media_info is None:
+            media_info = self.get_media_info(video_path)
+        video_duration = media_info['duration']
         if at_time > video_duration:
             raise exceptions.InvalidTimeError()
-        thumbnail_time = at_time
 
-        cmds = [self.ffmpeg_path, '-i', video_path, '-vframes', '1']
-        cmds.extend(['-ss', str(thumbnail_time), '-y', image_path])
+        return self.get_thumbnails(video_path, times=[at_time],
+                                   media_info=media_info)[0]
 
-        process = self._spawn(cmds)
-        self._check_returncode(process)
+    def get_thumbnails(self, video_path, count=10, times=None,
+                       media_info=None):
+        """
+        Extracts `count` evenly spaced images, or the images at `times`,
+        with a single ffmpeg process and returns their paths.
 
-        if not os.path.getsize(image_path):
-            # we somehow failed to generate thumbnail
-            os.unlink(image_path)
+        Every image has its own input which seeks to the image before
+        decoding, so only a few frames are decoded per image.
+        """
+        if media_info is None:
+            media_info = self.get_media_info(video_path)
+        duration = media_info['duration']
+        if times is None:
+            times = [duration * (index + 0.5) / count
+                     for index in range(count)]
+        if any(at_time > duration for at_time in times):
             raise exceptions.InvalidTimeError()
 
-        return image_path
+        cmds, image_paths = self._get_thumbnail_cmds(video_path, times)
+        try:
+            with metrics.timer('thumbnail', count=len(times)):
+                self._check_returncode(self._spawn(cmds),
+                                       timeout=self._get_time_limit(None))
+            self._check_thumbnails(image_paths)
+        except exceptions.VideoEncodingError:
+            for image_path in image_paths:
+                os.unlink(image_path)
+            raise
+
+        return image_paths
+
+    def _get_thumbnail_cmds(self, video_path, times):
+        """
+        Returns the command extracting the images at `times` and the paths
+        of the images.
+        """
+        filename = os.path.basename(video_path)
+        filename, __ = os.path.splitext(filename)
+
+        cmds = [self.ffmpeg_path, '-y']
+        for at_time in times:
+            cmds.extend(['-ss', '{:.3f}'.format(at_time), '-i', video_path])
+        image_paths = []
+        for index in range(len(times)):
+            fd, image_path = tempfile.mkstemp(
+                suffix='_{}_{:d}.jpg'.format(filename, index))
+            os.close(fd)
+            image_paths.append(image_path)
+            cmds.extend(['-map', '{:d}:v:0'.format(index),
+                         '-frames:v', '1', image_path])
+        return cmds, image_paths
+
+    def _check_thumbnails(self, image_paths):
+        if not all(os.path.getsize(path) for path in image_paths):
+            # we somehow failed to generate a thumbnail
+            raise exceptions.InvalidTimeError()
+
+    def get_storyboard(self, video_path, interval=10, width=160, columns=10,
+                       rows=10, media_info=None):
+        """
+        Extracts an image every `interval` seconds, seeking to each one
+        like `get_thumbnails` instead of decoding the whole video, and
+        tiles them into sprites of `columns` x `rows` images. Returns the
+        sprite paths and the path of a WebVTT file which maps each interval
+        to its area in a sprite, as used by players for scrubbing previews.
+
+        All files are in one temporary directory.
+        """
+        if media_info is None:
+            media_info = self.get_media_info(video_path)
+        duration = media_info['duration']
+        # tiles need a fixed size, most encoders require even dimensions
+        aspect = media_info['height'] / float(media_info['width'])
+        height = max(2, int(round(width * aspect / 2)) * 2)
+
+        count = int(math.ceil(duration / interval))
+        # the image of each interval is taken at its start, seeks close to
+        # the end of the video may not find a frame
+        times = [min(index * interval, max(0, duration - 1))
+                 for index in range(count)]
+
+        target_dir = tempfile.mkdtemp(prefix='video_encoding_')
+        frames_dir = os.path.join(target_dir, 'frames')
+        os.mkdir(frames_dir)
+        frame_pattern = os.path.join(frames_dir, 'frame_%05d.jpg')
+        try:
+            with metrics.timer('storyboard'):
+                for start in range(0, count, STORYBOARD_BATCH_SIZE):
+                    self._extract_storyboard_frames(
+                        video_path, times[start:start + STORYBOARD_BATCH_SIZE],
+                        start, frame_pattern, width, height)
+                cmds = [self.ffmpeg_path, '-y', '-i', frame_pattern,
+                        '-vf', 'tile={:d}x{:d}'.format(columns, rows),
+                        os.path.join(target_dir, 'sprite_%03d.jpg')]
+                self._check_returncode(self._spawn(cmds),
+                                       timeout=self._get_time_limit(None))
+            sprite_paths = sorted(os.path.join(target_dir, name)
+                                  for name in os.listdir(target_dir)
+                                  if name.startswith('sprite_'))
+            if not sprite_paths:
+                raise exceptions.FFmpegError(
+                    "`{}` produced no sprite.".format(' '.join(cmds)))
+        except exceptions.VideoEncodingError:
+            shutil.rmtree(target_dir, ignore_errors=True)
+            raise
+        finally:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+
+        lines = ['WEBVTT', '']
+        per_sprite = columns * rows
+        for index in range(min(count, per_sprite * len(sprite_paths))):
+            sprite = os.path.basename(sprite_paths[index // per_sprite])
+            column, row = index % columns, index % per_sprite // columns
+            lines.extend([
+                '{} --> {}'.format(
+                    _format_timestamp(index * interval),
+                    _format_timestamp(min(duration, (index + 1) * interval))),
+                '{}#xywh={:d},{:d},{:d},{:d}'.format(
+                    sprite, column * width, row * height, width, height),
+                '',
+            ])
+
+        vtt_path = os.path.join(target_dir, 'storyboard.vtt')
+        with open(vtt_path, 'w') as vtt_file:
+            vtt_file.write('\n'.join(lines))
+
+        return sprite_paths, vtt_path
+
+    def _extract_storyboard_frames(self, video_path, times, first_index,
+                                   frame_pattern, width, height):
+        """
+        Extracts the scaled images at `times` with one process. Every image
+        has its own input which seeks to the image before decoding.
+        """
+        cmds = [self.ffmpeg_path, '-y']
+        for at_time in times:
+            cmds.extend(['-ss', '{:.3f}'.format(at_time), '-i', video_path])
+        frame_paths = []
+        for index in range(len(times)):
+            frame_path = frame_pattern % (first_index + index)
+            frame_paths.append(frame_path)
+            cmds.extend(['-map', '{:d}:v:0'.format(index), '-frames:v', '1',
+                         '-vf', 'scale={:d}:{:d}'.format(width, height),
+                         '-q:v', '2', frame_path])
+        self._check_returncode(self._spawn(cmds),
+                               timeout=self._get_time_limit(None))
+        # the tiles are read as a sequence, which ends at a missing image
+        if not all(os.path.exists(path) and os.path.getsize(path)
+                   for path in frame_paths):
+            raise exceptions.FFmpegError(
+                "`{}` produced no image.".format(' '.join(cmds)))
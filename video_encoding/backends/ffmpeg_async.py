@@ -0,0 +1,173 @@
+import asyncio
+import os
+from collections import deque
+from subprocess import DEVNULL, PIPE
+
+import six
+
+from .. import exceptions, metrics
+from ..config import settings
+from .base import Progress
+from .ffmpeg import (
+    STDERR_MAX_LINES, FFmpegBackend, Watchdog, console_encoding,
+)
+
+# maximum length of a line read from ffmpeg
+STREAM_LIMIT = 1024 * 1024
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except ProcessLookupError:
+        # already exited
+        pass
+
+
+class AsyncFFmpegBackend(FFmpegBackend):
+    """
+    Adds asyncio variants of `encode`, `get_media_info` and
+    `get_thumbnail`, which run ffmpeg and ffprobe as asyncio subprocesses,
+    so one event loop can supervise many of them. The blocking methods of
+    `FFmpegBackend` remain available.
+
+    Cancelling the task awaiting a coroutine, or closing `async_encode`
+    before it is exhausted, kills the process.
+    """
+
+    async def _async_spawn(self, cmds):
+        metrics.increment('subprocesses', binary=os.path.basename(cmds[0]))
+        try:
+            return await asyncio.create_subprocess_exec(
+                *(self.command_prefix + cmds),
+                stdin=DEVNULL, stdout=PIPE, stderr=PIPE,
+                limit=STREAM_LIMIT,
+            )
+        except OSError as e:
+            raise six.raise_from(
+                exceptions.FFmpegError('Error while running ffmpeg binary'), e)
+
+    async def _async_check_returncode(self, process, cmds, timeout=None):
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(),
+                                                    timeout)
+        except asyncio.TimeoutError:
+            _kill(process)
+            await process.wait()
+            raise exceptions.FFmpegTimeoutError(
+                "`{}` exceeded the time limit of {:.0f}s".format(
+                    ' '.join(cmds), timeout))
+        except BaseException:
+            # e.g. the task was cancelled
+            _kill(process)
+            raise
+        if process.returncode != 0:
+            raise exceptions.FFmpegError("`{}` exited with code {:d}".format(
+                ' '.join(cmds), process.returncode))
+        return (stdout.decode(console_encoding),
+                stderr.decode(console_encoding))
+
+    async def async_encode(self, source_path, target_path, params,
+                           media_info=None):
+        """
+        Like `encode`, but an asynchronous iterator of `Progress`.
+        """
+        if media_info is None:
+            media_info = await self.async_get_media_info(source_path)
+        cmds = self._get_encode_cmds(source_path, target_path, params,
+                                     media_info)
+        encoding = self._async_encode(cmds, media_info['duration'],
+                                      [target_path])
+        try:
+            async for progress in encoding:
+                yield progress
+        finally:
+            await encoding.aclose()
+
+    async def _async_encode(self, cmds, total_time, target_paths):
+        cmds = cmds[:1] + ['-nostats', '-progress', 'pipe:1'] + cmds[1:]
+        process = await self._async_spawn(cmds)
+        stderr = deque(maxlen=STDERR_MAX_LINES)
+        collector = asyncio.ensure_future(
+            self._collect_lines(process.stderr, stderr))
+        # the thread of the watchdog is not started, it is checked by a task
+        watchdog = Watchdog(
+            process, stall_timeout=settings.VIDEO_ENCODING_STALL_TIMEOUT,
+            time_limit=self._get_time_limit(total_time))
+        watcher = asyncio.ensure_future(self._watch(process, watchdog))
+
+        progress = None
+        values = {}
+        try:
+            async for line in process.stdout:
+                parsed = self._parse_progress_line(line, values, total_time)
+                if parsed is None:
+                    continue
+                progress = parsed
+                watchdog.update(progress.out_time)
+                yield progress
+        except BaseException:
+            # also stops ffmpeg if the iteration is cancelled or closed
+            _kill(process)
+            raise
+        finally:
+            await process.wait()
+            watcher.cancel()
+            await collector
+
+        self._check_encode_result(
+            cmds, process.returncode, watchdog.error,
+            b''.join(stderr).decode(console_encoding, 'replace'),
+            target_paths)
+
+        if progress is None:
+            progress = Progress(None, None, None, None, None)
+        yield progress._replace(percent=100, out_time=total_time)
+
+    async def _collect_lines(self, stream, lines):
+        async for line in stream:
+            lines.append(line)
+
+    async def _watch(self, process, watchdog):
+        while process.returncode is None:
+            await asyncio.sleep(1)
+            watchdog.error = watchdog.check()
+            if watchdog.error is not None:
+                _kill(process)
+                return
+
+    async def async_get_media_info(self, video_path):
+        """
+        Like `get_media_info`.
+        """
+        cmds = self._get_probe_cmds(video_path)
+        with metrics.timer('probe'):
+            process = await self._async_spawn(cmds)
+            stdout, __ = await self._async_check_returncode(
+                process, cmds, timeout=settings.VIDEO_ENCODING_PROBE_TIMEOUT)
+        return self._make_media_info(stdout)
+
+    async def async_get_thumbnail(self, video_path, at_time=0.5,
+                                  media_info=None):
+        """
+        Like `get_thumbnail`.
+        """
+        if media_info is None:
+            media_info = await self.async_get_media_info(video_path)
+        if at_time > media_info['duration']:
+            raise exceptions.InvalidTimeError()
+
+        cmds, image_paths = self._get_thumbnail_cmds(video_path, [at_time])
+        try:
+            with metrics.timer('thumbnail', count=1):
+                process = await self._async_spawn(cmds)
+                await self._async_check_returncode(
+                    process, cmds, timeout=self._get_time_limit(None))
+            self._check_thumbnails(image_paths)
+        except BaseException:
+            # also when cancelled
+            for image_path in image_paths:
+                os.unlink(image_path)
+            raise
+
+        return image_paths[0]
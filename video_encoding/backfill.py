@@ -0,0 +1,166 @@
+"""
+Fills the dimension fields (`width_field`, `height_field` and
+`duration_field`) of video fields of existing rows, e.g. `Format.width`,
+`Format.height` and `Format.duration`.
+
+Rows are processed in primary key order and in chunks. Only primary keys
+and file names are fetched, as loading model instances would probe the
+files of `ImageField` subclasses right away. The files of a chunk are
+probed concurrently and the results are written with a single
+`bulk_update` per chunk, without calling `save()` or sending signals.
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.db.models import Q
+
+from .fields import VideoField
+
+logger = logging.getLogger(__name__)
+
+# media info keys of the dimension field attributes of `VideoField`
+DIMENSION_FIELDS = (
+    ('width_field', 'width'),
+    ('height_field', 'height'),
+    ('duration_field', 'duration'),
+)
+
+
+def get_dimension_fields(field):
+    """
+    Returns `(model field name, media info key)` of all dimension fields of
+    a video field.
+    """
+    return [(getattr(field, attribute), key)
+            for attribute, key in DIMENSION_FIELDS
+            if getattr(field, attribute, None)]
+
+
+def get_video_fields(model):
+    return [field for field in model._meta.fields
+            if isinstance(field, VideoField) and get_dimension_fields(field)]
+
+
+def get_video_models():
+    """
+    Returns all models with video fields which have dimension fields.
+    """
+    return [model for model in apps.get_models() if get_video_fields(model)]
+
+
+class Checkpoint:
+    """
+    Remembers the last processed primary key of each model in a JSON file,
+    so an interrupted backfill continues where it stopped.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.positions = {}
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.positions = json.load(checkpoint_file)
+
+    def get(self, model):
+        return self.positions.get(model._meta.label)
+
+    def set(self, model, pk):
+        self.positions[model._meta.label] = pk
+        if not self.path:
+            return
+        # replace the file atomically, it is read after crashes
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(self.positions, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+
+def _probe(field, name):
+    # staged and cached like any other access of the video properties
+    fieldfile = field.attr_class(None, field, name)
+    return fieldfile._get_video_info()
+
+
+def backfill_model(model, chunk_size=500, workers=8, force=False,
+                   checkpoint=None, callback=None):
+    """
+    Probes the videos of all rows of `model` whose dimension fields are
+    empty, or of all rows with `force`, and writes their dimensions.
+
+    `callback` is called with the statistics after each chunk. Returns the
+    statistics of the whole model.
+    """
+    checkpoint = checkpoint or Checkpoint()
+    fields = get_video_fields(model)
+    update_fields = [name for field in fields
+                     for name, __ in get_dimension_fields(field)]
+
+    queryset = model._default_manager.order_by('pk')
+    if not force:
+        queryset = queryset.filter(Q(*[
+            ('{}__isnull'.format(name), True) for name in update_fields
+        ], _connector=Q.OR))
+
+    stats = {'model': model._meta.label, 'rows': 0, 'probed': 0,
+             'updated': 0, 'failed': 0, 'last_pk': checkpoint.get(model),
+             'seconds': 0.0}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix='video_encoding_backfill'
+                            ) as executor:
+        while True:
+            chunk = queryset
+            if stats['last_pk'] is not None:
+                chunk = chunk.filter(pk__gt=stats['last_pk'])
+            rows = list(chunk.values_list(
+                'pk', *[field.attname for field in fields])[:chunk_size])
+            if not rows:
+                break
+
+            probes = []
+            for row in rows:
+                for field, name in zip(fields, row[1:]):
+                    if name:
+                        probes.append((row[0], field, executor.submit(
+                            _probe, field, name)))
+
+            updated = {}
+            for pk, field, future in probes:
+                stats['probed'] += 1
+                try:
+                    media_info = future.result()
+                except Exception as e:
+                    # e.g. missing files
+                    stats['failed'] += 1
+                    logger.warning("Probing %s of %s %s failed: %s",
+                                   field.name, model._meta.label, pk, e)
+                    continue
+                # instances without files do not probe on initialization
+                instance, names = updated.setdefault(pk, (model(pk=pk), []))
+                for name, key in get_dimension_fields(field):
+                    setattr(instance, name, media_info.get(key))
+                    names.append(name)
+
+            # only the probed fields are written, the instances lack the
+            # values of the others
+            groups = {}
+            for instance, names in updated.values():
+                groups.setdefault(tuple(names), []).append(instance)
+            for names, instances in groups.items():
+                model._default_manager.bulk_update(instances, names)
+
+            stats['rows'] += len(rows)
+            stats['updated'] += len(updated)
+            stats['last_pk'] = rows[-1][0]
+            stats['seconds'] = time.monotonic() - started
+            checkpoint.set(model, stats['last_pk'])
+            if callback is not None:
+                callback(stats)
+
+    stats['seconds'] = time.monotonic() - started
+    return stats
@@ -0,0 +1,168 @@
+"""
+Benchmarks the configured formats on synthetic sources, e.g. to compare
+changes of `VIDEO_ENCODING_FORMATS` before rolling them out.
+
+Sources are generated with the `lavfi` test sources of ffmpeg, so they are
+identical between runs. They are encoded with MPEG-4 Part 2 and PCM audio,
+which no format produces, so every format is actually encoded instead of
+remuxed.
+
+Each encode runs in a forked process, whose child usage covers exactly the
+ffmpeg processes of that encode. Only available on Unix.
+"""
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .backends import get_backend
+from .config import settings
+from .planning import plan_formats
+
+DEFAULT_SOURCES = [
+    {'name': '360p_10s', 'width': 640, 'height': 360, 'duration': 10},
+    {'name': '720p_10s', 'width': 1280, 'height': 720, 'duration': 10},
+    {'name': '1080p_30s', 'width': 1920, 'height': 1080, 'duration': 30},
+]
+
+
+def make_source(backend, target_dir, name, width, height, duration,
+                frame_rate=30):
+    """
+    Generates a test video and returns its path.
+    """
+    path = os.path.join(target_dir, '{}.mkv'.format(name))
+    cmds = [
+        backend.ffmpeg_path, '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=size={:d}x{:d}:rate={}:duration={}'
+        .format(width, height, frame_rate, duration),
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000:'
+        'duration={}'.format(duration),
+        '-c:v', 'mpeg4', '-q:v', '2', '-pix_fmt', 'yuv420p',
+        '-c:a', 'pcm_s16le',
+        # no encoder versions or dates in the file
+        '-fflags', '+bitexact', '-flags', '+bitexact', '-map_metadata', '-1',
+        path,
+    ]
+    backend._check_returncode(backend._spawn(cmds),
+                              timeout=backend._get_time_limit(duration))
+    return path
+
+
+def get_ffmpeg_version(backend):
+    process = backend._spawn([backend.ffmpeg_path, '-version'])
+    stdout, __ = backend._check_returncode(
+        process, timeout=settings.VIDEO_ENCODING_PROBE_TIMEOUT)
+    return stdout.splitlines()[0] if stdout else None
+
+
+def _encode(source_path, target_path, options, media_info):
+    """
+    Encodes a format in a forked process and returns its wall time, the
+    CPU time and the peak memory of ffmpeg.
+    """
+    backend = get_backend()
+    started = time.monotonic()
+    if (options.get('segmented', False) and media_info['duration'] >=
+            settings.VIDEO_ENCODING_SEGMENT_MIN_DURATION):
+        encoding = backend.encode_segmented(
+            source_path, target_path, options['params'],
+            media_info=media_info,
+            segment_duration=settings.VIDEO_ENCODING_SEGMENT_DURATION,
+            workers=settings.VIDEO_ENCODING_SEGMENT_WORKERS)
+    else:
+        encoding = backend.encode(source_path, target_path,
+                                  options['params'], media_info=media_info)
+    for __ in encoding:
+        pass
+    wall_time = time.monotonic() - started
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # kilobytes on Linux, bytes on macOS
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return wall_time, usage.ru_utime + usage.ru_stime, peak_rss
+
+
+def benchmark_format(source_path, options, media_info, repeat=1):
+    """
+    Encodes a source `repeat` times into the given format and returns the
+    median wall and CPU times and the largest peak memory.
+    """
+    target_dir = tempfile.mkdtemp(prefix='video_encoding_')
+    target_path = os.path.join(target_dir, 'benchmark.{}'.format(
+        options['extension']))
+    runs = []
+    try:
+        for __ in range(repeat):
+            # a fresh process per run, child usage is not reset otherwise
+            with ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context('fork'),
+            ) as executor:
+                runs.append(executor.submit(
+                    _encode, source_path, target_path, options,
+                    media_info).result())
+        output_size = os.path.getsize(target_path)
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+
+    wall_time = statistics.median(run[0] for run in runs)
+    return {
+        'wall_time': round(wall_time, 3),
+        'realtime_factor': round(media_info['duration'] / wall_time, 3),
+        'cpu_time': round(statistics.median(run[1] for run in runs), 3),
+        'peak_rss': max(run[2] for run in runs),
+        'output_size': output_size,
+    }
+
+
+def run_benchmark(sources=None, formats=None, repeat=1, stdout=None):
+    """
+    Benchmarks all configured formats, or the ones named in `formats`, on
+    all `sources` and returns a JSON serializable report.
+    """
+    backend = get_backend()
+    sources = sources or DEFAULT_SOURCES
+    configured = [
+        options for options in
+        settings.VIDEO_ENCODING_FORMATS[backend.name]
+        # HLS formats consist of other formats
+        if 'params' in options and (formats is None or
+                                    options['name'] in formats)]
+
+    results = []
+    source_dir = tempfile.mkdtemp(prefix='video_encoding_')
+    try:
+        for source in sources:
+            source_path = make_source(backend, source_dir, **source)
+            media_info = backend.get_media_info(source_path)
+            planned = configured
+            if settings.VIDEO_ENCODING_PLAN_FORMATS:
+                planned = plan_formats(configured, media_info)
+
+            for options in planned:
+                if stdout is not None:
+                    stdout.write("Encoding {} to {}.".format(
+                        source['name'], options['name']))
+                result = benchmark_format(source_path, options, media_info,
+                                          repeat=repeat)
+                # planned params show what was actually encoded
+                results.append(dict(
+                    result, source=source['name'], format=options['name'],
+                    params=options['params']))
+    finally:
+        shutil.rmtree(source_dir, ignore_errors=True)
+
+    return {
+        'backend': backend.name,
+        'ffmpeg': get_ffmpeg_version(backend),
+        'cpu_count': os.cpu_count(),
+        'repeat': repeat,
+        'sources': sources,
+        'results': results,
+    }
@@ -0,0 +1,127 @@
+import hashlib
+
+from django.core.cache import caches
+
+from .config import settings
+
+KEY_PREFIX = 'video_encoding:media_info:'
+# attributes which locate the files of a storage, e.g. the directory of
+# `FileSystemStorage` or the bucket and prefix of django-storages
+STORAGE_LOCATION_ATTRIBUTES = ('location', 'bucket_name', 'azure_container')
+
+
+def get_cache():
+    """
+    Returns the cache used to share media info between processes or `None`
+    if caching is disabled.
+    """
+    alias = settings.VIDEO_ENCODING_INFO_CACHE
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def make_key(*parts):
+    value = '\0'.join(str(part) for part in parts)
+    return KEY_PREFIX + hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def get_fieldfile_key(fieldfile):
+    """
+    Returns the key of a file, which includes the location of its storage,
+    so storages of the same class keep apart.
+    """
+    storage = fieldfile.storage
+    return make_key('storage', storage.__class__.__module__,
+                    storage.__class__.__name__,
+                    *[getattr(storage, name, None)
+                      for name in STORAGE_LOCATION_ATTRIBUTES],
+                    fieldfile.name)
+
+
+def get_fieldfile_fingerprint(fieldfile):
+    return get_storage_fingerprint(fieldfile.storage, fieldfile.name)
+
+
+def get_storage_fingerprint(storage, name):
+    size = storage.size(name)
+    try:
+        modified_time = storage.get_modified_time(name).timestamp()
+    except (NotImplementedError, AttributeError):
+        modified_time = None
+    return [size, modified_time]
+
+
+def get_media_info(key, fingerprint, probe):
+    """
+    Returns the cached media info stored under `key` as long as the
+    fingerprint of the file did not change, otherwise calls `probe` and
+    caches its result.
+
+    Eviction is left to the configured cache backend, i.e. `TIMEOUT`
+    for expiry and `MAX_ENTRIES` for LRU culling.
+    """
+    cache = get_cache()
+    if cache is None:
+        return probe()
+
+    cached = cache.get(key)
+    if cached is not None and cached['fingerprint'] == fingerprint:
+        return cached['info']
+
+    info = probe()
+    set_media_info(key, fingerprint, info)
+    return info
+
+
+def set_media_info(key, fingerprint, info):
+    cache = get_cache()
+    if cache is None:
+        return
+    cache.set(key, {'fingerprint': fingerprint, 'info': info},
+              settings.VIDEO_ENCODING_INFO_CACHE_TIMEOUT)
+
+
+def invalidate(key):
+    cache = get_cache()
+    if cache is not None:
+        cache.delete(key)
+
+
+def get_fieldfile_media_info(fieldfile, probe):
+    return get_media_info(get_fieldfile_key(fieldfile),
+                          get_fieldfile_fingerprint(fieldfile), probe)
+
+
+def get_fieldfile_complexity(fieldfile, probe):
+    key = make_key('complexity', get_fieldfile_key(fieldfile))
+    return get_media_info(key, get_fieldfile_fingerprint(fieldfile), probe)
+
+
+def get_fieldfile_content_hash(fieldfile, compute):
+    key = make_key('content_hash', get_fieldfile_key(fieldfile))
+    return get_media_info(key, get_fieldfile_fingerprint(fieldfile), compute)
+
+
+def get_fieldfile_headers(fieldfile, read):
+    """
+    Returns the probed media info of the file if it is cached, otherwise
+    the info `read` from its headers, which is cached on its own as it
+    lacks e.g. the codecs.
+    """
+    cache = get_cache()
+    if cache is None:
+        return read()
+
+    key = get_fieldfile_key(fieldfile)
+    fingerprint = get_fieldfile_fingerprint(fieldfile)
+    cached = cache.get(key)
+    if cached is not None and cached['fingerprint'] == fingerprint:
+        return cached['info']
+    return get_media_info(make_key('headers', key), fingerprint, read)
+
+
+def invalidate_fieldfile(fieldfile):
+    key = get_fieldfile_key(fieldfile)
+    invalidate(key)
+    invalidate(make_key('headers', key))
@@ -4,9 +4,93 @@ from django.conf import settings  # NOQA
 
 class VideoEncodingAppConf(AppConf):
     THREADS = 1
+    # progress is written at most every `PROGRESS_UPDATE` seconds unless it
+    # advanced by at least `PROGRESS_UPDATE_DELTA` percent
     PROGRESS_UPDATE = 30
+    PROGRESS_UPDATE_DELTA = 5
+    # skip or clamp formats above the resolution, frame rate or bitrate of
+    # the source, see `video_encoding.planning`
+    PLAN_FORMATS = True
+    # copy the streams of sources which already match a format
+    REMUX = True
+    # reuse outputs of sources with identical content and format params,
+    # requires hashing every source. Each format gets a copy of the output,
+    # which is a hard link on the same filesystem
+    DEDUPLICATE = False
+    # number of encodes run concurrently, they share `CORE_BUDGET` cores
+    PARALLEL_ENCODES = 1
+    CORE_BUDGET = None  # defaults to the number of cores
+    # formats with `'segmented': True` are split into segments of
+    # `SEGMENT_DURATION` seconds which are encoded by `SEGMENT_WORKERS`
+    # processes, sources shorter than `SEGMENT_MIN_DURATION` are encoded
+    # at once. The workers are limited to the share of `CORE_BUDGET` of the
+    # encode
+    SEGMENT_DURATION = 60
+    SEGMENT_MIN_DURATION = 300
+    SEGMENT_WORKERS = None  # defaults to the number of cores
+    # formats with `'kind': 'hls'` produce a HLS master playlist for their
+    # `renditions`, given as names of other formats or as dicts with `name`
+    # and `params`
+    HLS_SEGMENT_DURATION = 6
+    # scale the bitrates of all formats to the complexity of the source,
+    # which is estimated by encoding `CONTENT_AWARE_SAMPLES` parts of
+    # `CONTENT_AWARE_SAMPLE_DURATION` seconds at a low resolution. Sources
+    # with `CONTENT_AWARE_REFERENCE` bits per pixel keep the configured
+    # bitrates, the factor is limited to `CONTENT_AWARE_MIN_FACTOR` and
+    # `CONTENT_AWARE_MAX_FACTOR`
+    CONTENT_AWARE = False
+    CONTENT_AWARE_SAMPLES = 5
+    CONTENT_AWARE_SAMPLE_DURATION = 2
+    CONTENT_AWARE_REFERENCE = 0.1
+    CONTENT_AWARE_MIN_FACTOR = 0.3
+    CONTENT_AWARE_MAX_FACTOR = 1.0
+    # encode all formats of a video with one ffmpeg process
+    SINGLE_DECODE = False
+    # ffmpeg is killed if its position does not advance for `STALL_TIMEOUT`
+    # seconds or if it runs longer than `TIMEOUT_FACTOR` times the duration
+    # of the video, but at least `TIMEOUT_MIN` seconds. ffprobe is killed
+    # after `PROBE_TIMEOUT` seconds, `None` disables a limit
+    STALL_TIMEOUT = 300
+    TIMEOUT_FACTOR = 20
+    TIMEOUT_MIN = 600
+    PROBE_TIMEOUT = 60
+    # job queue used by the `encode_videos` worker command (seconds)
+    QUEUE_LEASE_TIME = 300
+    QUEUE_POLL_INTERVAL = 5
+    QUEUE_MAX_ATTEMPTS = 5
+    QUEUE_RETRY_DELAY = 60
+    # cancel running jobs of lower priority when a queued job has a higher
+    # priority, they are queued again
+    QUEUE_PREEMPT = True
+    # running conversions check every `CANCEL_CHECK_INTERVAL` seconds
+    # whether their source was deleted or replaced
+    CANCEL_CHECK_INTERVAL = 10
     BACKEND = 'video_encoding.backends.ffmpeg.FFmpegBackend'
+    # keyword arguments of the backend, e.g. `nice`, `ionice`,
+    # `cpu_affinity` and `memory_limit` of `FFmpegBackend`
     BACKEND_PARAMS = {}
+    # videos of storages without local paths are downloaded in chunks of
+    # `STAGING_CHUNK_SIZE` bytes to `STAGING_DIR`
+    STAGING_CHUNK_SIZE = 8 * 1024 * 1024
+    STAGING_DIR = None  # defaults to the temp directory
+    # encoded files are hard linked into storages on the same filesystem,
+    # otherwise they are streamed in chunks by `UPLOAD_WORKERS` threads
+    UPLOAD_LINK = True
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    UPLOAD_WORKERS = 4
+    # hook receiving timings and counters of all stages, see
+    # `video_encoding.metrics`, `None` disables it
+    METRICS = 'video_encoding.metrics.LoggingMetrics'
+    # read width, height and duration of `VideoFile` properties from the
+    # MP4 or Matroska headers instead of probing, see `video_encoding.headers`.
+    # Only done for storages with local paths and for the storage classes in
+    # `HEADER_PROBE_STORAGES`, whose files have to read ranges on seeks
+    # instead of downloading the whole file
+    HEADER_PROBE = True
+    HEADER_PROBE_STORAGES = []
+    # cache alias used to share probed media info, `None` disables it
+    INFO_CACHE = 'default'
+    INFO_CACHE_TIMEOUT = 60 * 60 * 24 * 7
     FORMATS = {
         'FFmpeg': [
             {
@@ -0,0 +1,220 @@
+import hashlib
+import logging
+import threading
+import time
+
+from . import cache, staging
+from .backends import get_backend
+from .config import settings
+from .exceptions import EncodingCancelled, VideoEncodingError
+
+logger = logging.getLogger(__name__)
+
+
+class CancelToken:
+    """
+    Stops the conversions it is passed to, e.g. when a job is preempted.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+        self.requeue = False
+
+    @property
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason, requeue=False):
+        if self.is_cancelled:
+            return
+        self.reason = reason
+        self.requeue = requeue
+        self._event.set()
+
+
+class ConversionContext:
+    """
+    Stages a video locally and probes it exactly once, so all encodes and
+    thumbnails of a conversion share the same media info.
+    """
+
+    def __init__(self, fieldfile, backend=None, cancel_token=None):
+        self.fieldfile = fieldfile
+        self.backend = backend or get_backend()
+        self.cancel_token = cancel_token or CancelToken()
+        self._content_hash = None
+        self._bitrate_factor = None
+        self._source_change = None
+        self._source_checked_at = time.monotonic()
+
+        self.source_path = staging.acquire(fieldfile)
+        self._staged = True
+        try:
+            self.media_info = cache.get_fieldfile_media_info(
+                fieldfile,
+                lambda: self.backend.get_media_info(self.source_path))
+        except Exception:
+            self.close()
+            raise
+
+        # spare `VideoFile` properties of the source another probe
+        fieldfile._info_cache = self.media_info
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def content_hash(self):
+        """
+        SHA-256 of the source content, computed on first access and
+        shared through the media info cache.
+        """
+        if self._content_hash is None:
+            self._content_hash = cache.get_fieldfile_content_hash(
+                self.fieldfile, self._hash_source)
+        return self._content_hash
+
+    def _hash_source(self):
+        digest = hashlib.sha256()
+        chunk_size = settings.VIDEO_ENCODING_STAGING_CHUNK_SIZE
+        with open(self.source_path, 'rb') as source:
+            for chunk in iter(lambda: source.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @property
+    def bitrate_factor(self):
+        """
+        Factor for the bitrates of all formats, derived from the
+        complexity of the source on first access. Failed estimates keep the
+        configured bitrates.
+        """
+        if self._bitrate_factor is None:
+            try:
+                complexity = cache.get_fieldfile_complexity(
+                    self.fieldfile, self._get_complexity)
+            except VideoEncodingError as e:
+                logger.warning("Complexity of %s could not be estimated: %s",
+                               self.fieldfile.name, e)
+                complexity = None
+
+            if complexity is None:
+                self._bitrate_factor = 1.0
+            else:
+                self._bitrate_factor = min(
+                    settings.VIDEO_ENCODING_CONTENT_AWARE_MAX_FACTOR,
+                    max(settings.VIDEO_ENCODING_CONTENT_AWARE_MIN_FACTOR,
+                        complexity /
+                        settings.VIDEO_ENCODING_CONTENT_AWARE_REFERENCE))
+        return self._bitrate_factor
+
+    def _get_complexity(self):
+        sample_duration = settings.VIDEO_ENCODING_CONTENT_AWARE_SAMPLE_DURATION
+        return self.backend.get_complexity(
+            self.source_path, media_info=self.media_info,
+            samples=settings.VIDEO_ENCODING_CONTENT_AWARE_SAMPLES,
+            sample_duration=sample_duration)
+
+    @property
+    def duration(self):
+        return self.media_info['duration']
+
+    @property
+    def width(self):
+        return self.media_info['width']
+
+    @property
+    def height(self):
+        return self.media_info['height']
+
+    @property
+    def frame_rate(self):
+        return self.media_info.get('frame_rate')
+
+    @property
+    def has_audio(self):
+        return self.media_info.get('has_audio', True)
+
+    def check_cancelled(self):
+        """
+        Raises `EncodingCancelled` if the conversion was cancelled or its
+        source was deleted or replaced in the meantime. The source is
+        looked up at most every `VIDEO_ENCODING_CANCEL_CHECK_INTERVAL`
+        seconds. Conversions of replaced sources are requeued, so the new
+        file is converted.
+        """
+        token = self.cancel_token
+        if token.is_cancelled:
+            raise EncodingCancelled(token.reason, requeue=token.requeue)
+
+        now = time.monotonic()
+        if (self._source_change is None and now - self._source_checked_at >=
+                settings.VIDEO_ENCODING_CANCEL_CHECK_INTERVAL):
+            self._source_checked_at = now
+            self._source_change = self._get_source_change()
+        if self._source_change is not None:
+            reason, requeue = self._source_change
+            raise EncodingCancelled(reason, requeue=requeue)
+
+    def _get_source_change(self):
+        """
+        Returns `(reason, requeue)` if the source was deleted or replaced.
+        """
+        instance = self.fieldfile.instance
+        field = self.fieldfile.field
+        names = list(
+            type(instance)._default_manager
+            .filter(pk=instance.pk)
+            .values_list(field.attname, flat=True)[:1])
+        if not names:
+            return "Video {} was deleted.".format(self.fieldfile.name), False
+        if not names[0]:
+            return "Video {} was removed.".format(self.fieldfile.name), False
+        if names[0] != self.fieldfile.name:
+            return "Video {} was replaced by {}.".format(
+                self.fieldfile.name, names[0]), True
+        return None
+
+    def can_remux(self, params):
+        return self.backend.can_remux(self.media_info, params)
+
+    def encode(self, target_path, params):
+        return self.backend.encode(self.source_path, target_path, params,
+                                   media_info=self.media_info)
+
+    def encode_segmented(self, target_path, params, **kwargs):
+        return self.backend.encode_segmented(
+            self.source_path, target_path, params,
+            media_info=self.media_info, **kwargs)
+
+    def encode_hls(self, target_dir, renditions, **kwargs):
+        return self.backend.encode_hls(
+            self.source_path, target_dir, renditions,
+            media_info=self.media_info, **kwargs)
+
+    def encode_multiple(self, outputs):
+        return self.backend.encode_multiple(self.source_path, outputs,
+                                            media_info=self.media_info)
+
+    def get_thumbnail(self, at_time=0.5):
+        return self.backend.get_thumbnail(self.source_path, at_time=at_time,
+                                          media_info=self.media_info)
+
+    def get_thumbnails(self, count=10, times=None):
+        return self.backend.get_thumbnails(self.source_path, count=count,
+                                           times=times,
+                                           media_info=self.media_info)
+
+    def get_storyboard(self, **kwargs):
+        return self.backend.get_storyboard(self.source_path,
+                                           media_info=self.media_info,
+                                           **kwargs)
+
+    def close(self):
+        if self._staged:
+            staging.release(self.fieldfile)
+            self._staged = False
@@ -8,5 +8,17 @@ class FFmpegError(VideoEncodingError):
         super(VideoEncodingError, self).__init__(*args, **kwargs)
 
 
+class FFmpegTimeoutError(FFmpegError):
+    pass
+
+
 class InvalidTimeError(VideoEncodingError):
     pass
+
+
+class EncodingCancelled(VideoEncodingError):
+    def __init__(self, msg, requeue=False):
+        self.msg = msg
+        # e.g. preempted jobs are run again later
+        self.requeue = requeue
+        super(VideoEncodingError, self).__init__(msg)
@@ -2,6 +2,7 @@ from django.db.models.fields.files import (FieldFile, ImageField,
                                            ImageFileDescriptor)
 from django.utils.translation import gettext_lazy as _
 
+from . import cache
 from .backends import get_backend_class
 from .files import VideoFile
 
@@ -11,10 +12,45 @@ class VideoFileDescriptor(ImageFileDescriptor):
 
 
 class VideoFieldFile(VideoFile, FieldFile):
+    def save(self, name, content, save=True, media_info=None):
+        """
+        Saves `content` like `FieldFile.save`. If the `media_info` of the
+        content is already known, it is used for the dimension fields
+        instead of probing the stored file again.
+        """
+        if media_info is None:
+            return super(VideoFieldFile, self).save(name, content, save=save)
+
+        name = self.field.generate_filename(self.instance, name)
+        name = self.storage.save(name, content,
+                                 max_length=self.field.max_length)
+        self.set_stored_file(name, media_info, save=save)
+
+    def set_stored_file(self, name, media_info, save=True):
+        """
+        Points the field to a file which is already in the storage. Its
+        `media_info` is used for the dimension fields.
+        """
+        self.name = name
+        self._committed = True
+        self._info_cache = media_info
+        cache.set_media_info(cache.get_fieldfile_key(self),
+                             cache.get_fieldfile_fingerprint(self),
+                             media_info)
+        # assign this file instead of its name to keep the info cache
+        setattr(self.instance, self.field.attname, self)
+
+        if save:
+            self.instance.save()
+
     def delete(self, save=True):
         # Clear the video info cache
         if hasattr(self, '_info_cache'):
             del self._info_cache
+        if hasattr(self, '_header_cache'):
+            del self._header_cache
+        if self.name:
+            cache.invalidate_fieldfile(self)
         super(VideoFieldFile, self).delete(save=save)
 
 
@@ -1,9 +1,9 @@
-import os
-
 from django.core.files import File
+from django.utils.module_loading import import_string
 
-from video_encoding.utils import get_fieldfile_local_path
+from . import cache, headers, staging
 from .backends import get_backend
+from .config import settings
 
 
 class VideoFile(File):
@@ -16,7 +16,7 @@ class VideoFile(File):
         """
         Returns video width in pixels.
         """
-        return self._get_video_info().get('width', 0)
+        return self._get_dimensions().get('width', 0)
 
     width = property(_get_width)
 
@@ -24,7 +24,7 @@ class VideoFile(File):
         """
         Returns video height in pixels.
         """
-        return self._get_video_info().get('height', 0)
+        return self._get_dimensions().get('height', 0)
 
     height = property(_get_height)
 
@@ -32,25 +32,61 @@ class VideoFile(File):
         """
         Returns duration in seconds.
         """
-        return self._get_video_info().get('duration', 0)
+        return self._get_dimensions().get('duration', 0)
 
     duration = property(_get_duration)
 
+    def _get_dimensions(self):
+        """
+        Returns width, height and duration of the video. Unless they are
+        cached, they are read from the container headers if possible,
+        which avoids probing.
+        """
+        if hasattr(self, '_info_cache'):
+            return self._info_cache
+        if not hasattr(self, '_header_cache'):
+            self._header_cache = None
+            if (settings.VIDEO_ENCODING_HEADER_PROBE and
+                    self._can_read_headers()):
+                self._header_cache = cache.get_fieldfile_headers(
+                    self, self._read_headers)
+        return self._header_cache or self._get_video_info()
+
+    def _can_read_headers(self):
+        """
+        Headers are only read from local files and from storages whose
+        files read ranges, other storages download the whole file.
+        """
+        if staging.get_local_path(self) is not None:
+            return True
+        return any(isinstance(self.storage, import_string(path)) for path
+                   in settings.VIDEO_ENCODING_HEADER_PROBE_STORAGES)
+
+    def _read_headers(self):
+        local_path = staging.get_local_path(self)
+        try:
+            if local_path is None:
+                video_file = self.storage.open(self.name, 'rb')
+            else:
+                video_file = open(local_path, 'rb')
+            with video_file:
+                return headers.read_media_info(video_file)
+        except OSError:
+            # probing reports the error
+            return None
+
     def _get_video_info(self):
         """
         Returns basic information about the video as dictionary.
         """
         if not hasattr(self, '_info_cache'):
-            encoding_backend = get_backend()
-
-            local_path, local_tmp_file = get_fieldfile_local_path(fieldfile=self)
-
-            info_cache = encoding_backend.get_media_info(local_path)
+            self._info_cache = cache.get_fieldfile_media_info(
+                self, self._probe_video_info)
 
-            if local_tmp_file:
-                os.unlink(local_tmp_file.name)
-                local_tmp_file.close()
+        return self._info_cache
 
-            self._info_cache = info_cache
+    def _probe_video_info(self):
+        encoding_backend = get_backend()
 
-        return self._info_cache
+        with staging.stage(self) as local_path:
+            return encoding_backend.get_media_info(local_path)
@@ -0,0 +1,434 @@
+"""
+Reads the duration and size of a video from its container headers, without
+spawning ffprobe. Supported are MP4/MOV (`moov` box) and Matroska/WebM
+(segment `Info` and `Tracks`), all other files and incomplete headers
+return `None`, so callers fall back to probing.
+
+Only the header boxes and elements are read, everything else is skipped
+with seeks. Whether this avoids downloading remote files depends on the
+file objects of their storage, e.g. those of django-storages download the
+whole file on the first read.
+
+`read_codecs` returns the codecs of MP4 tracks as used by the `CODECS`
+attribute of HLS playlists.
+"""
+import struct
+
+EBML_HEADER = 0x1A45DFA3
+EBML_SEGMENT = 0x18538067
+EBML_INFO = 0x1549A966
+EBML_TIMECODE_SCALE = 0x2AD7B1
+EBML_DURATION = 0x4489
+EBML_TRACKS = 0x1654AE6B
+EBML_TRACK_ENTRY = 0xAE
+EBML_TRACK_TYPE = 0x83
+EBML_VIDEO = 0xE0
+EBML_PIXEL_WIDTH = 0xB0
+EBML_PIXEL_HEIGHT = 0xBA
+EBML_CLUSTER = 0x1F43B675
+EBML_VIDEO_TRACK = 1
+
+# sizes of the fields of sample entries preceding their child boxes
+VISUAL_SAMPLE_ENTRY_SIZE = 78
+AUDIO_SAMPLE_ENTRY_SIZE = 28
+# sample entries whose codec string is their type
+SIMPLE_SAMPLE_ENTRIES = (b'Opus', b'fLaC', b'ac-3', b'ec-3')
+ES_DESCRIPTOR = 0x03
+DECODER_CONFIG_DESCRIPTOR = 0x04
+DECODER_SPECIFIC_INFO = 0x05
+MPEG4_AUDIO = 0x40
+
+
+class HeaderError(ValueError):
+    pass
+
+
+def _read(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise HeaderError("Unexpected end of file.")
+    return data
+
+
+def _get_size(stream):
+    position = stream.tell()
+    stream.seek(0, 2)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+def read_media_info(stream):
+    """
+    Returns a dict with `duration`, `width` and `height` read from the
+    headers of a seekable binary file or `None` if they cannot be read.
+    """
+    try:
+        stream.seek(0)
+        start = stream.read(12)
+        stream.seek(0)
+        if start[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free'):
+            return _read_mp4(stream)
+        if start[:4] == struct.pack('>I', EBML_HEADER):
+            return _read_matroska(stream)
+    except (HeaderError, struct.error):
+        pass
+    return None
+
+
+def _iter_boxes(stream, end):
+    """
+    Yields `(type, data start, box end)` of the boxes up to `end`.
+    """
+    position = stream.tell()
+    while position + 8 <= end:
+        stream.seek(position)
+        size, box_type = struct.unpack('>I4s', _read(stream, 8))
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack('>Q', _read(stream, 8))
+            header_size = 16
+        elif size == 0:
+            # extends to the end of the file
+            size = end - position
+        if size < header_size:
+            raise HeaderError("Invalid box size.")
+        if position + size > end:
+            raise HeaderError("Truncated box.")
+        yield box_type, position + header_size, position + size
+        position += size
+
+
+def _find_box(stream, start, end, box_type):
+    stream.seek(start)
+    for found_type, data_start, box_end in _iter_boxes(stream, end):
+        if found_type == box_type:
+            return data_start, box_end
+    return None
+
+
+def _read_mp4(stream):
+    moov = _find_box(stream, 0, _get_size(stream), b'moov')
+    if moov is None:
+        return None
+
+    duration = None
+    width = height = None
+    stream.seek(moov[0])
+    for box_type, start, end in list(_iter_boxes(stream, moov[1])):
+        if box_type == b'mvhd':
+            duration = _read_mvhd(stream, start)
+        elif box_type == b'trak' and width is None:
+            size = _read_video_size(stream, start, end)
+            if size is not None:
+                width, height = size
+
+    # fragmented files have no duration in their header
+    if not duration or width is None:
+        return None
+    return {'duration': duration, 'width': width, 'height': height}
+
+
+def _read_mvhd(stream, start):
+    stream.seek(start)
+    version = _read(stream, 4)[0]
+    if version == 1:
+        # creation and modification time are 64 bit
+        stream.seek(16, 1)
+        timescale, duration = struct.unpack('>IQ', _read(stream, 12))
+    else:
+        stream.seek(8, 1)
+        timescale, duration = struct.unpack('>II', _read(stream, 8))
+    if not timescale:
+        raise HeaderError("Invalid timescale.")
+    return duration / float(timescale)
+
+
+def _read_video_size(stream, start, end):
+    """
+    Returns the coded size of the first sample description of a video
+    track, as reported by ffprobe, or `None` for other tracks.
+    """
+    mdia = _find_box(stream, start, end, b'mdia')
+    if mdia is None:
+        return None
+    hdlr = _find_box(stream, mdia[0], mdia[1], b'hdlr')
+    if hdlr is None:
+        return None
+    # version, flags and pre_defined precede the handler type
+    stream.seek(hdlr[0] + 8)
+    if _read(stream, 4) != b'vide':
+        return None
+
+    box = _find_sample_description(stream, mdia)
+    if box is None:
+        return None
+    # version, flags and entry count, then the sample entry header,
+    # reserved fields and pre-defined values precede the size
+    stream.seek(box[0] + 8 + 8 + 24)
+    width, height = struct.unpack('>HH', _read(stream, 4))
+    return width, height
+
+
+def _find_sample_description(stream, mdia):
+    box = mdia
+    for box_type in (b'minf', b'stbl', b'stsd'):
+        box = _find_box(stream, box[0], box[1], box_type)
+        if box is None:
+            return None
+    return box
+
+
+def read_codecs(stream):
+    """
+    Returns the codecs of all tracks of a MP4 file, e.g. of the init
+    segment of a HLS variant, as RFC 6381 strings like `avc1.64001f` or
+    `mp4a.40.2`. Returns `None` if a codec is not supported.
+    """
+    try:
+        moov = _find_box(stream, 0, _get_size(stream), b'moov')
+        if moov is None:
+            return None
+        codecs = []
+        stream.seek(moov[0])
+        for box_type, start, end in list(_iter_boxes(stream, moov[1])):
+            if box_type != b'trak':
+                continue
+            mdia = _find_box(stream, start, end, b'mdia')
+            stsd = mdia and _find_sample_description(stream, mdia)
+            codec = stsd and _read_codec(stream, *stsd)
+            if codec is None:
+                return None
+            codecs.append(codec)
+        return codecs or None
+    except (HeaderError, struct.error):
+        return None
+
+
+def _read_codec(stream, start, end):
+    # version, flags and entry count precede the first sample entry
+    stream.seek(start + 8)
+    for entry_type, entry_start, entry_end in _iter_boxes(stream, end):
+        break
+    else:
+        return None
+
+    if entry_type in SIMPLE_SAMPLE_ENTRIES:
+        return entry_type.decode('ascii')
+    if entry_type in (b'avc1', b'avc3'):
+        return _read_avc_codec(stream, entry_type, entry_start, entry_end)
+    if entry_type in (b'hvc1', b'hev1'):
+        return _read_hevc_codec(stream, entry_type, entry_start, entry_end)
+    if entry_type == b'mp4a':
+        return _read_mp4a_codec(stream, entry_start, entry_end)
+    return None
+
+
+def _read_avc_codec(stream, entry_type, start, end):
+    config = _find_box(stream, start + VISUAL_SAMPLE_ENTRY_SIZE, end,
+                       b'avcC')
+    if config is None:
+        return None
+    # profile, compatibility flags and level follow the version
+    stream.seek(config[0] + 1)
+    return '{}.{}'.format(entry_type.decode('ascii'),
+                          _read(stream, 3).hex())
+
+
+def _read_hevc_codec(stream, entry_type, start, end):
+    config = _find_box(stream, start + VISUAL_SAMPLE_ENTRY_SIZE, end,
+                       b'hvcC')
+    if config is None:
+        return None
+    stream.seek(config[0] + 1)
+    data = _read(stream, 12)
+    profile_space, tier, profile = data[0] >> 6, data[0] >> 5 & 1, \
+        data[0] & 0x1F
+    # the compatibility flags are written in reverse bit order
+    compatibility = int('{:032b}'.format(
+        struct.unpack('>I', data[1:5])[0])[::-1], 2)
+    constraints = data[5:11].rstrip(b'\0')
+    parts = [
+        entry_type.decode('ascii'),
+        '{}{:d}'.format(('', 'A', 'B', 'C')[profile_space], profile),
+        '{:X}'.format(compatibility),
+        '{}{:d}'.format('LH'[tier], data[11]),
+    ]
+    parts.extend('{:X}'.format(byte) for byte in constraints)
+    return '.'.join(parts)
+
+
+def _read_mp4a_codec(stream, start, end):
+    esds = _find_box(stream, start + AUDIO_SAMPLE_ENTRY_SIZE, end, b'esds')
+    if esds is None:
+        return None
+    # version and flags precede the ES descriptor
+    stream.seek(esds[0] + 4)
+    if _read_descriptor(stream) != ES_DESCRIPTOR:
+        return None
+    # ES ID, then flags of optional fields
+    flags = _read(stream, 3)[2]
+    if flags & 0x80:
+        stream.seek(2, 1)
+    if flags & 0x40:
+        stream.seek(_read(stream, 1)[0], 1)
+    if flags & 0x20:
+        stream.seek(2, 1)
+
+    if _read_descriptor(stream) != DECODER_CONFIG_DESCRIPTOR:
+        return None
+    object_type = _read(stream, 1)[0]
+    if object_type != MPEG4_AUDIO:
+        return 'mp4a.{:02x}'.format(object_type)
+    # stream type, buffer size and bitrates
+    stream.seek(12, 1)
+    if _read_descriptor(stream) != DECODER_SPECIFIC_INFO:
+        return None
+    config = _read(stream, 2)
+    audio_object_type = config[0] >> 3
+    if audio_object_type == 31:
+        audio_object_type = 32 + ((config[0] & 0x07) << 3 | config[1] >> 5)
+    return 'mp4a.40.{:d}'.format(audio_object_type)
+
+
+def _read_descriptor(stream):
+    """
+    Reads the header of a MPEG-4 descriptor and returns its tag.
+    """
+    tag = _read(stream, 1)[0]
+    # the size has up to four bytes with seven bits each
+    for __ in range(4):
+        if not _read(stream, 1)[0] & 0x80:
+            break
+    return tag
+
+
+def _read_vint(stream, keep_marker=False):
+    """
+    Reads an EBML variable size integer. Sizes of unknown length, with all
+    value bits set, are returned as `None`.
+    """
+    first = _read(stream, 1)[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        raise HeaderError("Invalid EBML integer.")
+
+    value = first if keep_marker else first & (mask - 1)
+    for byte in _read(stream, length - 1):
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None
+    return value
+
+
+def _iter_elements(stream, end):
+    """
+    Yields `(id, data start, element end)` of the EBML elements up to `end`.
+    Elements of unknown size, e.g. of live streams, end at `end`.
+    """
+    position = stream.tell()
+    while position < end:
+        stream.seek(position)
+        element_id = _read_vint(stream, keep_marker=True)
+        size = _read_vint(stream)
+        start = stream.tell()
+        element_end = end if size is None else start + size
+        if element_end > end:
+            raise HeaderError("Truncated element.")
+        yield element_id, start, element_end
+        position = element_end
+
+
+def _read_uint(stream, start, end):
+    stream.seek(start)
+    value = 0
+    for byte in _read(stream, end - start):
+        value = (value << 8) | byte
+    return value
+
+
+def _read_float(stream, start, end):
+    stream.seek(start)
+    if end - start == 4:
+        return struct.unpack('>f', _read(stream, 4))[0]
+    if end - start == 8:
+        return struct.unpack('>d', _read(stream, 8))[0]
+    raise HeaderError("Invalid EBML float.")
+
+
+def _read_matroska(stream):
+    stream.seek(0)
+    segment = None
+    for element_id, start, end in _iter_elements(stream, _get_size(stream)):
+        if element_id == EBML_SEGMENT:
+            segment = start, end
+            break
+    if segment is None:
+        return None
+
+    timecode_scale = 1000000
+    duration = None
+    width = height = None
+    stream.seek(segment[0])
+    for element_id, start, end in _iter_elements(stream, segment[1]):
+        if element_id == EBML_INFO:
+            stream.seek(start)
+            for child_id, child_start, child_end in _iter_elements(stream,
+                                                                   end):
+                if child_id == EBML_TIMECODE_SCALE:
+                    timecode_scale = _read_uint(stream, child_start,
+                                                child_end)
+                elif child_id == EBML_DURATION:
+                    duration = _read_float(stream, child_start, child_end)
+        elif element_id == EBML_TRACKS:
+            stream.seek(start)
+            size = _read_matroska_video_size(stream, end)
+            if size is not None:
+                width, height = size
+        elif element_id == EBML_CLUSTER:
+            # headers precede the media data
+            break
+        if duration is not None and width is not None:
+            break
+
+    if not duration or width is None:
+        return None
+    # durations are given in units of the timecode scale (nanoseconds)
+    return {'duration': duration * timecode_scale / 1e9, 'width': width,
+            'height': height}
+
+
+def _read_matroska_video_size(stream, end):
+    for element_id, start, entry_end in list(_iter_elements(stream, end)):
+        if element_id != EBML_TRACK_ENTRY:
+            continue
+        track_type = None
+        size = None
+        stream.seek(start)
+        for child_id, child_start, child_end in list(
+                _iter_elements(stream, entry_end)):
+            if child_id == EBML_TRACK_TYPE:
+                track_type = _read_uint(stream, child_start, child_end)
+            elif child_id == EBML_VIDEO:
+                size = _read_matroska_pixels(stream, child_start, child_end)
+        if track_type == EBML_VIDEO_TRACK and size is not None:
+            return size
+    return None
+
+
+def _read_matroska_pixels(stream, start, end):
+    width = height = None
+    stream.seek(start)
+    for element_id, child_start, child_end in list(
+            _iter_elements(stream, end)):
+        if element_id == EBML_PIXEL_WIDTH:
+            width = _read_uint(stream, child_start, child_end)
+        elif element_id == EBML_PIXEL_HEIGHT:
+            height = _read_uint(stream, child_start, child_end)
+    if width is None or height is None:
+        return None
+    return width, height
@@ -0,0 +1,178 @@
+import logging
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.utils import timezone
+
+from .backends import get_backend_class
+from .config import settings
+from .exceptions import EncodingCancelled
+from .fields import VideoField
+from .models import EncodingJob
+from .tasks import convert_video
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_video(fieldfile, force=False, priority=0):
+    """
+    Queues the conversion of a video file into all defined formats.
+
+    Requests for a format which is already queued or running are merged
+    into the existing job.
+    """
+    instance = fieldfile.instance
+    content_type = ContentType.objects.get_for_model(instance)
+    backend_name = get_backend_class().name
+
+    jobs = []
+    for options in settings.VIDEO_ENCODING_FORMATS[backend_name]:
+        job, created = EncodingJob.objects.get_or_create(
+            object_id=instance.pk, content_type=content_type,
+            field_name=fieldfile.field.name, format=options['name'],
+            defaults={'force': force, 'priority': priority})
+        if not created:
+            _requeue(job, force, priority)
+        jobs.append(job)
+    return jobs
+
+
+def _requeue(job, force, priority):
+    now = timezone.now()
+    jobs = EncodingJob.objects.filter(pk=job.pk)
+    # the status may change between the updates, e.g. when a running job
+    # finishes, so they are repeated until one applies
+    while True:
+        # finished jobs are queued again
+        if jobs.filter(status__in=[EncodingJob.DONE, EncodingJob.FAILED,
+                                   EncodingJob.CANCELLED]).update(
+                status=EncodingJob.QUEUED, attempts=0, force=force,
+                priority=priority, available_at=now, last_error='',
+                updated_at=now):
+            return
+
+        # a running job may work on an outdated file, e.g. of a replaced
+        # video, so it is queued again as soon as it ends
+        if jobs.filter(status=EncodingJob.RUNNING).update(
+                rerun=True, force=job.force or force,
+                priority=max(job.priority, priority), updated_at=now):
+            return
+
+        # a pending job takes over the stronger request
+        if jobs.filter(status=EncodingJob.QUEUED).update(
+                force=job.force or force,
+                priority=max(job.priority, priority), updated_at=now):
+            return
+
+        if not jobs.exists():
+            return
+
+
+def enqueue_all_videos(instance, force=False, priority=0):
+    """
+    Queues the conversion of all videos of a given instance.
+    """
+    jobs = []
+    for field in instance._meta.fields:
+        if isinstance(field, VideoField) and getattr(instance, field.name):
+            jobs.extend(enqueue_video(getattr(instance, field.name),
+                                      force=force, priority=priority))
+    return jobs
+
+
+def claim_jobs(worker_id, limit):
+    """
+    Leases up to `limit` jobs to the given worker. Rows locked by other
+    workers are skipped, so workers never wait for each other.
+    """
+    if limit <= 0:
+        return []
+
+    now = timezone.now()
+    lease_expires_at = now + timedelta(
+        seconds=settings.VIDEO_ENCODING_QUEUE_LEASE_TIME)
+
+    max_attempts = settings.VIDEO_ENCODING_QUEUE_MAX_ATTEMPTS
+
+    with transaction.atomic():
+        jobs = list(
+            EncodingJob.objects
+            .select_for_update(skip_locked=True)
+            .claimable(now)
+            .order_by('-priority', 'available_at')[:limit])
+        for job in jobs:
+            if job.attempts >= max_attempts:
+                # the lease of its last attempt expired
+                job.status = EncodingJob.FAILED
+                job.last_error = "Lease of worker {} expired.".format(
+                    job.locked_by)
+                job.locked_by = ''
+                job.lease_expires_at = None
+                continue
+            job.status = EncodingJob.RUNNING
+            job.locked_by = worker_id
+            job.lease_expires_at = lease_expires_at
+            job.attempts += 1
+            # this attempt converts the current file
+            job.rerun = False
+            job.preempted = False
+        EncodingJob.objects.bulk_update(
+            jobs, ['status', 'locked_by', 'lease_expires_at', 'attempts',
+                   'last_error', 'rerun', 'preempted'])
+    return [job for job in jobs if job.status == EncodingJob.RUNNING]
+
+
+def renew_leases(worker_id, job_ids):
+    """
+    Extends the leases of the running jobs of a worker.
+    """
+    if not job_ids:
+        return 0
+    lease_expires_at = timezone.now() + timedelta(
+        seconds=settings.VIDEO_ENCODING_QUEUE_LEASE_TIME)
+    return EncodingJob.objects.filter(
+        pk__in=job_ids, locked_by=worker_id,
+        status=EncodingJob.RUNNING,
+    ).update(lease_expires_at=lease_expires_at)
+
+
+def run_job(job, backend=None, cancel_token=None):
+    """
+    Converts the video of a leased job and records the result. Jobs
+    cancelled with `requeue`, e.g. through `cancel_token` or because their
+    video was replaced, are queued again, other cancelled jobs are not
+    retried.
+    """
+    try:
+        fieldfile = job.get_fieldfile()
+    except ObjectDoesNotExist as e:
+        job.fail(e, retry=False)
+        return
+    if not fieldfile:
+        job.fail("Video field '{}' is empty.".format(job.field_name),
+                 retry=False)
+        return
+
+    try:
+        errors = convert_video(fieldfile, force=job.force,
+                               formats=[job.format], backend=backend,
+                               cancel_token=cancel_token)
+    except Exception as e:
+        logger.exception("Conversion of %s failed.", job)
+        job.fail(e)
+        return
+
+    error = errors.get(job.format)
+    if isinstance(error, EncodingCancelled):
+        logger.info("Conversion of %s was cancelled: %s", job, error)
+        if error.requeue:
+            job.preempt()
+        else:
+            job.cancel(error)
+    elif error is not None:
+        logger.warning("Conversion of %s failed: %s", job, error)
+        job.fail(error)
+    else:
+        job.complete()
@@ -0,0 +1,68 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from ...backfill import (
+    Checkpoint, backfill_model, get_video_fields, get_video_models,
+)
+
+
+class Command(BaseCommand):
+    help = ("Probes existing videos and fills the width, height and "
+            "duration fields of their rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', action='append', dest='models', default=None,
+            help="Model as app_label.ModelName, may be repeated. Defaults "
+                 "to all models with video dimension fields.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help="Number of rows probed and updated at once.")
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help="Number of files probed concurrently.")
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Also probe rows whose fields are already filled.")
+        parser.add_argument(
+            '--checkpoint', default=None,
+            help="JSON file storing the progress, an interrupted run "
+                 "continues after the last processed row.")
+        parser.add_argument(
+            '--reset', action='store_true',
+            help="Start from the first row, ignoring the checkpoint.")
+
+    def handle(self, *args, **options):
+        if options['models']:
+            models = [self.get_model(label) for label in options['models']]
+        else:
+            models = get_video_models()
+
+        checkpoint = Checkpoint(options['checkpoint'])
+        if options['reset']:
+            checkpoint.positions = {}
+
+        for model in models:
+            stats = backfill_model(
+                model, chunk_size=options['chunk_size'],
+                workers=options['workers'], force=options['force'],
+                checkpoint=checkpoint, callback=self.report)
+            self.stdout.write(self.style.SUCCESS(
+                "{model} done: {rows:d} rows, {updated:d} updated, "
+                "{failed:d} failed in {seconds:.1f}s.".format(**stats)))
+
+    def report(self, stats):
+        rate = stats['rows'] / stats['seconds'] if stats['seconds'] else 0
+        self.stdout.write(
+            "{model}: {rows:d} rows, {probed:d} probed, {failed:d} failed, "
+            "last pk {last_pk}, {rate:.1f} rows/s".format(rate=rate, **stats))
+
+    def get_model(self, label):
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        if not get_video_fields(model):
+            raise CommandError(
+                "{} has no video fields with dimension fields.".format(label))
+        return model
@@ -0,0 +1,61 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmark import run_benchmark
+
+RE_SOURCE = re.compile(r'^(\d+)x(\d+):(\d+(?:\.\d+)?)$')
+
+
+class Command(BaseCommand):
+    help = ("Encodes synthetic videos into the configured formats and "
+            "reports timings, memory and output sizes as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', action='append', dest='formats', default=None,
+            help="Name of a format to benchmark, may be repeated. Defaults "
+                 "to all formats.")
+        parser.add_argument(
+            '--source', action='append', dest='sources', default=None,
+            help="Size and duration of a test video, e.g. 1280x720:10, may "
+                 "be repeated.")
+        parser.add_argument(
+            '--repeat', type=int, default=1,
+            help="Number of encodes per format, medians are reported.")
+        parser.add_argument(
+            '--output', default=None,
+            help="Path of the JSON report, defaults to stdout.")
+
+    def handle(self, *args, **options):
+        sources = None
+        if options['sources']:
+            sources = [self.parse_source(value)
+                       for value in options['sources']]
+
+        report = run_benchmark(
+            sources=sources, formats=options['formats'],
+            repeat=options['repeat'],
+            stdout=self.stderr if options['verbosity'] > 1 else None)
+
+        data = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(data + '\n')
+        else:
+            self.stdout.write(data)
+
+    def parse_source(self, value):
+        match = RE_SOURCE.match(value)
+        if not match:
+            raise CommandError(
+                "Invalid source '{}', expected WIDTHxHEIGHT:DURATION."
+                .format(value))
+        width, height, duration = match.groups()
+        return {
+            'name': '{}x{}_{}s'.format(width, height, duration),
+            'width': int(width),
+            'height': int(height),
+            'duration': float(duration),
+        }
@@ -0,0 +1,36 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from ...worker import Worker
+
+
+class Command(BaseCommand):
+    help = "Processes queued video conversions."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help="Number of jobs run at once, defaults to "
+                 "VIDEO_ENCODING_PARALLEL_ENCODES.")
+        parser.add_argument(
+            '--worker-id', default=None,
+            help="Name of the worker, defaults to host and process id.")
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit as soon as the queue is empty.")
+
+    def handle(self, *args, **options):
+        worker = Worker(worker_id=options['worker_id'],
+                        concurrency=options['concurrency'])
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping after running jobs are finished.")
+            worker.stop()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        self.stdout.write("Worker {} started with {:d} slots.".format(
+            worker.worker_id, worker.concurrency))
+        worker.run(once=options['once'])
@@ -1,4 +1,4 @@
-from django.db.models import Manager
+from django.db.models import Manager, Q
 from django.db.models.query import QuerySet
 
 
@@ -9,6 +9,23 @@ class FormatQuerySet(QuerySet):
     def complete(self):
         return self.filter(progress=100)
 
+    def cancelled(self):
+        return self.filter(cancelled=True)
+
 
 class FormatManager(Manager.from_queryset(FormatQuerySet)):
     use_for_related_fields = True
+
+
+class EncodingJobQuerySet(QuerySet):
+    def claimable(self, now):
+        """
+        Queued jobs which are due and running jobs whose lease expired.
+        """
+        return self.filter(
+            Q(status='queued', available_at__lte=now) |
+            Q(status='running', lease_expires_at__lt=now))
+
+
+class EncodingJobManager(Manager.from_queryset(EncodingJobQuerySet)):
+    pass
@@ -0,0 +1,139 @@
+"""
+Timings and counters of the conversion pipeline.
+
+All stages report to the hook configured by `VIDEO_ENCODING_METRICS`, a
+subclass of `BaseMetrics`. The default `LoggingMetrics` emits a debug record
+on the `video_encoding.metrics` logger for every value, with `metric`,
+`value` and `tags` as extra attributes, and aggregates them in memory.
+
+Reported metrics (seconds unless noted otherwise):
+
+* `convert`, `staging`, `probe`, `encode`, `thumbnail`, `storyboard`,
+  `storage.save`, `progress.write`: durations of the stages
+* `staging.bytes`, `storage.bytes`: bytes moved (counters)
+* `subprocesses`: spawned ffmpeg and ffprobe processes (counter)
+* `encode.speed`: encoding speed as multiple of realtime
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_metrics = None
+_lock = threading.Lock()
+
+
+class BaseMetrics:
+    def increment(self, name, value=1, **tags):
+        """
+        Adds `value` to a counter.
+        """
+
+    def observe(self, name, value, **tags):
+        """
+        Records a value of a distribution, e.g. a duration.
+        """
+
+
+class LoggingMetrics(BaseMetrics):
+    """
+    Logs every value and keeps counters and histograms of all values
+    reported by this process, see `get_stats`.
+    """
+    # upper bounds of the histogram buckets
+    buckets = (0.01, 0.1, 1, 10, 60, 300, 1800, float('inf'))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, value=1, **tags):
+        self._log(name, value, tags)
+        key = self._get_key(name, tags)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **tags):
+        self._log(name, value, tags)
+        key = self._get_key(name, tags)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'count': 0, 'sum': 0.0, 'min': value, 'max': value,
+                    'buckets': [0] * len(self.buckets),
+                }
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['min'] = min(histogram['min'], value)
+            histogram['max'] = max(histogram['max'], value)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+                    break
+
+    def get_stats(self):
+        """
+        Returns a copy of all counters and histograms by `(name, tags)`.
+        """
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {key: dict(value, buckets=list(value['buckets']))
+                               for key, value in self.histograms.items()},
+            }
+
+    def _get_key(self, name, tags):
+        return name, tuple(sorted(tags.items()))
+
+    def _log(self, name, value, tags):
+        logger.debug('%s %s %s', name, value, tags, extra={
+            'metric': name, 'value': value, 'tags': tags})
+
+
+def get_metrics():
+    """
+    Returns the instance of the configured metrics hook.
+    """
+    global _metrics
+    with _lock:
+        if _metrics is None:
+            if settings.VIDEO_ENCODING_METRICS is None:
+                _metrics = BaseMetrics()
+            else:
+                try:
+                    cls = import_string(settings.VIDEO_ENCODING_METRICS)
+                except ImportError as e:
+                    raise ImproperlyConfigured(
+                        "Cannot retrieve metrics '{}'. Error: '{}'.".format(
+                            settings.VIDEO_ENCODING_METRICS, e))
+                _metrics = cls()
+        return _metrics
+
+
+def increment(name, value=1, **tags):
+    get_metrics().increment(name, value, **tags)
+
+
+def observe(name, value, **tags):
+    get_metrics().observe(name, value, **tags)
+
+
+@contextmanager
+def timer(name, **tags):
+    """
+    Records the duration of the block, also if it raises.
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started, **tags)
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('video_encoding', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EncodingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField(editable=False)),
+                ('field_name', models.CharField(max_length=255)),
+                ('format', models.CharField(max_length=255, verbose_name='Format')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16, verbose_name='Status')),
+                ('priority', models.SmallIntegerField(default=0, verbose_name='Priority')),
+                ('force', models.BooleanField(default=False)),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Available at')),
+                ('locked_by', models.CharField(blank=True, max_length=255)),
+                ('lease_expires_at', models.DateTimeField(null=True)),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('content_type', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'verbose_name': 'Encoding job',
+                'verbose_name_plural': 'Encoding jobs',
+                'indexes': [models.Index(fields=['status', 'available_at'], name='video_encoding_job_claim')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='encodingjob',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id', 'field_name', 'format'), name='video_encoding_job_unique_format'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_formats(apps, schema_editor):
+    Format = apps.get_model('video_encoding', 'Format')
+    fields = ('content_type', 'object_id', 'field_name', 'format')
+
+    duplicates = Format.objects.values(*fields) \
+        .annotate(count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        del duplicate['count']
+        # keep the most advanced format
+        ids = list(Format.objects.filter(**duplicate)
+                   .order_by('-progress', 'id').values_list('id', flat=True))
+        Format.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_encoding', '0002_encodingjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_formats,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='format',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id', 'field_name', 'format'), name='video_encoding_format_unique'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_encoding', '0003_format_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EncodedOutput',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_hash', models.CharField(max_length=64)),
+                ('params_hash', models.CharField(max_length=64)),
+                ('file', models.CharField(max_length=2048)),
+                ('media_info', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Encoded output',
+                'verbose_name_plural': 'Encoded outputs',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='encodedoutput',
+            constraint=models.UniqueConstraint(fields=('source_hash', 'params_hash'), name='video_encoding_output_unique'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_encoding', '0004_encodedoutput'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='format',
+            name='cancelled',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Cancelled'),
+        ),
+        migrations.AlterField(
+            model_name='encodingjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=16, verbose_name='Status'),
+        ),
+    ]
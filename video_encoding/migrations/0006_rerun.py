@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_encoding', '0005_cancellation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encodingjob',
+            name='rerun',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_encoding', '0006_rerun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encodingjob',
+            name='preempted',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_encoding', '0007_preempted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encodedoutput',
+            name='fingerprint',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -1,12 +1,19 @@
+import hashlib
+import json
+import time
+from datetime import timedelta
 from os.path import splitext
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from . import metrics
+from .config import settings
 from .fields import VideoField
-from .manager import FormatManager
+from .manager import EncodingJobManager, FormatManager
 
 
 def upload_format_to(i, f):
@@ -35,6 +42,11 @@ class Format(models.Model):
         editable=False,
         verbose_name=_("Progress"),
     )
+    cancelled = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name=_("Cancelled"),
+    )
     format = models.CharField(
         max_length=255,
         editable=False,
@@ -69,6 +81,13 @@ class Format(models.Model):
     class Meta:
         verbose_name = _("Format")
         verbose_name_plural = _("Formats")
+        constraints = [
+            # also serves as index for the lookups of the generic relation
+            models.UniqueConstraint(
+                fields=['content_type', 'object_id', 'field_name', 'format'],
+                name='video_encoding_format_unique',
+            ),
+        ]
 
     def __str__(self):
         return '{} ({:d}%)'.format(self.file.name, self.progress)
@@ -77,14 +96,269 @@ class Format(models.Model):
         return self.__str__()
 
     def update_progress(self, percent, commit=True):
-        if 0 > percent > 100:
+        """
+        Updates the progress. Database writes are throttled by
+        `VIDEO_ENCODING_PROGRESS_UPDATE` (seconds) and
+        `VIDEO_ENCODING_PROGRESS_UPDATE_DELTA` (percent), reaching 100
+        is always written.
+        """
+        if not 0 <= percent <= 100:
             raise ValueError("Invalid percent value.")
 
-        self.progress = percent
+        self.progress = int(percent)
         if commit:
-            self.save()
+            self.flush_progress(force=self.progress == 100)
 
     def reset_progress(self, commit=True):
-        self.percent = 0
+        self.progress = 0
         if commit:
-            self.save()
+            self.flush_progress(force=True)
+
+    def flush_progress(self, force=False):
+        """
+        Writes only the progress column, without calling `save()` or
+        sending any signals.
+        """
+        flushed = getattr(self, '_flushed_progress', None)
+        now = time.monotonic()
+
+        if not force and flushed is not None:
+            if self.progress == flushed:
+                return
+            recently = (now - self._progress_flushed_at <
+                        settings.VIDEO_ENCODING_PROGRESS_UPDATE)
+            small_step = (self.progress - flushed <
+                          settings.VIDEO_ENCODING_PROGRESS_UPDATE_DELTA)
+            if recently and small_step:
+                return
+
+        with metrics.timer('progress.write'):
+            Format.objects.filter(pk=self.pk).update(progress=self.progress)
+        self._flushed_progress = self.progress
+        self._progress_flushed_at = now
+
+    def set_cancelled(self, cancelled=True):
+        """
+        Marks the last encoding as cancelled, e.g. because its source was
+        deleted. Writes only the cancelled column.
+        """
+        self.cancelled = cancelled
+        Format.objects.filter(pk=self.pk).update(cancelled=cancelled)
+
+
+class EncodingJob(models.Model):
+    """
+    A queued conversion of a video field into a single format, processed by
+    the `encode_videos` worker command.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = (
+        (QUEUED, _("Queued")),
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+        (CANCELLED, _("Cancelled")),
+    )
+
+    object_id = models.PositiveIntegerField(
+        editable=False,
+    )
+    content_type = models.ForeignKey(
+        ContentType,
+        editable=False,
+        on_delete=models.CASCADE
+    )
+    video = GenericForeignKey()
+    field_name = models.CharField(
+        max_length=255,
+    )
+    format = models.CharField(
+        max_length=255,
+        verbose_name=_("Format"),
+    )
+
+    status = models.CharField(
+        choices=STATUS_CHOICES,
+        default=QUEUED,
+        max_length=16,
+        verbose_name=_("Status"),
+    )
+    priority = models.SmallIntegerField(
+        default=0,
+        verbose_name=_("Priority"),
+    )
+    force = models.BooleanField(
+        default=False,
+    )
+    # requested again while running, e.g. because the video was replaced
+    rerun = models.BooleanField(
+        default=False,
+    )
+    # cancelled while running to make room for a job with a higher priority
+    preempted = models.BooleanField(
+        default=False,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name=_("Attempts"),
+    )
+    available_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Available at"),
+    )
+    locked_by = models.CharField(
+        blank=True,
+        max_length=255,
+    )
+    lease_expires_at = models.DateTimeField(
+        null=True,
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name=_("Last error"),
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
+
+    objects = EncodingJobManager()
+
+    class Meta:
+        verbose_name = _("Encoding job")
+        verbose_name_plural = _("Encoding jobs")
+        constraints = [
+            models.UniqueConstraint(
+                fields=['content_type', 'object_id', 'field_name', 'format'],
+                name='video_encoding_job_unique_format',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'available_at'],
+                         name='video_encoding_job_claim'),
+        ]
+
+    def __str__(self):
+        return '{} {}.{} ({})'.format(self.format, self.object_id,
+                                      self.field_name, self.status)
+
+    def get_fieldfile(self):
+        instance = self.content_type.get_object_for_this_type(
+            pk=self.object_id)
+        return getattr(instance, self.field_name)
+
+    def _update(self, filters=None, **kwargs):
+        """
+        Updates the job as long as this worker still holds its lease.
+        """
+        updated = EncodingJob.objects.filter(
+            pk=self.pk, locked_by=self.locked_by, **(filters or {})).update(
+            updated_at=timezone.now(), **kwargs)
+        if updated:
+            for name, value in kwargs.items():
+                setattr(self, name, value)
+        return bool(updated)
+
+    def _finish(self, **kwargs):
+        """
+        Ends the attempt with the given changes. Jobs which were requested
+        again in the meantime are queued again instead.
+        """
+        kwargs['preempted'] = False
+        while True:
+            if self._update(filters={'rerun': False}, **kwargs):
+                return True
+            if self._update(
+                    filters={'rerun': True}, status=self.QUEUED, rerun=False,
+                    preempted=False, locked_by='', lease_expires_at=None,
+                    attempts=0, available_at=timezone.now(), last_error=''):
+                return True
+            if not EncodingJob.objects.filter(
+                    pk=self.pk, locked_by=self.locked_by).exists():
+                # the lease was lost
+                return False
+
+    def complete(self):
+        return self._finish(status=self.DONE, locked_by='',
+                            lease_expires_at=None, last_error='')
+
+    def fail(self, error, retry=True):
+        """
+        Requeues the job with exponential backoff until
+        `VIDEO_ENCODING_QUEUE_MAX_ATTEMPTS` is reached.
+        """
+        max_attempts = settings.VIDEO_ENCODING_QUEUE_MAX_ATTEMPTS
+        if retry and self.attempts < max_attempts:
+            delay = (settings.VIDEO_ENCODING_QUEUE_RETRY_DELAY *
+                     2 ** max(0, self.attempts - 1))
+            return self._finish(
+                status=self.QUEUED, locked_by='', lease_expires_at=None,
+                available_at=timezone.now() + timedelta(seconds=delay),
+                last_error=str(error))
+        return self._finish(status=self.FAILED, locked_by='',
+                            lease_expires_at=None, last_error=str(error))
+
+    def cancel(self, reason):
+        return self._finish(status=self.CANCELLED, locked_by='',
+                            lease_expires_at=None, last_error=str(reason))
+
+    def preempt(self):
+        """
+        Queues the job again without counting the interrupted attempt.
+        """
+        return self._update(status=self.QUEUED, rerun=False, preempted=False,
+                            locked_by='', lease_expires_at=None,
+                            attempts=max(0, self.attempts - 1),
+                            available_at=timezone.now())
+
+
+class EncodedOutput(models.Model):
+    """
+    An encoded file addressed by the hashes of its source content and of
+    the format params, so identical sources are encoded only once.
+    """
+    source_hash = models.CharField(
+        max_length=64,
+    )
+    params_hash = models.CharField(
+        max_length=64,
+    )
+    file = models.CharField(
+        max_length=2048,
+    )
+    # size and modification time of `file`, which belongs to a format and
+    # may be replaced by another encoding
+    fingerprint = models.JSONField(
+        default=list,
+    )
+    media_info = models.JSONField(
+        default=dict,
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    class Meta:
+        verbose_name = _("Encoded output")
+        verbose_name_plural = _("Encoded outputs")
+        constraints = [
+            models.UniqueConstraint(
+                fields=['source_hash', 'params_hash'],
+                name='video_encoding_output_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return self.file
+
+    @staticmethod
+    def get_params_hash(backend_name, options):
+        data = json.dumps([backend_name, options['extension'],
+                           options['params']])
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
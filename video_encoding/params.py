@@ -0,0 +1,99 @@
+"""
+Helpers to inspect and rewrite the encoder `params` of a format.
+
+Params are flat lists of command line arguments, e.g.
+`['-codec:v', 'libx264', '-vf', 'scale=-2:480']`. All helpers return new
+lists and never modify the given params.
+"""
+
+VIDEO_FILTER_OPTIONS = ('-vf', '-filter:v')
+
+# options which only affect the video stream
+VIDEO_OPTIONS = VIDEO_FILTER_OPTIONS + (
+    '-codec:v', '-c:v', '-vcodec', '-b:v', '-maxrate', '-minrate', '-bufsize',
+    '-r', '-crf', '-preset', '-tune', '-profile:v', '-level', '-pix_fmt',
+    '-g', '-keyint_min', '-qmin', '-qmax', '-force_key_frames',
+    '-sc_threshold',
+)
+
+
+def get_option(params, *names):
+    """
+    Returns the value of the last occurrence of any of the given options or
+    `None` if it is not present.
+    """
+    value = None
+    for index, param in enumerate(params[:-1]):
+        if param in names:
+            value = params[index + 1]
+    return value
+
+
+def has_option(params, *names):
+    return any(param in names for param in params)
+
+
+def remove_option(params, *names, **kwargs):
+    """
+    Removes all occurrences of the given options including their values,
+    unless `has_value=False` is passed.
+    """
+    has_value = kwargs.get('has_value', True)
+    result = []
+    skip = False
+    for param in params:
+        if skip:
+            skip = False
+            continue
+        if param in names:
+            skip = has_value
+            continue
+        result.append(param)
+    return result
+
+
+def set_option(params, name, value, aliases=()):
+    """
+    Replaces the value of option `name` (and its `aliases`) or appends it.
+    """
+    names = (name,) + tuple(aliases)
+    if not has_option(params, *names):
+        return list(params) + [name, value]
+
+    result = list(params)
+    for index, param in enumerate(result[:-1]):
+        if param in names:
+            result[index + 1] = value
+    return result
+
+
+def get_video_filter(params):
+    return get_option(params, *VIDEO_FILTER_OPTIONS)
+
+
+def remove_video_filter(params):
+    return remove_option(params, *VIDEO_FILTER_OPTIONS)
+
+
+def remove_video_options(params):
+    """
+    Removes all options which only affect the video stream, e.g. to copy
+    the video stream while using the audio and muxer options.
+    """
+    return remove_option(params, *VIDEO_OPTIONS)
+
+
+def parse_bitrate(value):
+    """
+    Converts bitrates like `1000k` or `2M` to bits per second.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:].lower())
+    if multiplier:
+        value = value[:-1]
+    try:
+        return int(float(value) * (multiplier or 1))
+    except ValueError:
+        return None
@@ -0,0 +1,163 @@
+"""
+Adjusts the configured formats to the probed source, so no resources are
+spent on renditions which cannot look better than the source:
+
+* formats above the source resolution are skipped, except for the
+  smallest one of each container if no other format reaches the source
+  size, which is clamped to the source size
+* frame rates above the source frame rate are dropped
+* bitrates above the source bitrate are lowered to it
+* formats which end up with identical params are encoded only once
+
+With `scale_bitrates` the bitrates can additionally be adapted to the
+complexity of the content.
+"""
+import re
+
+from . import params as params_utils
+
+RE_SCALE = re.compile(r'scale=(-?\d+):(-?\d+)')
+
+
+def get_scale(params):
+    """
+    Returns the `(width, height)` of the scale filter, where a value
+    below 1 means the size is derived from the other one.
+    """
+    match = RE_SCALE.search(params_utils.get_video_filter(params) or '')
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def _get_target_height(scale, media_info):
+    width, height = scale
+    if height > 0:
+        return height
+    return width * media_info['height'] / float(media_info['width'])
+
+
+def _exceeds_source(scale, media_info):
+    return _get_target_height(scale, media_info) > media_info['height']
+
+
+def _clamp_scale(params, media_info):
+    width, height = get_scale(params)
+    # most encoders require even dimensions
+    if height > 0:
+        replacement = 'scale={:d}:{:d}'.format(
+            width, media_info['height'] // 2 * 2)
+    else:
+        replacement = 'scale={:d}:{:d}'.format(
+            media_info['width'] // 2 * 2, height)
+    video_filter = RE_SCALE.sub(replacement,
+                                params_utils.get_video_filter(params), 1)
+    return params_utils.set_option(params, '-vf', video_filter,
+                                   aliases=params_utils.VIDEO_FILTER_OPTIONS)
+
+
+def _clamp_frame_rate(params, media_info):
+    frame_rate = media_info.get('frame_rate')
+    target = params_utils.get_option(params, '-r')
+    try:
+        if frame_rate and target and float(target) >= frame_rate:
+            return params_utils.remove_option(params, '-r')
+    except ValueError:
+        # e.g. `ntsc` or fractions
+        pass
+    return params
+
+
+def _clamp_bitrate(params, media_info):
+    bit_rate = media_info.get('bit_rate')
+    target = params_utils.parse_bitrate(params_utils.get_option(params,
+                                                                '-b:v'))
+    if not bit_rate or not target or target <= bit_rate:
+        return params
+
+    value = '{:d}k'.format(max(1, bit_rate // 1000))
+    params = params_utils.set_option(params, '-b:v', value)
+    if params_utils.has_option(params, '-maxrate'):
+        params = params_utils.set_option(params, '-maxrate', value)
+    if params_utils.has_option(params, '-bufsize'):
+        params = params_utils.set_option(
+            params, '-bufsize', '{:d}k'.format(max(1, bit_rate // 500)))
+    return params
+
+
+def _scale_bitrate(params, name, factor):
+    bitrate = params_utils.parse_bitrate(params_utils.get_option(params,
+                                                                 name))
+    if not bitrate:
+        return params
+    return params_utils.set_option(
+        params, name, '{:d}k'.format(max(1, int(bitrate * factor) // 1000)))
+
+
+def scale_bitrates(formats, factor):
+    """
+    Returns copies of the formats with their bitrates (`-b:v`, `-maxrate`
+    and `-bufsize`) multiplied by `factor`. Constant quality settings like
+    `-crf` already adapt to the content and are kept.
+    """
+    if factor == 1:
+        return formats
+
+    scaled = []
+    for options in formats:
+        if 'params' not in options:
+            scaled.append(options)
+            continue
+        params = options['params']
+        for name in ('-b:v', '-maxrate', '-bufsize'):
+            params = _scale_bitrate(params, name, factor)
+        scaled.append(dict(options, params=params))
+    return scaled
+
+
+def plan_formats(formats, media_info):
+    """
+    Returns the formats which should be encoded for a source with the
+    given media info. Adjusted formats are copies with changed `params`.
+    """
+    # formats above the source size are only needed if the smaller formats
+    # of the same container do not reach it
+    largest_below = {}
+    smallest_above = {}
+    for options in formats:
+        scale = get_scale(options.get('params', []))
+        if scale is None:
+            continue
+        extension = options.get('extension')
+        height = _get_target_height(scale, media_info)
+        if height <= media_info['height']:
+            largest_below[extension] = max(
+                height, largest_below.get(extension, 0))
+        elif height < smallest_above.get(extension, (None, float('inf')))[1]:
+            smallest_above[extension] = (options, height)
+
+    clamped = [options for extension, (options, __) in smallest_above.items()
+               if largest_below.get(extension, 0) < media_info['height']]
+
+    planned = []
+    seen = set()
+    for options in formats:
+        if 'params' not in options:
+            planned.append(options)
+            continue
+
+        params = options['params']
+        scale = get_scale(params)
+        if scale is not None and _exceeds_source(scale, media_info):
+            if not any(options is item for item in clamped):
+                continue
+            params = _clamp_scale(params, media_info)
+        params = _clamp_frame_rate(params, media_info)
+        params = _clamp_bitrate(params, media_info)
+
+        key = (options.get('extension'), tuple(params))
+        if key in seen:
+            continue
+        seen.add(key)
+        planned.append(dict(options, params=params))
+    return planned
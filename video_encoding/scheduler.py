@@ -0,0 +1,64 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.db import connections
+
+from .backends import get_backend, get_backend_class
+from .config import settings
+
+
+class EncodingScheduler:
+    """
+    Runs encodes concurrently in a thread pool. The core budget is split
+    evenly between the encoder processes via `-threads`.
+
+    Each encode runs in its own thread, which uses its own database
+    connection for progress updates.
+    """
+
+    def __init__(self, max_workers=None, core_budget=None):
+        self.max_workers = max(
+            1, max_workers or settings.VIDEO_ENCODING_PARALLEL_ENCODES)
+        self.core_budget = (core_budget or
+                            settings.VIDEO_ENCODING_CORE_BUDGET or
+                            os.cpu_count() or 1)
+        self.threads = max(1, self.core_budget // self.max_workers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='video_encoding')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def get_backend(self):
+        """
+        Returns a backend which respects the threads share of an encode, if
+        the backend supports limiting its threads.
+        """
+        if get_backend_class().supports_threads:
+            return get_backend(threads=self.threads)
+        return get_backend()
+
+    def submit(self, fn, *args, **kwargs):
+        return self._executor.submit(self._run, fn, *args, **kwargs)
+
+    def _run(self, fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # connections are thread local and would leak otherwise
+            connections.close_all()
+
+    def wait(self, futures):
+        """
+        Waits for all futures and reraises the first error.
+        """
+        wait(futures)
+        for future in futures:
+            future.result()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
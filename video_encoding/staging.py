@@ -0,0 +1,107 @@
+"""
+Local staging of video files.
+
+Storages without local paths are downloaded in binary chunks to a scratch
+file. Staged files are reference counted, so concurrent users of the same
+file (probing, thumbnails, renditions) share one download, which is removed
+as soon as the last user releases it.
+"""
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from . import cache, metrics
+from .config import settings
+
+_lock = threading.Lock()
+_staged = {}
+
+
+class StagedFile:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.references = 0
+        self.path = None
+        self.is_temporary = False
+
+
+def get_local_path(fieldfile):
+    """
+    Returns the path of the file if the storage provides one.
+    """
+    try:
+        return fieldfile.storage.path(fieldfile.name)
+    except (NotImplementedError, AttributeError):
+        return None
+
+
+def download(fieldfile, chunk_size=None):
+    """
+    Streams a file from its storage to a new scratch file and returns its
+    path.
+    """
+    chunk_size = chunk_size or settings.VIDEO_ENCODING_STAGING_CHUNK_SIZE
+    __, extension = os.path.splitext(fieldfile.name)
+    local_file = tempfile.NamedTemporaryFile(
+        suffix=extension, dir=settings.VIDEO_ENCODING_STAGING_DIR,
+        delete=False)
+    try:
+        with local_file, fieldfile.storage.open(fieldfile.name, 'rb') as f:
+            for chunk in f.chunks(chunk_size):
+                local_file.write(chunk)
+    except Exception:
+        os.unlink(local_file.name)
+        raise
+    return local_file.name
+
+
+def acquire(fieldfile):
+    """
+    Returns a local path of the file. Each call has to be paired with a
+    call of `release`.
+    """
+    key = cache.get_fieldfile_key(fieldfile)
+    with _lock:
+        staged = _staged.setdefault(key, StagedFile())
+        staged.references += 1
+
+    try:
+        with staged.lock:
+            if staged.path is None:
+                staged.path = get_local_path(fieldfile)
+                if staged.path is None:
+                    with metrics.timer('staging'):
+                        staged.path = download(fieldfile)
+                    staged.is_temporary = True
+                    metrics.increment('staging.bytes',
+                                      os.path.getsize(staged.path))
+    except Exception:
+        release(fieldfile)
+        raise
+    return staged.path
+
+
+def release(fieldfile):
+    key = cache.get_fieldfile_key(fieldfile)
+    with _lock:
+        staged = _staged[key]
+        staged.references -= 1
+        if staged.references > 0:
+            return
+        del _staged[key]
+
+    if staged.is_temporary:
+        os.unlink(staged.path)
+
+
+@contextmanager
+def stage(fieldfile):
+    """
+    Provides a local path of the file for the duration of the block.
+    """
+    path = acquire(fieldfile)
+    try:
+        yield path
+    finally:
+        release(fieldfile)
@@ -1,16 +1,20 @@
 import os
+import shutil
 import tempfile
 
 from django.apps import apps
 from django.contrib.contenttypes.models import ContentType
-from django.core.files import File
 
-from video_encoding.utils import get_fieldfile_local_path
+from . import cache, metrics, uploads
 from .backends import get_backend
 from .config import settings
-from .exceptions import VideoEncodingError
+from .context import ConversionContext
+from .exceptions import EncodingCancelled, VideoEncodingError
 from .fields import VideoField
-from .models import Format
+from .models import EncodedOutput, Format
+from .planning import plan_formats, scale_bitrates
+from .scheduler import EncodingScheduler
+from .uploads import Uploader
 
 
 def convert_all_videos(app_label, model_name, object_pk):
@@ -22,6 +26,7 @@ def convert_all_videos(app_label, model_name, object_pk):
     instance = Model.objects.get(pk=object_pk)
 
     # search for `VideoFields`
+    fieldfiles = []
     fields = instance._meta.fields
     for field in fields:
         if isinstance(field, VideoField):
@@ -29,26 +34,171 @@ def convert_all_videos(app_label, model_name, object_pk):
                 # ignore empty fields
                 continue
 
-            # trigger conversion
-            fieldfile = getattr(instance, field.name)
-            convert_video(fieldfile)
+            fieldfiles.append(getattr(instance, field.name))
 
+    # trigger conversion
+    convert_videos(fieldfiles)
 
-def convert_video(fieldfile, force=False):
+
+def convert_video(fieldfile, force=False, formats=None, backend=None,
+                  cancel_token=None):
     """
-    Converts a given video file into all defined formats.
+    Converts a given video file into all defined formats or only into the
+    formats named in `formats`. Running encodes are stopped when
+    `cancel_token` is cancelled or the video is deleted or replaced.
+
+    Returns the errors of failed formats by format name.
     """
-    instance = fieldfile.instance
-    field = fieldfile.field
+    if settings.VIDEO_ENCODING_PARALLEL_ENCODES > 1 and backend is None:
+        return convert_videos([fieldfile], force=force, formats=formats,
+                              cancel_token=cancel_token)[0]
+
+    encoding_backend = backend or get_backend()
+
+    errors = {}
+    with metrics.timer('convert'), ConversionContext(
+            fieldfile, encoding_backend, cancel_token) as context:
+        for encode, args in _get_encode_jobs(context, force, formats):
+            errors.update(encode(*args))
+    return errors
+
+
+def convert_videos(fieldfiles, force=False, formats=None, cancel_token=None):
+    """
+    Converts the given video files into all defined formats.
+
+    If `VIDEO_ENCODING_PARALLEL_ENCODES` is greater than 1, the formats of
+    all videos are encoded concurrently.
+
+    Returns the errors of failed formats for each video.
+    """
+    if settings.VIDEO_ENCODING_PARALLEL_ENCODES <= 1:
+        return [convert_video(fieldfile, force=force, formats=formats,
+                              cancel_token=cancel_token)
+                for fieldfile in fieldfiles]
+
+    contexts = []
+    try:
+        timer = metrics.timer('convert', videos=len(fieldfiles))
+        # the scheduler waits for running encodes before sources are removed
+        with timer, EncodingScheduler() as scheduler:
+            futures = []
+            for fieldfile in fieldfiles:
+                context = ConversionContext(
+                    fieldfile, scheduler.get_backend(), cancel_token)
+                contexts.append(context)
+                futures.append([
+                    scheduler.submit(encode, *args)
+                    for encode, args in _get_encode_jobs(context, force,
+                                                         formats)])
+            scheduler.wait([f for video in futures for f in video])
+    finally:
+        for context in contexts:
+            context.close()
+
+    results = []
+    for video_futures in futures:
+        errors = {}
+        for future in video_futures:
+            errors.update(future.result())
+        results.append(errors)
+    return results
+
+
+def _get_encode_jobs(context, force, names=None):
+    """
+    Returns a list of `(function, args)` encoding all pending formats.
+    """
+    formats = settings.VIDEO_ENCODING_FORMATS[context.backend.name]
+    if settings.VIDEO_ENCODING_PLAN_FORMATS:
+        formats = plan_formats(formats, context.media_info)
+    if names is not None:
+        formats = [options for options in formats if options['name'] in names]
+    pending = _get_pending_formats(context.fieldfile, formats, force)
+    if pending and settings.VIDEO_ENCODING_CONTENT_AWARE:
+        # the complexity is only estimated if anything is encoded
+        scaled = scale_bitrates([options for __, options in pending],
+                                context.bitrate_factor)
+        pending = [(video_format, options) for (video_format, __), options
+                   in zip(pending, scaled)]
+
+    jobs = [(_encode_hls, (context, video_format, options))
+            for video_format, options in pending if _is_hls(options)]
+    pending = [item for item in pending if not _is_hls(item[1])]
+
+    if settings.VIDEO_ENCODING_DEDUPLICATE and not force:
+        pending = [(video_format, options)
+                   for video_format, options in pending
+                   if not _reuse_output(context, video_format, options)]
+
+    if settings.VIDEO_ENCODING_SINGLE_DECODE:
+        # segmented or remuxed formats are processed on their own
+        combined = [(video_format, options)
+                    for video_format, options in pending
+                    if not _is_segmented(context, options) and
+                    not context.can_remux(options['params'])]
+        if len(combined) > 1:
+            jobs.append((_encode_combined, (context, combined)))
+            pending = [item for item in pending if item not in combined]
 
-    local_path, temp_file = get_fieldfile_local_path(fieldfile=fieldfile)
+    jobs.extend((_encode_format, (context, video_format, options))
+                for video_format, options in pending)
+    return jobs
 
-    filename = os.path.basename(local_path)
-    source_path = local_path
 
-    encoding_backend = get_backend()
+def _reuse_output(context, video_format, options):
+    """
+    Stores a copy of an existing output of the same content encoded with
+    the same params for the format. Returns whether one was found.
+
+    Each format owns its file, so deleting one of them keeps the others.
+    """
+    output = EncodedOutput.objects.filter(
+        source_hash=context.content_hash,
+        params_hash=EncodedOutput.get_params_hash(context.backend.name,
+                                                  options),
+    ).first()
+    if output is None:
+        return False
+
+    storage = video_format.file.storage
+    try:
+        if not storage.exists(output.file) or (
+                cache.get_storage_fingerprint(storage, output.file) !=
+                output.fingerprint):
+            # the format of the output was encoded again
+            raise FileNotFoundError(output.file)
+        name = uploads.copy(storage, output.file,
+                            _get_format_name(context, video_format, options),
+                            max_length=video_format.file.field.max_length)
+    except OSError:
+        # e.g. the format of the output was deleted
+        output.delete()
+        return False
+
+    video_format.file.set_stored_file(name, output.media_info)
+    video_format.update_progress(100)
+    return True
+
 
-    for options in settings.VIDEO_ENCODING_FORMATS[encoding_backend.name]:
+def _is_hls(options):
+    return options.get('kind') == 'hls'
+
+
+def _is_segmented(context, options):
+    return (options.get('segmented', False) and
+            context.duration >= settings.VIDEO_ENCODING_SEGMENT_MIN_DURATION)
+
+
+def _get_pending_formats(fieldfile, formats, force):
+    """
+    Returns a list of `(video_format, options)` which need to be encoded.
+    """
+    instance = fieldfile.instance
+    field = fieldfile.field
+
+    pending = []
+    for options in formats:
         video_format, created = Format.objects.get_or_create(
             object_id=instance.pk,
             content_type=ContentType.objects.get_for_model(instance),
@@ -57,41 +207,232 @@ def convert_video(fieldfile, force=False):
         # do not reencode if not requested
         if video_format.file and not force:
             continue
-        else:
-            # set progress to 0
-            video_format.reset_progress()
-
-        # TODO do not upscale videos
-
-        _, target_path = tempfile.mkstemp(
-            suffix='_{name}.{extension}'.format(**options))
-
-        try:
-            encoding = encoding_backend.encode(
-                source_path, target_path, options['params'])
-            while encoding:
-                try:
-                    progress = next(encoding)
-                except StopIteration:
-                    break
-                video_format.update_progress(progress)
-        except VideoEncodingError:
-            # TODO handle with more care
-            video_format.delete()
-            os.remove(target_path)
-            continue
 
-        # save encoded file
-        video_format.file.save(
-            '{filename}_{name}.{extension}'.format(filename=filename,
-                                                   **options),
-            File(open(target_path, mode='rb')))
+        # set progress to 0
+        video_format.reset_progress()
+        if video_format.cancelled:
+            video_format.set_cancelled(False)
+
+        pending.append((video_format, options))
+    return pending
+
+
+def _make_target_path(options):
+    fd, target_path = tempfile.mkstemp(
+        suffix='_{name}.{extension}'.format(**options))
+    os.close(fd)
+    return target_path
+
 
-        video_format.update_progress(100)  # now we are ready
+def _encode_format(context, video_format, options):
+    target_path = _make_target_path(options)
 
-        # remove temporary file
+    if (_is_segmented(context, options) and
+            not context.can_remux(options['params'])):
+        encoding = context.encode_segmented(
+            target_path, options['params'],
+            segment_duration=settings.VIDEO_ENCODING_SEGMENT_DURATION,
+            workers=settings.VIDEO_ENCODING_SEGMENT_WORKERS)
+    else:
+        encoding = context.encode(target_path, options['params'])
+
+    try:
+        _track_progress(context, encoding, [video_format])
+    except VideoEncodingError as e:
+        _discard_format(video_format, e)
         os.remove(target_path)
+        return {options['name']: e}
+
+    _save_format(context, video_format, options, target_path)
+    return {}
+
+
+def _encode_combined(context, pending):
+    """
+    Encodes all pending formats with a single decode of the source.
+    """
+    target_paths = [_make_target_path(options) for __, options in pending]
+    outputs = [(target_path, options['params'])
+               for target_path, (__, options) in zip(target_paths, pending)]
+
+    try:
+        encoding = context.encode_multiple(outputs)
+        _track_progress(context, encoding,
+                        [video_format for video_format, __ in pending])
+    except VideoEncodingError as e:
+        for (video_format, __), target_path in zip(pending, target_paths):
+            _discard_format(video_format, e)
+            os.remove(target_path)
+        return {options['name']: e for __, options in pending}
+
+    media_infos = [context.backend.get_media_info(target_path)
+                   for target_path in target_paths]
+
+    # store all outputs concurrently
+    storage = pending[0][0].file.storage
+    with Uploader(storage) as uploader:
+        for (video_format, options), target_path in zip(pending,
+                                                        target_paths):
+            uploader.submit(
+                _get_format_name(context, video_format, options),
+                target_path,
+                max_length=video_format.file.field.max_length)
+        names = uploader.wait()
+
+    for (video_format, options), name, media_info in zip(pending, names,
+                                                         media_infos):
+        _finish_format(context, video_format, options, name, media_info)
+    return {}
+
+
+def _encode_hls(context, video_format, options):
+    """
+    Encodes a HLS format and stores its playlists and segments in a
+    directory named after the path `upload_format_to` would use. Finished
+    segments are uploaded while the encoding continues.
+    """
+    formats = {item['name']: item for item in
+               settings.VIDEO_ENCODING_FORMATS[context.backend.name]}
+    renditions = [rendition if isinstance(rendition, dict)
+                  else formats[rendition]
+                  for rendition in options['renditions']]
+    if settings.VIDEO_ENCODING_PLAN_FORMATS:
+        renditions = plan_formats(renditions, context.media_info)
+    if settings.VIDEO_ENCODING_CONTENT_AWARE:
+        renditions = scale_bitrates(renditions, context.bitrate_factor)
+    renditions = [(rendition['name'], rendition['params'])
+                  for rendition in renditions]
+
+    directory = os.path.splitext(video_format.file.field.generate_filename(
+        video_format, 'master.m3u8'))[0]
+    storage = video_format.file.storage
+    uploaded = set()
+
+    def upload(uploader, final=False):
+        filenames = set(os.listdir(target_dir))
+        for filename in sorted(filenames - uploaded):
+            if not final and not _is_finished_segment(filename, filenames):
+                continue
+            uploaded.add(filename)
+            # playlists reference their files by name, so existing files
+            # are replaced instead of stored under an alternative name
+            name = '{}/{}'.format(directory, filename)
+            if storage.exists(name):
+                storage.delete(name)
+            # keep local files for probing the playlists
+            uploader.submit(name, os.path.join(target_dir, filename),
+                            keep_local=True)
+
+    target_dir = tempfile.mkdtemp(prefix='video_encoding_')
+    try:
+        with Uploader(storage) as uploader:
+            try:
+                encoding = context.encode_hls(
+                    target_dir, renditions, segment_duration=(
+                        settings.VIDEO_ENCODING_HLS_SEGMENT_DURATION))
+                _track_progress(context, encoding, [video_format],
+                                callback=lambda: upload(uploader))
+            except VideoEncodingError as e:
+                # remove the segments stored so far
+                for future in uploader.futures:
+                    if future.exception() is None:
+                        storage.delete(future.result())
+                _discard_format(video_format, e)
+                return {options['name']: e}
+
+            media_info = context.backend.get_media_info(
+                os.path.join(target_dir, 'master.m3u8'))
+            upload(uploader, final=True)
+            uploader.wait()
+
+        video_format.file.set_stored_file(
+            '{}/master.m3u8'.format(directory), media_info)
+        video_format.update_progress(100)
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+    return {}
+
+
+def _track_progress(context, encoding, video_formats, callback=None):
+    """
+    Runs an encoding and reports its progress to the given formats. As
+    soon as the conversion is cancelled the encoding is closed, which
+    kills its ffmpeg process.
+    """
+    name = ','.join(video_format.format for video_format in video_formats)
+    speed = None
+    try:
+        with metrics.timer('encode', format=name):
+            context.check_cancelled()
+            for progress in encoding:
+                context.check_cancelled()
+                speed = progress.speed or speed
+                for video_format in video_formats:
+                    video_format.update_progress(progress.percent)
+                if callback is not None:
+                    callback()
+    finally:
+        encoding.close()
+    if speed is not None:
+        metrics.observe('encode.speed', speed, format=name)
+
+
+def _discard_format(video_format, error):
+    if isinstance(error, EncodingCancelled):
+        # keep the format, so the cancellation is visible
+        video_format.reset_progress()
+        video_format.set_cancelled()
+    else:
+        # TODO handle with more care
+        video_format.delete()
+
+
+def _is_finished_segment(filename, filenames):
+    """
+    Segments are finished as soon as ffmpeg started the next one.
+    """
+    prefix, extension = os.path.splitext(filename)
+    prefix, __, number = prefix.rpartition('_')
+    if extension != '.m4s' or not number.isdigit():
+        return False
+    next_segment = '{}_{:0{}d}{}'.format(prefix, int(number) + 1,
+                                         len(number), extension)
+    return next_segment in filenames
+
+
+def _get_format_name(context, video_format, options):
+    filename = os.path.basename(context.source_path)
+    return video_format.file.field.generate_filename(
+        video_format, '{filename}_{name}.{extension}'.format(
+            filename=filename, **options))
+
+
+def _save_format(context, video_format, options, target_path):
+    """
+    Stores an encoded file, its media info is probed from the local copy.
+    """
+    media_info = context.backend.get_media_info(target_path)
+
+    name = uploads.store(video_format.file.storage,
+                         _get_format_name(context, video_format, options),
+                         target_path,
+                         max_length=video_format.file.field.max_length)
+
+    _finish_format(context, video_format, options, name, media_info)
+
+
+def _finish_format(context, video_format, options, name, media_info):
+    video_format.file.set_stored_file(name, media_info)
+    video_format.update_progress(100)  # now we are ready
 
-        if temp_file:
-            os.unlink(temp_file.name)
-            temp_file.close()
+    if settings.VIDEO_ENCODING_DEDUPLICATE:
+        EncodedOutput.objects.update_or_create(
+            source_hash=context.content_hash,
+            params_hash=EncodedOutput.get_params_hash(context.backend.name,
+                                                      options),
+            defaults={
+                'file': name,
+                'fingerprint': cache.get_storage_fingerprint(
+                    video_format.file.storage, name),
+                'media_info': media_info,
+            })
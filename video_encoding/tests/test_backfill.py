@@ -0,0 +1,35 @@
+from ..backfill import backfill_model
+from ..models import Format
+from .utils import MediaTestCase
+
+
+class BackfillTest(MediaTestCase):
+    def test_missing_files_are_counted(self):
+        first = self.make_source('videos/a.mp4')
+        missing = self.make_source('videos/b.mp4', size='320x240')
+        last = self.make_source('videos/c.mp4', size='320x240')
+        Format.objects.update(width=None, height=None, duration=None)
+        # e.g. removed from the storage by hand
+        Format.objects.filter(pk=missing.pk).update(file='videos/missing.mp4')
+
+        stats = backfill_model(Format, chunk_size=2, workers=2)
+
+        self.assertEqual(stats['rows'], 3)
+        self.assertEqual(stats['probed'], 3)
+        self.assertEqual(stats['updated'], 2)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['last_pk'], last.pk)
+        self.assertEqual(
+            list(Format.objects.order_by('pk').values_list(
+                'width', 'height', 'duration')),
+            [(160, 120, 2), (None, None, None), (320, 240, 2)])
+        first.refresh_from_db()
+        self.assertEqual(first.file.name, 'videos/a.mp4')
+
+    def test_filled_rows_are_skipped(self):
+        self.make_source('videos/a.mp4')
+
+        stats = backfill_model(Format)
+
+        self.assertEqual(stats['rows'], 0)
+        self.assertEqual(stats['probed'], 0)
@@ -0,0 +1,39 @@
+import os
+from unittest import mock
+
+from django.core.files.storage import FileSystemStorage
+
+from .. import cache
+from ..backends import get_backend
+from ..fields import VideoFieldFile
+from ..models import Format
+from .utils import MediaTestCase, make_video
+
+
+class FieldFileKeyTest(MediaTestCase):
+    def get_fieldfile(self, location, **kwargs):
+        make_video(os.path.join(location, 'videos/a.mp4'), **kwargs)
+        fieldfile = VideoFieldFile(None, Format._meta.get_field('file'),
+                                   'videos/a.mp4')
+        fieldfile.storage = FileSystemStorage(location=location)
+        return fieldfile
+
+    def test_storages_are_told_apart(self):
+        first = self.get_fieldfile(os.path.join(self.media_root, 'first'),
+                                   size='320x240')
+        second = self.get_fieldfile(os.path.join(self.media_root, 'second'),
+                                    size='160x120')
+
+        self.assertNotEqual(cache.get_fieldfile_key(first),
+                            cache.get_fieldfile_key(second))
+        self.assertEqual(first._get_video_info()['width'], 320)
+        self.assertEqual(second._get_video_info()['width'], 160)
+
+    def test_paths_are_not_cached(self):
+        video_path = make_video(os.path.join(self.media_root, 'temp.mp4'))
+
+        with mock.patch('video_encoding.cache.set_media_info') as set_info:
+            media_info = get_backend().get_media_info(video_path)
+
+        self.assertEqual(media_info['width'], 160)
+        set_info.assert_not_called()
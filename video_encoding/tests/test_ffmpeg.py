@@ -0,0 +1,366 @@
+import functools
+import io
+import os
+import shutil
+import signal
+import sys
+import tempfile
+from unittest import mock, skipUnless
+
+from django.test import SimpleTestCase, override_settings
+
+from .. import params as params_utils
+from ..backends.base import BaseEncodingBackend, Progress
+from ..backends.ffmpeg import FFmpegBackend
+from ..compat import which
+from ..exceptions import FFmpegTimeoutError
+from .utils import make_video
+
+
+class FFmpegTestCase(SimpleTestCase):
+    def setUp(self):
+        super(FFmpegTestCase, self).setUp()
+        self.backend = FFmpegBackend()
+        self.temp_dir = tempfile.mkdtemp(prefix='video_encoding_test_')
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+
+    def make_video(self, name='source.mp4', **kwargs):
+        return make_video(os.path.join(self.temp_dir, name), **kwargs)
+
+
+@override_settings(VIDEO_ENCODING_REMUX=True)
+class RemuxTest(FFmpegTestCase):
+    media_info = {
+        'duration': 10, 'width': 1280, 'height': 720, 'frame_rate': 25,
+        'bit_rate': 2000000, 'video_codec': 'h264', 'audio_codec': 'aac',
+        'pix_fmt': 'yuv420p', 'has_audio': True,
+    }
+    params = [
+        '-codec:v', 'libx264', '-crf', '20', '-preset', 'medium',
+        '-b:v', '3000k', '-maxrate', '3000k', '-bufsize', '6000k',
+        '-vf', 'scale=-2:720', '-codec:a', 'aac', '-b:a', '128k',
+        '-strict', '-2',
+    ]
+
+    def can_remux(self, params):
+        return self.backend.can_remux(self.media_info, params)
+
+    def test_accepted(self):
+        self.assertTrue(self.can_remux(self.params))
+        self.assertTrue(self.can_remux(
+            params_utils.set_option(self.params, '-vf', 'scale=1280:720')))
+        self.assertTrue(self.can_remux(
+            params_utils.remove_video_filter(self.params) + ['-r', '30']))
+
+    def test_rejected_options(self):
+        for options in (['-vf', 'drawtext=text=x'],
+                        ['-vf', 'yadif,scale=-2:720'],
+                        ['-vf', 'scale=-2:480'], ['-vf', 'scale=-2:1080'],
+                        ['-profile:v', 'baseline'], ['-level', '3.0'],
+                        ['-t', '5'], ['-an'], ['-ac', '1'], ['-ar', '44100'],
+                        ['-af', 'loudnorm'], ['-r', '24'],
+                        ['-b:v', '1000k', '-maxrate', '1000k'],
+                        ['-pix_fmt', 'yuv444p'], ['-codec:v', 'libx265']):
+            params = list(self.params)
+            for name, value in zip(options[::2], options[1::2]):
+                params = params_utils.set_option(params, name, value)
+            if len(options) == 1:
+                params += options
+            self.assertFalse(self.can_remux(params), options)
+
+    @override_settings(VIDEO_ENCODING_REMUX=False)
+    def test_disabled(self):
+        self.assertFalse(self.can_remux(self.params))
+
+    def test_muxer_options(self):
+        params = self.params + ['-movflags', '+frag_keyframe', '-f', 'mp4']
+
+        cmds = self.backend._get_encode_cmds('source.mov', 'target.mp4',
+                                             params, self.media_info)
+
+        self.assertEqual(cmds[-8:], ['-c', 'copy', '-y', '-f', 'mp4',
+                                     '-movflags', '+frag_keyframe',
+                                     'target.mp4'])
+
+    def test_remux(self):
+        video_path = self.make_video(size='1280x720')
+        media_info = self.backend.get_media_info(video_path)
+        target_path = os.path.join(self.temp_dir, 'target.mp4')
+        # the noise of the test video needs a high bitrate
+        params = params_utils.set_option(self.params, '-maxrate', '20M')
+        self.assertIn('copy', self.backend._get_encode_cmds(
+            video_path, target_path, params, media_info))
+
+        for __ in self.backend.encode(video_path, target_path, params,
+                                      media_info=media_info):
+            pass
+
+        remuxed = self.backend.get_media_info(target_path)
+        self.assertEqual((remuxed['width'], remuxed['height']), (1280, 720))
+        self.assertAlmostEqual(remuxed['duration'], 2, delta=0.1)
+
+
+@skipUnless(sys.platform.startswith('linux'), "Process limits need Linux.")
+class ProcessLimitsTest(FFmpegTestCase):
+    def test_limits(self):
+        backend = FFmpegBackend(nice=5, cpu_affinity=[0],
+                                memory_limit=2 ** 32)
+
+        process = backend._spawn([
+            which('sh'), '-c',
+            'nice; ulimit -v; grep Cpus_allowed_list /proc/self/status'])
+        stdout, __ = process.communicate()
+
+        niceness, memory_limit, cpus = stdout.decode().splitlines()
+        self.assertEqual(int(niceness), os.nice(0) + 5)
+        self.assertEqual(int(memory_limit), 2 ** 32 // 1024)
+        self.assertEqual(cpus.split()[-1], '0')
+
+    def test_encode(self):
+        backend = FFmpegBackend(nice=5, cpu_affinity=[0],
+                                memory_limit=2 ** 32)
+
+        media_info = backend.get_media_info(self.make_video())
+
+        self.assertEqual(media_info['width'], 160)
+
+
+class ProgressTest(FFmpegTestCase):
+    def parse(self, output, total_time=4):
+        stream = io.BytesIO(output.encode('ascii'))
+        return list(self.backend._iter_progress(stream, total_time))
+
+    def test_blocks(self):
+        progress = self.parse(
+            'frame=50\nfps=25.00\nstream_0_0_q=28.0\nbitrate=N/A\n'
+            'out_time_us=1000000\nout_time_ms=1000000\n'
+            'out_time=00:00:01.000000\nspeed=1.5x\nprogress=continue\n'
+            'frame=100\nfps=N/A\nout_time_us=4100000\nspeed=N/A\n'
+            'progress=end\n')
+
+        self.assertEqual(progress, [
+            Progress(percent=25.0, frame=50, fps=25.0, speed=1.5,
+                     out_time=1.0),
+            Progress(percent=100.0, frame=100, fps=None, speed=None,
+                     out_time=4.1),
+        ])
+
+    def test_values_of_a_block(self):
+        # values are not carried over into the next block
+        progress = self.parse('frame=50\nprogress=continue\n'
+                              'out_time_ms=2000000\nprogress=continue\n')
+
+        self.assertEqual(progress[1], Progress(50.0, None, None, None, 2.0))
+
+    def test_unknown_time(self):
+        progress = self.parse('out_time_us=N/A\nprogress=continue\n'
+                              'out_time_us=-23000\nprogress=continue\n'
+                              'out_time_us=1000000\nprogress=end\n',
+                              total_time=None)
+
+        self.assertEqual([item.percent for item in progress], [0, 0, 0])
+        self.assertEqual([item.out_time for item in progress],
+                         [None, -0.023, 1.0])
+
+    def test_other_lines(self):
+        values = {}
+
+        self.assertIsNone(self.backend._parse_progress_line(
+            b'Press [q] to stop\n', values, 4))
+        self.assertIsNone(self.backend._parse_progress_line(
+            b' frame = 12 \n', values, 4))
+        self.assertEqual(values, {'frame': '12'})
+
+
+class WatchdogTest(FFmpegTestCase):
+    @override_settings(VIDEO_ENCODING_STALL_TIMEOUT=1)
+    def test_stall_timeout(self):
+        spawn = self.backend._spawn
+        processes = []
+
+        def record(cmds):
+            processes.append(spawn(cmds))
+            return processes[-1]
+
+        target_path = os.path.join(self.temp_dir, 'target.mp4')
+        params = ['-codec:v', 'libx264', '-preset', 'ultrafast']
+        # ffmpeg waits for its input on the open stdin pipe
+        with mock.patch.object(self.backend, '_spawn', side_effect=record):
+            with self.assertRaisesRegex(FFmpegTimeoutError,
+                                        'made no progress for 1s'):
+                for __ in self.backend.encode('pipe:0', target_path, params,
+                                              media_info={'duration': 2}):
+                    pass
+
+        self.assertEqual(processes[0].returncode, -signal.SIGKILL)
+
+
+class StoryboardTest(FFmpegTestCase):
+    def get_storyboard(self, video_path, **kwargs):
+        sprite_paths, vtt_path = self.backend.get_storyboard(video_path,
+                                                             **kwargs)
+        self.addCleanup(shutil.rmtree, os.path.dirname(vtt_path),
+                        ignore_errors=True)
+        with open(vtt_path) as vtt_file:
+            return sprite_paths, vtt_file.read()
+
+    def test_fewer_keyframes_than_images(self):
+        # a single keyframe
+        video_path = self.make_video(duration=7, params=['-g', '1000'])
+
+        sprite_paths, vtt = self.get_storyboard(video_path, interval=1,
+                                                columns=4, rows=1)
+
+        self.assertEqual(len(sprite_paths), 2)
+        self.assertEqual(vtt.count(' --> '), 7)
+        self.assertIn('00:00:06.000 --> 00:00:07.000\n'
+                      'sprite_002.jpg#xywh=320,0,160,120', vtt)
+
+    def test_images_are_seeked(self):
+        video_path = self.make_video(duration=12)
+
+        extract_frames = FFmpegBackend._extract_storyboard_frames
+        with mock.patch.object(FFmpegBackend, '_extract_storyboard_frames',
+                               autospec=True,
+                               side_effect=extract_frames) as extract:
+            sprite_paths, vtt = self.get_storyboard(video_path, interval=1,
+                                                    columns=5, rows=2)
+
+        self.assertEqual(len(sprite_paths), 2)
+        self.assertEqual(vtt.count(' --> '), 12)
+        self.assertIn('00:00:11.000 --> 00:00:12.000\n'
+                      'sprite_002.jpg#xywh=160,0,160,120', vtt)
+        self.assertEqual([call[0][2] for call in extract.call_args_list],
+                         [[0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [10, 11]])
+
+    def test_shorter_than_interval(self):
+        video_path = self.make_video(duration=5)
+
+        sprite_paths, vtt = self.get_storyboard(video_path)
+
+        self.assertEqual(len(sprite_paths), 1)
+        self.assertEqual(vtt.count(' --> '), 1)
+
+
+class SegmentedTest(FFmpegTestCase):
+    params = ['-codec:v', 'libx264', '-preset', 'ultrafast',
+              '-codec:a', 'aac', '-b:a', '64k']
+
+    def encode_segmented(self, backend, **kwargs):
+        video_path = self.make_video(duration=4, params=['-g', '25'])
+        target_path = os.path.join(self.temp_dir, 'target.mp4')
+        with mock.patch.object(
+                FFmpegBackend, '_encode_segments', autospec=True,
+                side_effect=FFmpegBackend._encode_segments) as encode:
+            for __ in backend.encode_segmented(
+                    video_path, target_path, self.params,
+                    segment_duration=1, **kwargs):
+                pass
+        self.assertTrue(os.path.getsize(target_path))
+        __, segments, __, threads, workers, __ = encode.call_args[0]
+        self.assertEqual(len(segments), 4)
+        return threads, workers
+
+    @mock.patch('os.cpu_count', return_value=8)
+    def test_workers_are_limited_to_threads(self, cpu_count):
+        backend = FFmpegBackend(threads=2)
+
+        self.assertEqual(self.encode_segmented(backend), (1, 2))
+        self.assertEqual(self.encode_segmented(backend, workers=4), (1, 2))
+        self.assertEqual(self.encode_segmented(backend, workers=1), (2, 1))
+
+    @mock.patch('os.cpu_count', return_value=4)
+    def test_threads_are_shared(self, cpu_count):
+        backend = FFmpegBackend(threads=8)
+
+        self.assertEqual(self.encode_segmented(backend), (2, 4))
+        self.assertEqual(self.encode_segmented(backend, workers=3), (2, 3))
+
+    @mock.patch('os.cpu_count', return_value=4)
+    def test_core_budget(self, cpu_count):
+        backend = FFmpegBackend()
+
+        self.assertEqual(self.encode_segmented(backend), (1, 4))
+        with self.settings(VIDEO_ENCODING_CORE_BUDGET=2):
+            self.assertEqual(self.encode_segmented(backend), (1, 2))
+        with self.settings(VIDEO_ENCODING_CORE_BUDGET=8):
+            self.assertEqual(self.encode_segmented(backend), (2, 4))
+
+
+class MultipleTest(FFmpegTestCase):
+    def encode_multiple(self, encode_multiple):
+        video_path = self.make_video(duration=2, size='320x240')
+        outputs = [
+            (os.path.join(self.temp_dir, '{}.mp4'.format(height)),
+             ['-codec:v', 'libx264', '-preset', 'ultrafast',
+              '-vf', 'scale=-2:{}'.format(height),
+              '-codec:a', 'aac', '-b:a', '64k'])
+            for height in (96, 120)
+        ]
+
+        percents = [progress.percent for progress in
+                    encode_multiple(video_path, outputs)]
+
+        self.assertEqual(percents, sorted(percents))
+        self.assertEqual(percents[-1], 100)
+        for (target_path, __), height in zip(outputs, (96, 120)):
+            media_info = self.backend.get_media_info(target_path)
+            self.assertEqual(media_info['height'], height)
+            self.assertAlmostEqual(media_info['duration'], 2, delta=0.1)
+        return percents
+
+    def test_outputs(self):
+        self.encode_multiple(self.backend.encode_multiple)
+
+    def test_fallback(self):
+        # backends without support encode one output after another
+        with mock.patch.object(FFmpegBackend, 'encode', autospec=True,
+                               side_effect=FFmpegBackend.encode) as encode:
+            percents = self.encode_multiple(functools.partial(
+                BaseEncodingBackend.encode_multiple, self.backend))
+
+        self.assertEqual(encode.call_count, 2)
+        # the first output is reported as the first half
+        self.assertIn(50, percents)
+
+
+class HLSTest(FFmpegTestCase):
+    renditions = [
+        ('low', ['-codec:v', 'libx264', '-preset', 'ultrafast',
+                 '-vf', 'scale=-2:96', '-b:v', '200k',
+                 '-codec:a', 'aac', '-b:a', '64k']),
+        ('high', ['-codec:v', 'libx264', '-preset', 'ultrafast',
+                  '-vf', 'scale=-2:120', '-r', '15', '-b:v', '400k',
+                  '-codec:a', 'aac', '-b:a', '64k']),
+    ]
+
+    def read(self, target_dir, name):
+        with open(os.path.join(target_dir, name)) as playlist_file:
+            return playlist_file.read()
+
+    def test_segments_are_aligned(self):
+        # keyframes of the source every 10s
+        video_path = self.make_video(duration=10, params=['-g', '250'])
+        target_dir = os.path.join(self.temp_dir, 'hls')
+        os.mkdir(target_dir)
+
+        for __ in self.backend.encode_hls(video_path, target_dir,
+                                          self.renditions,
+                                          segment_duration=4):
+            pass
+
+        for name, __ in self.renditions:
+            playlist = self.read(target_dir, '{}.m3u8'.format(name))
+            durations = [float(line[8:].rstrip(','))
+                         for line in playlist.splitlines()
+                         if line.startswith('#EXTINF:')]
+            self.assertEqual([round(value) for value in durations],
+                             [4, 4, 2])
+        master = self.read(target_dir, 'master.m3u8')
+        # constrained baseline profile of the ultrafast preset
+        self.assertRegex(master, 'RESOLUTION=128x96,'
+                         'CODECS="avc1\\.42c0[0-9a-f]{2},mp4a\\.40\\.2"\n'
+                         'low\\.m3u8')
+        self.assertRegex(master, 'RESOLUTION=160x120,'
+                         'CODECS="avc1\\.42c0[0-9a-f]{2},mp4a\\.40\\.2"\n'
+                         'high\\.m3u8')
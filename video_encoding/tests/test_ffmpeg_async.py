@@ -0,0 +1,96 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from ..backends.ffmpeg_async import AsyncFFmpegBackend
+from ..exceptions import InvalidTimeError
+from .utils import make_video
+
+
+class RecordingBackend(AsyncFFmpegBackend):
+    """
+    Keeps the last spawned process, to check it has been stopped.
+    """
+
+    async def _async_spawn(self, cmds):
+        self.process = await super(RecordingBackend, self)._async_spawn(cmds)
+        return self.process
+
+
+class AsyncFFmpegTest(SimpleTestCase):
+    params = ['-codec:v', 'libx264', '-preset', 'ultrafast',
+              '-vf', 'scale=-2:96', '-codec:a', 'aac', '-b:a', '64k']
+
+    def setUp(self):
+        super(AsyncFFmpegTest, self).setUp()
+        self.backend = RecordingBackend()
+        self.temp_dir = tempfile.mkdtemp(prefix='video_encoding_test_')
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.video_path = make_video(
+            os.path.join(self.temp_dir, 'source.mp4'), size='320x240')
+
+    async def encode(self, target_path, params):
+        return [progress async for progress in self.backend.async_encode(
+            self.video_path, target_path, params)]
+
+    def test_get_media_info(self):
+        media_info = asyncio.run(
+            self.backend.async_get_media_info(self.video_path))
+
+        self.assertEqual(media_info,
+                         self.backend.get_media_info(self.video_path))
+        self.assertAlmostEqual(media_info['duration'], 2, delta=0.1)
+        self.assertEqual((media_info['width'], media_info['height']),
+                         (320, 240))
+
+    def test_get_thumbnail(self):
+        image_path = asyncio.run(
+            self.backend.async_get_thumbnail(self.video_path, at_time=1))
+        self.addCleanup(os.unlink, image_path)
+
+        self.assertTrue(os.path.getsize(image_path))
+
+    def test_thumbnail_after_end(self):
+        with self.assertRaises(InvalidTimeError):
+            asyncio.run(
+                self.backend.async_get_thumbnail(self.video_path, at_time=5))
+
+    def test_encode(self):
+        target_path = os.path.join(self.temp_dir, 'target.mp4')
+
+        percents = [progress.percent for progress in
+                    asyncio.run(self.encode(target_path, self.params))]
+
+        self.assertEqual(percents, sorted(percents))
+        self.assertEqual(percents[-1], 100)
+        media_info = self.backend.get_media_info(target_path)
+        self.assertEqual(media_info['height'], 96)
+        self.assertAlmostEqual(media_info['duration'], 2, delta=0.1)
+
+    def test_cancel_encode(self):
+        target_path = os.path.join(self.temp_dir, 'target.mp4')
+        # the realtime filter makes the encode take as long as the video
+        params = ['-codec:v', 'libx264', '-preset', 'ultrafast',
+                  '-vf', 'realtime', '-an']
+
+        async def cancel():
+            started = asyncio.Event()
+
+            async def encode():
+                async for __ in self.backend.async_encode(
+                        self.video_path, target_path, params):
+                    started.set()
+
+            task = asyncio.ensure_future(encode())
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel())
+
+        # killed instead of finishing the encode
+        self.assertLess(self.backend.process.returncode, 0)
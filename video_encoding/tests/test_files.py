@@ -0,0 +1,52 @@
+from unittest import mock
+
+from django.test import override_settings
+
+from ..fields import VideoFieldFile
+from ..models import Format
+from .utils import MediaTestCase, RemoteStorage
+
+
+class HeaderProbeTest(MediaTestCase):
+    def setUp(self):
+        super(HeaderProbeTest, self).setUp()
+        self.make_source('videos/a.mp4', size='320x240')
+
+    def get_fieldfile(self, storage=None):
+        fieldfile = VideoFieldFile(None, Format._meta.get_field('file'),
+                                   'videos/a.mp4')
+        if storage is not None:
+            fieldfile.storage = storage
+        return fieldfile
+
+    def test_headers_are_cached(self):
+        self.assertEqual(self.get_fieldfile().width, 320)
+
+        with mock.patch('video_encoding.headers.read_media_info') as read:
+            fieldfile = self.get_fieldfile()
+            self.assertEqual(fieldfile.height, 240)
+        read.assert_not_called()
+        self.assertFalse(hasattr(fieldfile, '_info_cache'))
+
+    def test_cached_media_info_is_used(self):
+        self.get_fieldfile()._get_video_info()
+
+        with mock.patch('video_encoding.headers.read_media_info') as read:
+            self.assertEqual(self.get_fieldfile().duration, 2)
+        read.assert_not_called()
+
+    def test_remote_storages_are_probed(self):
+        storage = RemoteStorage(location=self.media_root)
+
+        with mock.patch('video_encoding.headers.read_media_info') as read:
+            self.assertEqual(self.get_fieldfile(storage).width, 320)
+        read.assert_not_called()
+
+    @override_settings(VIDEO_ENCODING_HEADER_PROBE_STORAGES=[
+        'video_encoding.tests.utils.RemoteStorage'])
+    def test_storages_with_range_reads(self):
+        storage = RemoteStorage(location=self.media_root)
+
+        with mock.patch('video_encoding.staging.download') as download:
+            self.assertEqual(self.get_fieldfile(storage).width, 320)
+        download.assert_not_called()
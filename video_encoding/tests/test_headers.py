@@ -0,0 +1,225 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+
+from django.test import SimpleTestCase
+
+from .. import headers
+from .utils import make_video
+
+
+def box(box_type, *children, **kwargs):
+    """
+    Builds a MP4 box. `large` uses a 64 bit size, `open_ended` the size 0
+    of a box which extends to the end of the file.
+    """
+    payload = b''.join(children)
+    if kwargs.get('large'):
+        return struct.pack('>I4sQ', 1, box_type, 16 + len(payload)) + payload
+    if kwargs.get('open_ended'):
+        return struct.pack('>I4s', 0, box_type) + payload
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def mvhd(timescale, duration, version=0):
+    if version == 1:
+        fields = struct.pack('>B3xQQIQ', 1, 0, 0, timescale, duration)
+    else:
+        fields = struct.pack('>B3xIIII', 0, 0, 0, timescale, duration)
+    return box(b'mvhd', fields, bytes(80))
+
+
+def trak(handler, entry_type, entry):
+    hdlr = box(b'hdlr', bytes(8), handler, bytes(12), b'\0')
+    stsd = box(b'stsd', struct.pack('>4xI', 1), box(entry_type, entry))
+    stbl = box(b'stbl', stsd)
+    return box(b'trak', box(b'mdia', hdlr, box(b'minf', stbl)))
+
+
+def video_trak(width=320, height=240):
+    # data reference index, pre-defined values and reserved fields precede
+    # the size, the resolution, frame count, compressor name and depth
+    # follow it
+    entry = (struct.pack('>6xH16xHH', 1, width, height) + bytes(50) +
+             box(b'avcC', bytes([1, 0x64, 0x00, 0x1f]), bytes(4)))
+    return trak(b'vide', b'avc1', entry)
+
+
+def audio_trak():
+    config = bytes([0x05, 2, 0x12, 0x10])
+    decoder = bytes([0x04, 13 + len(config), 0x40, 0x15]) + bytes(11)
+    es = bytes([0x03, 3 + len(decoder + config), 0, 1, 0])
+    entry = (struct.pack('>6xH8xHH4xI', 1, 2, 16, 48000 << 16) +
+             box(b'esds', bytes(4), es, decoder, config))
+    return trak(b'soun', b'mp4a', entry)
+
+
+def mp4(*boxes):
+    return box(b'ftyp', b'isom', bytes(4), b'isomavc1') + b''.join(boxes)
+
+
+def element(element_id, *children, **kwargs):
+    """
+    Builds an EBML element, `unknown_size` marks the size as unknown like
+    live streams do.
+    """
+    payload = b''.join(children)
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+    if kwargs.get('unknown_size'):
+        size = b'\x01' + b'\xff' * 7
+    else:
+        size = b'\x01' + len(payload).to_bytes(7, 'big')
+    return id_bytes + size + payload
+
+
+def uint(element_id, value, length=2):
+    return element(element_id, value.to_bytes(length, 'big'))
+
+
+def info(duration, timecode_scale=1000000):
+    return element(headers.EBML_INFO,
+                   uint(headers.EBML_TIMECODE_SCALE, timecode_scale, 4),
+                   element(headers.EBML_DURATION, struct.pack('>d', duration)))
+
+
+def tracks(width=320, height=240):
+    video = element(headers.EBML_VIDEO,
+                    uint(headers.EBML_PIXEL_WIDTH, width),
+                    uint(headers.EBML_PIXEL_HEIGHT, height))
+    entry = element(headers.EBML_TRACK_ENTRY,
+                    uint(headers.EBML_TRACK_TYPE, headers.EBML_VIDEO_TRACK,
+                         1),
+                    video)
+    return element(headers.EBML_TRACKS, entry)
+
+
+def matroska(*children, **kwargs):
+    return (element(headers.EBML_HEADER, bytes(4)) +
+            element(headers.EBML_SEGMENT, *children, **kwargs))
+
+
+def read(data):
+    return headers.read_media_info(io.BytesIO(data))
+
+
+class MP4Test(SimpleTestCase):
+    def test_header(self):
+        data = mp4(box(b'moov', mvhd(1000, 2500), audio_trak(),
+                       video_trak()),
+                   box(b'mdat', bytes(64)))
+
+        self.assertEqual(read(data),
+                         {'duration': 2.5, 'width': 320, 'height': 240})
+
+    def test_64_bit_mvhd(self):
+        data = mp4(box(b'moov', mvhd(90000, 2 ** 33, version=1),
+                       video_trak()))
+
+        self.assertEqual(read(data)['duration'], 2 ** 33 / 90000.0)
+
+    def test_64_bit_box_size(self):
+        data = mp4(box(b'mdat', bytes(64), large=True),
+                   box(b'moov', mvhd(1000, 2500), video_trak(), large=True))
+
+        self.assertEqual(read(data),
+                         {'duration': 2.5, 'width': 320, 'height': 240})
+
+    def test_box_until_end_of_file(self):
+        data = mp4(box(b'moov', mvhd(1000, 2500), video_trak(),
+                       open_ended=True))
+
+        self.assertEqual(read(data),
+                         {'duration': 2.5, 'width': 320, 'height': 240})
+
+    def test_fragmented(self):
+        data = mp4(box(b'moov', mvhd(1000, 0), video_trak(),
+                       box(b'mvex', bytes(8))),
+                   box(b'moof', bytes(16)), box(b'mdat', bytes(64)))
+
+        self.assertIsNone(read(data))
+
+    def test_without_video(self):
+        data = mp4(box(b'moov', mvhd(1000, 2500), audio_trak()))
+
+        self.assertIsNone(read(data))
+
+    def test_truncated(self):
+        data = mp4(box(b'moov', mvhd(1000, 2500), video_trak()))
+
+        for size in (len(data) - 1, len(data) - 40, 30):
+            self.assertIsNone(read(data[:size]))
+
+    def test_invalid_box_size(self):
+        data = mp4(struct.pack('>I4s', 4, b'moov'), bytes(64))
+
+        self.assertIsNone(read(data))
+
+    def test_codecs(self):
+        data = mp4(box(b'moov', mvhd(1000, 0), video_trak(), audio_trak()))
+
+        self.assertEqual(headers.read_codecs(io.BytesIO(data)),
+                         ['avc1.64001f', 'mp4a.40.2'])
+
+    def test_unsupported_codec(self):
+        data = mp4(box(b'moov', mvhd(1000, 0),
+                       trak(b'vide', b'av01', bytes(78))))
+
+        self.assertIsNone(headers.read_codecs(io.BytesIO(data)))
+
+
+class MatroskaTest(SimpleTestCase):
+    def test_header(self):
+        data = matroska(info(2500.0), tracks())
+
+        self.assertEqual(read(data),
+                         {'duration': 2.5, 'width': 320, 'height': 240})
+
+    def test_timecode_scale(self):
+        data = matroska(tracks(), info(25.0, timecode_scale=100000000))
+
+        self.assertEqual(read(data)['duration'], 2.5)
+
+    def test_unknown_size(self):
+        cluster = element(headers.EBML_CLUSTER, bytes(64), unknown_size=True)
+        data = matroska(info(2500.0), tracks(), cluster, unknown_size=True)
+
+        self.assertEqual(read(data),
+                         {'duration': 2.5, 'width': 320, 'height': 240})
+
+    def test_tracks_after_clusters(self):
+        data = matroska(info(2500.0),
+                        element(headers.EBML_CLUSTER, bytes(64)), tracks())
+
+        self.assertIsNone(read(data))
+
+    def test_truncated(self):
+        data = matroska(info(2500.0), tracks())
+
+        for size in (len(data) - 1, len(data) - 20, 30):
+            self.assertIsNone(read(data[:size]))
+
+
+class EncodedVideoTest(SimpleTestCase):
+    def setUp(self):
+        super(EncodedVideoTest, self).setUp()
+        self.temp_dir = tempfile.mkdtemp(prefix='video_encoding_test_')
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+
+    def read_file(self, name, **kwargs):
+        path = make_video(os.path.join(self.temp_dir, name), **kwargs)
+        with open(path, 'rb') as video_file:
+            return headers.read_media_info(video_file)
+
+    def test_mp4(self):
+        media_info = self.read_file('video.mp4', size='320x240')
+
+        self.assertAlmostEqual(media_info.pop('duration'), 2, delta=0.1)
+        self.assertEqual(media_info, {'width': 320, 'height': 240})
+
+    def test_matroska(self):
+        media_info = self.read_file('video.mkv', size='320x240')
+
+        self.assertAlmostEqual(media_info.pop('duration'), 2, delta=0.1)
+        self.assertEqual(media_info, {'width': 320, 'height': 240})
@@ -0,0 +1,231 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..context import ConversionContext
+from ..jobs import _requeue, claim_jobs, enqueue_video, renew_leases, run_job
+from ..models import EncodingJob, Format
+from .utils import MediaTestCase, make_job
+
+
+def _encode_and(action):
+    """
+    Returns a replacement of `ConversionContext.encode` which calls
+    `action` once the encoding started.
+    """
+    encode = ConversionContext.encode
+
+    def wrapper(context, *args):
+        for index, progress in enumerate(encode(context, *args)):
+            if index == 0:
+                action()
+            yield progress
+    return wrapper
+
+
+@override_settings(VIDEO_ENCODING_CANCEL_CHECK_INTERVAL=0)
+class SourceChangeTest(MediaTestCase):
+    def get_format(self, source):
+        return Format.objects.get(object_id=source.pk, field_name='file')
+
+    def test_replaced_video_is_encoded(self):
+        source = self.make_source('videos/a.mp4')
+        enqueue_video(source.file)
+        [job] = claim_jobs('test', 1)
+
+        def replace():
+            replaced = self.replace_source(source, 'videos/b.mp4')
+            # the upload of the new video requests its conversion
+            enqueue_video(replaced.file)
+
+        with mock.patch.object(ConversionContext, 'encode',
+                               _encode_and(replace)):
+            run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, EncodingJob.QUEUED)
+        self.assertEqual(job.attempts, 0)
+        self.assertFalse(self.get_format(source).file)
+
+        [job] = claim_jobs('test', 1)
+        run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, EncodingJob.DONE)
+        video_format = self.get_format(source)
+        self.assertEqual(video_format.file.name,
+                         'formats/mp4_test/videos/b.mp4')
+        self.assertFalse(video_format.cancelled)
+        self.assertEqual(video_format.progress, 100)
+        self.assertEqual(video_format.height, 96)
+
+    def test_deleted_video_is_cancelled(self):
+        source = self.make_source('videos/a.mp4')
+        enqueue_video(source.file)
+        [job] = claim_jobs('test', 1)
+
+        with mock.patch.object(ConversionContext, 'encode',
+                               _encode_and(source.delete)):
+            run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, EncodingJob.CANCELLED)
+        self.assertIn('was deleted', job.last_error)
+        self.assertFalse(claim_jobs('test', 1))
+
+    def test_request_while_running_is_rerun(self):
+        source = self.make_source('videos/a.mp4')
+        enqueue_video(source.file)
+        [job] = claim_jobs('test', 1)
+
+        enqueue_video(source.file, force=True)
+        self.assertTrue(job.complete())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, EncodingJob.QUEUED)
+        self.assertTrue(job.force)
+        self.assertFalse(job.rerun)
+
+
+class QueueTest(TestCase):
+    def expire_leases(self):
+        EncodingJob.objects.update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_claim_order(self):
+        make_job('first')
+        make_job('high', priority=1)
+        make_job('later', available_at=timezone.now() + timedelta(hours=1))
+        make_job('second')
+
+        jobs = claim_jobs('a', 2)
+
+        self.assertEqual([job.format for job in jobs], ['high', 'first'])
+        for job in jobs:
+            self.assertEqual(job.status, EncodingJob.RUNNING)
+            self.assertEqual(job.locked_by, 'a')
+            self.assertEqual(job.attempts, 1)
+            self.assertGreater(job.lease_expires_at, timezone.now())
+        self.assertEqual([job.format for job in claim_jobs('b', 2)],
+                         ['second'])
+        self.assertEqual(claim_jobs('b', 2), [])
+
+    def test_expired_lease(self):
+        make_job('job')
+        claim_jobs('a', 1)
+        self.assertEqual(claim_jobs('b', 1), [])
+        self.expire_leases()
+
+        [job] = claim_jobs('b', 1)
+
+        self.assertEqual(job.locked_by, 'b')
+        self.assertEqual(job.attempts, 2)
+
+    @override_settings(VIDEO_ENCODING_QUEUE_MAX_ATTEMPTS=1)
+    def test_expired_lease_of_last_attempt(self):
+        make_job('job')
+        claim_jobs('a', 1)
+        self.expire_leases()
+
+        self.assertEqual(claim_jobs('b', 1), [])
+
+        job = EncodingJob.objects.get()
+        self.assertEqual(job.status, EncodingJob.FAILED)
+        self.assertEqual(job.last_error, "Lease of worker a expired.")
+        self.assertEqual(job.locked_by, '')
+
+    def test_renew_leases(self):
+        make_job('a1')
+        make_job('a2')
+        make_job('b1')
+        jobs = claim_jobs('a', 2) + claim_jobs('b', 1)
+        self.expire_leases()
+
+        self.assertEqual(renew_leases('a', [job.pk for job in jobs]), 2)
+
+        leases = dict(EncodingJob.objects.values_list(
+            'format', 'lease_expires_at'))
+        self.assertGreater(leases['a1'], timezone.now())
+        self.assertGreater(leases['a2'], timezone.now())
+        self.assertLess(leases['b1'], timezone.now())
+        self.assertEqual(renew_leases('a', []), 0)
+
+    def test_lost_lease(self):
+        make_job('job')
+        [job] = claim_jobs('a', 1)
+        self.expire_leases()
+        claim_jobs('b', 1)
+
+        self.assertFalse(job.complete())
+        self.assertEqual(EncodingJob.objects.get().locked_by, 'b')
+
+    @override_settings(VIDEO_ENCODING_QUEUE_MAX_ATTEMPTS=3,
+                       VIDEO_ENCODING_QUEUE_RETRY_DELAY=60)
+    def test_fail_backoff(self):
+        make_job('job')
+        for delay in (60, 120):
+            [job] = claim_jobs('a', 1)
+            self.assertTrue(job.fail('error'))
+
+            job.refresh_from_db()
+            self.assertEqual(job.status, EncodingJob.QUEUED)
+            self.assertEqual(job.last_error, 'error')
+            self.assertAlmostEqual(
+                (job.available_at - timezone.now()).total_seconds(), delay,
+                delta=5)
+            EncodingJob.objects.update(available_at=timezone.now())
+
+        [job] = claim_jobs('a', 1)
+        job.fail('error')
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, EncodingJob.FAILED)
+        self.assertEqual(job.attempts, 3)
+
+    def test_fail_without_retry(self):
+        make_job('job')
+        [job] = claim_jobs('a', 1)
+
+        job.fail('error', retry=False)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, EncodingJob.FAILED)
+
+    def test_requeue_finished(self):
+        for status in (EncodingJob.DONE, EncodingJob.FAILED,
+                       EncodingJob.CANCELLED):
+            job = make_job(status, status=status, attempts=3,
+                           last_error='error')
+
+            _requeue(job, True, 2)
+
+            job.refresh_from_db()
+            self.assertEqual(job.status, EncodingJob.QUEUED)
+            self.assertEqual(job.attempts, 0)
+            self.assertEqual(job.last_error, '')
+            self.assertTrue(job.force)
+            self.assertEqual(job.priority, 2)
+
+    def test_requeue_queued(self):
+        job = make_job('job', priority=2, force=True)
+
+        _requeue(job, False, 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, EncodingJob.QUEUED)
+        # the stronger request is kept
+        self.assertTrue(job.force)
+        self.assertEqual(job.priority, 2)
+
+    def test_requeue_running(self):
+        make_job('job')
+        [job] = claim_jobs('a', 1)
+
+        _requeue(job, False, 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, EncodingJob.RUNNING)
+        self.assertTrue(job.rerun)
+        self.assertEqual(job.priority, 1)
@@ -0,0 +1,66 @@
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase, override_settings
+
+from ..models import Format
+
+
+@override_settings(VIDEO_ENCODING_PROGRESS_UPDATE=30,
+                   VIDEO_ENCODING_PROGRESS_UPDATE_DELTA=5)
+class ProgressTest(TestCase):
+    def setUp(self):
+        super(ProgressTest, self).setUp()
+        self.format = Format.objects.create(
+            object_id=0, field_name='file', format='mp4',
+            content_type=ContentType.objects.get_for_model(Format))
+        self.now = 1000.0
+        patcher = mock.patch('video_encoding.models.time')
+        self.addCleanup(patcher.stop)
+        patcher.start().monotonic.side_effect = lambda: self.now
+
+    def update(self, percent, after=0, **kwargs):
+        self.now += after
+        self.format.update_progress(percent, **kwargs)
+        return Format.objects.get(pk=self.format.pk).progress
+
+    def test_throttling(self):
+        self.assertEqual(self.update(1), 1)
+        # small steps are written once `PROGRESS_UPDATE` passed
+        self.assertEqual(self.update(3, after=10), 1)
+        self.assertEqual(self.update(4, after=19), 1)
+        self.assertEqual(self.update(4.5, after=2), 4)
+        # large steps are written at once
+        self.assertEqual(self.update(9.9, after=1), 9)
+        self.assertEqual(self.update(14, after=1), 14)
+
+    def test_unchanged_progress(self):
+        self.update(10)
+
+        with self.assertNumQueries(0):
+            self.format.update_progress(10.5)
+            self.now += 60
+            self.format.update_progress(10.9)
+
+    def test_completion_is_written(self):
+        self.update(98)
+
+        self.assertEqual(self.update(100, after=1), 100)
+
+    def test_reset_is_written(self):
+        self.update(2)
+
+        self.format.reset_progress()
+
+        self.assertEqual(self.update(1, after=1), 0)
+
+    def test_without_commit(self):
+        self.assertEqual(self.update(50, commit=False), 0)
+
+        self.format.flush_progress()
+
+        self.assertEqual(Format.objects.get(pk=self.format.pk).progress, 50)
+
+    def test_invalid_percent(self):
+        with self.assertRaises(ValueError):
+            self.format.update_progress(101)
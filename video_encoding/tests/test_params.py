@@ -0,0 +1,70 @@
+from django.test import SimpleTestCase
+
+from .. import params as params_utils
+
+
+class OptionTest(SimpleTestCase):
+    params = ['-codec:v', 'libx264', '-b:v', '1M', '-an', '-b:v', '2M']
+
+    def test_get_option(self):
+        self.assertEqual(params_utils.get_option(self.params, '-b:v'), '2M')
+        self.assertEqual(
+            params_utils.get_option(self.params, '-c:v', '-codec:v'),
+            'libx264')
+        self.assertIsNone(params_utils.get_option(self.params, '-r'))
+        # the last param has no value
+        self.assertIsNone(params_utils.get_option(['-r'], '-r'))
+
+    def test_has_option(self):
+        self.assertTrue(params_utils.has_option(self.params, '-an'))
+        self.assertFalse(params_utils.has_option(self.params, '-vn'))
+
+    def test_remove_option(self):
+        self.assertEqual(params_utils.remove_option(self.params, '-b:v'),
+                         ['-codec:v', 'libx264', '-an'])
+        self.assertEqual(
+            params_utils.remove_option(self.params, '-an', has_value=False),
+            ['-codec:v', 'libx264', '-b:v', '1M', '-b:v', '2M'])
+
+    def test_set_option(self):
+        params = list(self.params)
+
+        self.assertEqual(params_utils.set_option(params, '-b:v', '3M'),
+                         ['-codec:v', 'libx264', '-b:v', '3M', '-an',
+                          '-b:v', '3M'])
+        self.assertEqual(params_utils.set_option(params, '-r', '30'),
+                         self.params + ['-r', '30'])
+        self.assertEqual(params, self.params)
+
+    def test_set_option_aliases(self):
+        params = ['-filter:v', 'scale=-2:720']
+
+        self.assertEqual(
+            params_utils.set_option(
+                params, '-vf', 'scale=-2:480',
+                aliases=params_utils.VIDEO_FILTER_OPTIONS),
+            ['-filter:v', 'scale=-2:480'])
+        self.assertEqual(params_utils.get_video_filter(params),
+                         'scale=-2:720')
+
+    def test_remove_video_options(self):
+        params = ['-codec:v', 'libx264', '-crf', '23', '-vf', 'scale=-2:720',
+                  '-codec:a', 'aac', '-b:a', '128k', '-movflags', 'faststart']
+
+        self.assertEqual(params_utils.remove_video_options(params),
+                         ['-codec:a', 'aac', '-b:a', '128k',
+                          '-movflags', 'faststart'])
+
+
+class ParseBitrateTest(SimpleTestCase):
+    def test_units(self):
+        self.assertEqual(params_utils.parse_bitrate('1000k'), 1000000)
+        self.assertEqual(params_utils.parse_bitrate('2M'), 2000000)
+        self.assertEqual(params_utils.parse_bitrate('1.5m'), 1500000)
+        self.assertEqual(params_utils.parse_bitrate(' 128000 '), 128000)
+        self.assertEqual(params_utils.parse_bitrate(64000), 64000)
+
+    def test_invalid(self):
+        self.assertIsNone(params_utils.parse_bitrate(None))
+        self.assertIsNone(params_utils.parse_bitrate('fast'))
+        self.assertIsNone(params_utils.parse_bitrate('k'))
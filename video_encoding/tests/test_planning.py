@@ -0,0 +1,146 @@
+from django.test import SimpleTestCase
+
+from ..planning import get_scale, plan_formats, scale_bitrates
+
+
+def make_format(name, height, extension='mp4', params=None):
+    return {
+        'name': name,
+        'extension': extension,
+        'params': ['-codec:v', 'libx264',
+                   '-vf', 'scale=-2:{:d}'.format(height)] + (params or []),
+    }
+
+
+FORMATS = [
+    make_format('360p', 360),
+    make_format('720p', 720),
+    make_format('1080p', 1080),
+]
+
+
+def get_names(formats):
+    return [options['name'] for options in formats]
+
+
+class GetScaleTest(SimpleTestCase):
+    def test_scale(self):
+        self.assertEqual(get_scale(['-vf', 'scale=-2:720']), (-2, 720))
+        self.assertEqual(get_scale(['-filter:v', 'fps=30,scale=1280:-1']),
+                         (1280, -1))
+
+    def test_without_scale(self):
+        self.assertIsNone(get_scale(['-codec:v', 'libx264']))
+        self.assertIsNone(get_scale(['-vf', 'fps=30']))
+
+
+class PlanFormatsTest(SimpleTestCase):
+    def test_larger_formats_are_skipped(self):
+        media_info = {'width': 1280, 'height': 720}
+
+        planned = plan_formats(FORMATS, media_info)
+
+        self.assertEqual(get_names(planned), ['360p', '720p'])
+        self.assertEqual(planned[1]['params'], FORMATS[1]['params'])
+
+    def test_smallest_larger_format_is_clamped(self):
+        media_info = {'width': 854, 'height': 480}
+
+        planned = plan_formats(FORMATS, media_info)
+
+        self.assertEqual(get_names(planned), ['360p', '720p'])
+        self.assertEqual(planned[1]['params'],
+                         ['-codec:v', 'libx264', '-vf', 'scale=-2:480'])
+        # the configured formats are not changed
+        self.assertEqual(FORMATS[1]['params'][-1], 'scale=-2:720')
+
+    def test_containers_are_planned_separately(self):
+        formats = FORMATS + [make_format('webm_720p', 720, 'webm')]
+        media_info = {'width': 854, 'height': 480}
+
+        planned = plan_formats(formats, media_info)
+
+        self.assertEqual(get_names(planned), ['360p', '720p', 'webm_720p'])
+        self.assertEqual(planned[2]['params'][-1], 'scale=-2:480')
+
+    def test_width_is_clamped(self):
+        formats = [{'name': 'hd', 'extension': 'mp4',
+                    'params': ['-vf', 'scale=1280:-2']}]
+        media_info = {'width': 641, 'height': 360}
+
+        planned = plan_formats(formats, media_info)
+
+        self.assertEqual(planned[0]['params'], ['-vf', 'scale=640:-2'])
+
+    def test_frame_rate(self):
+        formats = [
+            make_format('60fps', 360, params=['-r', '60']),
+            make_format('24fps', 360, params=['-r', '24']),
+            make_format('ntsc', 360, params=['-r', 'ntsc']),
+        ]
+        media_info = {'width': 640, 'height': 360, 'frame_rate': 30}
+
+        planned = plan_formats(formats, media_info)
+
+        self.assertNotIn('-r', planned[0]['params'])
+        self.assertEqual(planned[1]['params'][-2:], ['-r', '24'])
+        self.assertEqual(planned[2]['params'][-2:], ['-r', 'ntsc'])
+
+    def test_bitrate(self):
+        formats = [make_format('360p', 360, params=[
+            '-b:v', '5M', '-maxrate', '5M', '-bufsize', '10M'])]
+        media_info = {'width': 640, 'height': 360, 'bit_rate': 2000000}
+
+        planned = plan_formats(formats, media_info)
+
+        self.assertEqual(planned[0]['params'][-6:],
+                         ['-b:v', '2000k', '-maxrate', '2000k',
+                          '-bufsize', '4000k'])
+
+    def test_lower_bitrate_is_kept(self):
+        formats = [make_format('360p', 360, params=['-b:v', '1M'])]
+        media_info = {'width': 640, 'height': 360, 'bit_rate': 2000000}
+
+        planned = plan_formats(formats, media_info)
+
+        self.assertEqual(planned[0]['params'][-2:], ['-b:v', '1M'])
+
+    def test_identical_formats_are_encoded_once(self):
+        formats = [
+            make_format('360p', 360),
+            make_format('360p_60fps', 360, params=['-r', '60']),
+        ]
+        media_info = {'width': 640, 'height': 360, 'frame_rate': 30}
+
+        self.assertEqual(get_names(plan_formats(formats, media_info)),
+                         ['360p'])
+
+    def test_formats_without_params(self):
+        formats = [{'name': 'copy', 'extension': 'mp4'}]
+
+        self.assertEqual(plan_formats(formats, {'width': 640,
+                                                'height': 360}),
+                         formats)
+
+
+class ScaleBitratesTest(SimpleTestCase):
+    def test_bitrates_are_scaled(self):
+        formats = [
+            make_format('360p', 360, params=[
+                '-b:v', '1M', '-maxrate', '2M', '-bufsize', '4M',
+                '-b:a', '128k']),
+            make_format('crf', 360, params=['-crf', '23']),
+            {'name': 'copy', 'extension': 'mp4'},
+        ]
+
+        scaled = scale_bitrates(formats, 0.5)
+
+        self.assertEqual(scaled[0]['params'][-8:],
+                         ['-b:v', '500k', '-maxrate', '1000k',
+                          '-bufsize', '2000k', '-b:a', '128k'])
+        self.assertEqual(scaled[1], formats[1])
+        self.assertIs(scaled[2], formats[2])
+        self.assertEqual(formats[0]['params'][-7], '1M')
+
+    def test_factor_of_one(self):
+        self.assertIs(scale_bitrates(FORMATS, 1), FORMATS)
@@ -0,0 +1,45 @@
+from django.test import SimpleTestCase, override_settings
+
+from ..backends.base import BaseEncodingBackend
+from ..backends.ffmpeg import FFmpegBackend
+from ..scheduler import EncodingScheduler
+
+
+class PlainBackend(BaseEncodingBackend):
+    name = 'Plain'
+
+    def __init__(self, nice=None):
+        self.nice = nice
+
+    def encode(self, source_path, target_path, params, media_info=None):
+        return iter([])
+
+    def get_media_info(self, video_path):
+        return {}
+
+    def get_thumbnail(self, video_path, at_time=0.5, media_info=None):
+        return None
+
+
+class GetBackendTest(SimpleTestCase):
+    def test_threads_are_shared(self):
+        scheduler = EncodingScheduler(max_workers=3, core_budget=8)
+        self.addCleanup(scheduler.shutdown)
+
+        backend = scheduler.get_backend()
+
+        self.assertIsInstance(backend, FFmpegBackend)
+        self.assertEqual(backend.params[:2], ['-threads', '2'])
+
+    @override_settings(
+        VIDEO_ENCODING_BACKEND='video_encoding.tests.test_scheduler.'
+                               'PlainBackend',
+        VIDEO_ENCODING_BACKEND_PARAMS={'nice': 10})
+    def test_threads_are_optional(self):
+        scheduler = EncodingScheduler(max_workers=3, core_budget=8)
+        self.addCleanup(scheduler.shutdown)
+
+        backend = scheduler.get_backend()
+
+        self.assertIsInstance(backend, PlainBackend)
+        self.assertEqual(backend.nice, 10)
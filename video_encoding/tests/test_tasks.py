@@ -0,0 +1,84 @@
+import os
+import shutil
+from unittest import mock
+
+from django.test import override_settings
+
+from ..context import ConversionContext
+from ..models import EncodedOutput, Format
+from ..tasks import convert_video
+from .utils import MediaTestCase
+
+
+@override_settings(VIDEO_ENCODING_DEDUPLICATE=True)
+class DeduplicateTest(MediaTestCase):
+    def setUp(self):
+        super(DeduplicateTest, self).setUp()
+        self.first = self.make_source('videos/a.mp4')
+        shutil.copy(os.path.join(self.media_root, 'videos/a.mp4'),
+                    os.path.join(self.media_root, 'videos/b.mp4'))
+        self.second = Format.objects.create(
+            object_id=0, field_name='source', format='second',
+            file='videos/b.mp4', content_type=self.first.content_type)
+
+    def get_format(self, source):
+        return Format.objects.get(object_id=source.pk, field_name='file')
+
+    def convert(self, source):
+        """
+        Returns whether the source was encoded.
+        """
+        encode = ConversionContext.encode
+        calls = []
+
+        def wrapper(context, *args):
+            calls.append(args)
+            return encode(context, *args)
+
+        with mock.patch.object(ConversionContext, 'encode', wrapper):
+            self.assertEqual(convert_video(source.file), {})
+        return bool(calls)
+
+    def test_reused_outputs_are_independent(self):
+        self.assertTrue(self.convert(self.first))
+        self.assertFalse(self.convert(self.second))
+
+        first_format = self.get_format(self.first)
+        second_format = self.get_format(self.second)
+        self.assertEqual(EncodedOutput.objects.count(), 1)
+        self.assertNotEqual(first_format.file.name, second_format.file.name)
+        self.assertEqual(second_format.progress, 100)
+        self.assertEqual(second_format.height, 96)
+
+        first_format.file.delete()
+        self.assertTrue(second_format.file.storage.exists(
+            second_format.file.name))
+
+    def test_deleted_outputs_are_encoded(self):
+        self.convert(self.first)
+        self.get_format(self.first).file.delete()
+
+        self.assertTrue(self.convert(self.second))
+        self.assertTrue(self.get_format(self.second).file)
+
+    def test_replaced_outputs_are_encoded(self):
+        self.convert(self.first)
+        first_format = self.get_format(self.first)
+        # e.g. the format was deleted and encoded from another video
+        with first_format.file.storage.open(first_format.file.name,
+                                            'wb') as output:
+            output.write(b'other video')
+
+        self.assertTrue(self.convert(self.second))
+        second_format = self.get_format(self.second)
+        self.assertGreater(second_format.file.size, len(b'other video'))
+
+    def test_content_hash_is_cached(self):
+        self.convert(self.first)
+
+        with mock.patch.object(ConversionContext, '_hash_source') as hash_:
+            with ConversionContext(self.first.file) as context:
+                self.assertEqual(
+                    context.content_hash,
+                    EncodedOutput.objects.get().source_hash)
+        hash_.assert_not_called()
@@ -0,0 +1,118 @@
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from ..context import CancelToken
+from ..jobs import claim_jobs
+from ..models import EncodingJob
+from ..worker import Worker
+from .utils import make_job
+
+
+class PreemptTest(TestCase):
+    def make_worker(self, worker_id, jobs):
+        worker = Worker(worker_id, concurrency=len(jobs))
+        self.addCleanup(worker.scheduler.shutdown)
+        for job in jobs:
+            worker.running[job.pk] = (job, CancelToken(), None)
+        return worker
+
+    def get_preempted(self, worker):
+        return sorted(job.format for job, token, __ in worker.running.values()
+                      if token.is_cancelled)
+
+    def test_one_job_per_waiting_job(self):
+        make_job('low')
+        make_job('lower', priority=-1)
+        worker = self.make_worker('a', claim_jobs('a', 2))
+        make_job('high', priority=1)
+
+        worker._preempt()
+        worker._preempt()
+
+        self.assertEqual(self.get_preempted(worker), ['lower'])
+        self.assertTrue(EncodingJob.objects.get(format='lower').preempted)
+
+    def test_workers_share_waiting_jobs(self):
+        make_job('low_a')
+        worker_a = self.make_worker('a', claim_jobs('a', 1))
+        make_job('low_b')
+        worker_b = self.make_worker('b', claim_jobs('b', 1))
+        make_job('high', priority=1)
+
+        worker_a._preempt()
+        worker_b._preempt()
+
+        self.assertEqual(self.get_preempted(worker_a), ['low_a'])
+        self.assertEqual(self.get_preempted(worker_b), [])
+
+        # the slot is taken, the next waiting job preempts another one
+        make_job('higher', priority=2)
+        worker_b._preempt()
+
+        self.assertEqual(self.get_preempted(worker_b), ['low_b'])
+
+    def test_higher_priority_is_not_preempted(self):
+        make_job('high', priority=1)
+        worker = self.make_worker('a', claim_jobs('a', 1))
+        make_job('low')
+        make_job('same', priority=1)
+
+        worker._preempt()
+
+        self.assertEqual(self.get_preempted(worker), [])
+
+    def test_requeued_job_can_be_preempted_again(self):
+        make_job('low')
+        [job] = claim_jobs('a', 1)
+        worker = self.make_worker('a', [job])
+        make_job('high', priority=1)
+        worker._preempt()
+
+        job.refresh_from_db()
+        self.assertTrue(job.preempt())
+        job.refresh_from_db()
+        self.assertEqual(job.status, EncodingJob.QUEUED)
+        self.assertFalse(job.preempted)
+
+
+class DatabaseErrorTest(SimpleTestCase):
+    def setUp(self):
+        super(DatabaseErrorTest, self).setUp()
+        self.worker = Worker('a', concurrency=1)
+        self.addCleanup(self.worker.scheduler.shutdown)
+
+    @override_settings(VIDEO_ENCODING_QUEUE_POLL_INTERVAL=3)
+    def test_claim_is_retried(self):
+        error = OperationalError('database is locked')
+
+        with mock.patch('video_encoding.worker.claim_jobs',
+                        side_effect=[error, error, error, []]) as claim, \
+                mock.patch.object(Worker, '_heartbeat'), \
+                mock.patch.object(Worker, '_wait') as wait, \
+                self.assertLogs('video_encoding.worker', 'WARNING') as logs:
+            self.worker.run(once=True)
+
+        self.assertEqual(claim.call_count, 4)
+        self.assertEqual([args[0] for args, __ in wait.call_args_list],
+                         [1, 2, 3])
+        self.assertIn('database is locked', logs.output[0])
+
+    @override_settings(VIDEO_ENCODING_QUEUE_LEASE_TIME=0.03)
+    def test_heartbeat_survives(self):
+        renewed = []
+
+        def renew_leases(worker_id, job_ids):
+            renewed.append(job_ids)
+            if len(renewed) < 3:
+                raise OperationalError('database is locked')
+            self.worker._heartbeat_stopped.set()
+
+        with mock.patch('video_encoding.worker.renew_leases',
+                        renew_leases), \
+                self.assertLogs('video_encoding.worker', 'WARNING') as logs:
+            self.worker._heartbeat()
+
+        self.assertEqual(len(renewed), 3)
+        self.assertEqual(len(logs.output), 2)
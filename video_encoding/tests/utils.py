@@ -0,0 +1,116 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.files.storage import FileSystemStorage, Storage
+from django.test import TestCase, override_settings
+
+from ..compat import which
+from ..models import EncodingJob, Format
+
+# encodes the test videos within a fraction of a second
+TEST_FORMATS = {
+    'FFmpeg': [
+        {
+            'name': 'mp4_test',
+            'extension': 'mp4',
+            'params': [
+                '-codec:v', 'libx264', '-preset', 'ultrafast',
+                '-vf', 'scale=-2:96', '-codec:a', 'aac', '-b:a', '64k',
+            ],
+        },
+    ],
+}
+
+
+def make_video(path, duration=2, size='160x120', frame_rate=25,
+               params=None):
+    """
+    Generates a H.264 test video with an audio track.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cmds = [
+        which('ffmpeg'), '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=size={}:rate={}:duration={}'.format(
+            size, frame_rate, duration),
+        '-f', 'lavfi', '-i', 'sine=duration={}'.format(duration),
+        '-codec:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+        '-codec:a', 'aac',
+    ]
+    cmds.extend(params or [])
+    cmds.append(path)
+    subprocess.run(cmds, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   check=True)
+    return path
+
+
+def make_job(name, priority=0, **kwargs):
+    """
+    Queues a job without a video, for tests of the queue itself.
+    """
+    return EncodingJob.objects.create(
+        object_id=0, content_type=ContentType.objects.get_for_model(Format),
+        field_name='file', format=name, priority=priority, **kwargs)
+
+
+class MediaTestCase(TestCase):
+    """
+    Stores files in a temporary `MEDIA_ROOT` and encodes `TEST_FORMATS`.
+    """
+
+    def setUp(self):
+        super(MediaTestCase, self).setUp()
+        self.media_root = tempfile.mkdtemp(prefix='video_encoding_test_')
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = override_settings(
+            MEDIA_ROOT=self.media_root, VIDEO_ENCODING_FORMATS=TEST_FORMATS)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        # media info is cached by file name
+        caches['default'].clear()
+
+    def make_source(self, name='videos/source.mp4', **kwargs):
+        """
+        Returns a `Format` whose `file` is used as video to convert, which
+        spares a model only used by tests.
+        """
+        make_video(os.path.join(self.media_root, name), **kwargs)
+        return Format.objects.create(
+            object_id=0, field_name='source', format=name, file=name,
+            content_type=ContentType.objects.get_for_model(Format))
+
+    def replace_source(self, source, name, **kwargs):
+        make_video(os.path.join(self.media_root, name), **kwargs)
+        Format.objects.filter(pk=source.pk).update(file=name)
+        return Format.objects.get(pk=source.pk)
+
+
+class RemoteStorage(Storage):
+    """
+    A storage without local paths, like S3, which keeps its files in a
+    directory.
+    """
+
+    def __init__(self, location):
+        self._storage = FileSystemStorage(location=location)
+
+    def _open(self, name, mode='rb'):
+        return self._storage._open(name, mode)
+
+    def _save(self, name, content):
+        return self._storage._save(name, content)
+
+    def delete(self, name):
+        self._storage.delete(name)
+
+    def exists(self, name):
+        return self._storage.exists(name)
+
+    def size(self, name):
+        return self._storage.size(name)
+
+    def get_modified_time(self, name):
+        return self._storage.get_modified_time(name)
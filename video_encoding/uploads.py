@@ -0,0 +1,146 @@
+"""
+Storing of encoded files.
+
+If the storage is on the same filesystem as the scratch directory, files
+are hard linked into the storage instead of being copied. Otherwise they
+are streamed in chunks of `VIDEO_ENCODING_UPLOAD_CHUNK_SIZE` bytes, which
+remote storages like S3 upload as multipart uploads.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.core.files import File
+
+from . import metrics
+from .config import settings
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# read once, changing the umask is not thread safe
+UMASK = _get_umask()
+
+
+def store(storage, name, local_path, max_length=None, keep_local=False):
+    """
+    Stores a local file under `name` or an available alternative and
+    returns the stored name. The local file is removed unless `keep_local`
+    is set.
+    """
+    started = time.monotonic()
+    stored_name = _link(storage, name, local_path, max_length)
+    linked = stored_name is not None
+    if not linked:
+        with open(local_path, 'rb') as local_file:
+            content = File(local_file)
+            content.DEFAULT_CHUNK_SIZE = \
+                settings.VIDEO_ENCODING_UPLOAD_CHUNK_SIZE
+            stored_name = storage.save(name, content, max_length=max_length)
+    metrics.observe('storage.save', time.monotonic() - started,
+                    linked=linked)
+    if not linked:
+        metrics.increment('storage.bytes', os.path.getsize(local_path))
+
+    if not keep_local:
+        os.unlink(local_path)
+    return stored_name
+
+
+def copy(storage, source_name, name, max_length=None):
+    """
+    Stores a copy of a file of the storage under `name` or an available
+    alternative and returns the stored name. On the same filesystem the
+    copy is a hard link, so both names can be deleted independently.
+    """
+    started = time.monotonic()
+    try:
+        stored_name = _link(storage, name, storage.path(source_name),
+                            max_length)
+    except (NotImplementedError, AttributeError):
+        stored_name = None
+    linked = stored_name is not None
+    if not linked:
+        with storage.open(source_name, 'rb') as content:
+            content.DEFAULT_CHUNK_SIZE = \
+                settings.VIDEO_ENCODING_UPLOAD_CHUNK_SIZE
+            stored_name = storage.save(name, content, max_length=max_length)
+    metrics.observe('storage.save', time.monotonic() - started,
+                    linked=linked)
+    if not linked:
+        metrics.increment('storage.bytes', storage.size(stored_name))
+    return stored_name
+
+
+def _link(storage, name, local_path, max_length):
+    """
+    Hard links the file into the storage and returns the stored name or
+    `None` if the storage is not on the same filesystem.
+    """
+    if not settings.VIDEO_ENCODING_UPLOAD_LINK:
+        return None
+    try:
+        storage.path(name)
+    except (NotImplementedError, AttributeError):
+        return None
+
+    while True:
+        name = storage.get_available_name(name, max_length=max_length)
+        target_path = storage.path(name)
+        directory = os.path.dirname(target_path)
+        os.makedirs(directory, exist_ok=True)
+        if os.stat(directory).st_dev != os.stat(local_path).st_dev:
+            return None
+        try:
+            os.link(local_path, target_path)
+        except FileExistsError:
+            # name was taken in the meantime, try another one
+            continue
+        except OSError:
+            # e.g. the filesystem does not support hard links
+            return None
+        break
+
+    # scratch files are only readable by the owner
+    mode = getattr(storage, 'file_permissions_mode', None)
+    os.chmod(target_path, mode if mode is not None else 0o666 & ~UMASK)
+    return name.replace('\\', '/')
+
+
+class Uploader:
+    """
+    Stores files concurrently with `VIDEO_ENCODING_UPLOAD_WORKERS` threads,
+    e.g. finished segments while the encoding continues.
+    """
+
+    def __init__(self, storage, max_workers=None):
+        self.storage = storage
+        self.futures = []
+        self._executor = ThreadPoolExecutor(
+            max_workers=(max_workers or
+                         settings.VIDEO_ENCODING_UPLOAD_WORKERS),
+            thread_name_prefix='video_encoding_upload')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown(wait=True)
+
+    def submit(self, name, local_path, **kwargs):
+        future = self._executor.submit(store, self.storage, name,
+                                       local_path, **kwargs)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        """
+        Waits for all uploads and returns the stored names in the order of
+        submission. The first error is reraised.
+        """
+        wait(self.futures)
+        return [future.result() for future in self.futures]
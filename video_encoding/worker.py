@@ -0,0 +1,187 @@
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from django.db import (DatabaseError, close_old_connections, connections,
+                       transaction)
+from django.utils import timezone
+
+from .config import settings
+from .context import CancelToken
+from .jobs import claim_jobs, renew_leases, run_job
+from .models import EncodingJob
+from .scheduler import EncodingScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def _get_retry_delay(failures, max_delay):
+    """
+    Doubles the delay after each consecutive failure, starting at a second.
+    """
+    return min(max_delay, 2.0 ** (failures - 1))
+
+
+class Worker:
+    """
+    Claims queued encoding jobs and runs up to `concurrency` of them at
+    once. Leases of running jobs are renewed in the background, so jobs of
+    crashed workers are picked up by others once their lease expires.
+
+    While all slots are busy, the running job with the lowest priority is
+    preempted as soon as a job with a higher priority is queued.
+    """
+
+    def __init__(self, worker_id=None, concurrency=None):
+        self.worker_id = worker_id or '{}:{:d}'.format(
+            socket.gethostname(), os.getpid())
+        self.scheduler = EncodingScheduler(max_workers=concurrency)
+        # job id -> (job, cancel token, future)
+        self.running = {}
+        self._stopped = threading.Event()
+        self._heartbeat_stopped = threading.Event()
+
+    @property
+    def concurrency(self):
+        return self.scheduler.max_workers
+
+    def stop(self):
+        """
+        Stops claiming new jobs, running jobs are finished.
+        """
+        self._stopped.set()
+
+    def run(self, once=False):
+        """
+        Processes jobs until stopped. With `once` the worker returns as soon
+        as the queue is drained.
+        """
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        poll_interval = settings.VIDEO_ENCODING_QUEUE_POLL_INTERVAL
+        failures = 0
+        try:
+            while not self._stopped.is_set():
+                try:
+                    jobs = self._claim()
+                    if once and not jobs and not self.running:
+                        break
+                    if (settings.VIDEO_ENCODING_QUEUE_PREEMPT and
+                            len(self.running) >= self.concurrency):
+                        self._preempt()
+                except DatabaseError as e:
+                    # e.g. a locked database or a lost connection
+                    failures += 1
+                    delay = _get_retry_delay(failures, poll_interval)
+                    logger.warning("Worker %s failed to poll the queue, "
+                                   "retrying in %gs: %s", self.worker_id,
+                                   delay, e)
+                    close_old_connections()
+                    self._wait(delay)
+                    continue
+                failures = 0
+                self._wait(poll_interval)
+        finally:
+            self._stopped.set()
+            # keep renewing leases until the running jobs are finished
+            self.scheduler.shutdown(wait=True)
+            self._heartbeat_stopped.set()
+            heartbeat.join()
+            connections.close_all()
+
+    def _claim(self):
+        jobs = claim_jobs(self.worker_id,
+                          self.concurrency - len(self.running))
+        for job in jobs:
+            logger.info("Worker %s claimed %s.", self.worker_id, job)
+            token = CancelToken()
+            future = self.scheduler.submit(
+                run_job, job, self.scheduler.get_backend(), token)
+            self.running[job.pk] = (job, token, future)
+        return jobs
+
+    def _wait(self, timeout):
+        if not self.running:
+            self._stopped.wait(timeout)
+            return
+
+        futures = [future for __, __, future in self.running.values()]
+        done, __ = wait(futures, timeout=timeout,
+                        return_when=FIRST_COMPLETED)
+        for job_id, (__, __, future) in list(self.running.items()):
+            if future not in done:
+                continue
+            del self.running[job_id]
+            if future.exception() is not None:
+                logger.error("Job %s crashed: %s", job_id,
+                             future.exception())
+
+    def _preempt(self):
+        """
+        Cancels running jobs with a low priority while claimable jobs with
+        a higher one wait. The cancelled jobs are queued again and the freed
+        slots are claimed by the jobs with the highest priority.
+
+        Each waiting job preempts at most one running job, also across
+        workers: preempted jobs are flagged until they are queued again and
+        the rows are locked while the jobs are chosen.
+        """
+        tokens = {job.pk: token for job, token, __ in self.running.values()
+                  if not token.is_cancelled}
+        if not tokens:
+            return
+
+        now = timezone.now()
+        with transaction.atomic():
+            candidates = list(
+                EncodingJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(pk__in=tokens, locked_by=self.worker_id,
+                        status=EncodingJob.RUNNING, preempted=False)
+                .order_by('priority'))
+            if not candidates:
+                return
+            # slots of jobs preempted before are taken by the first ones
+            pending = EncodingJob.objects.filter(
+                status=EncodingJob.RUNNING, preempted=True,
+                lease_expires_at__gte=now).count()
+            waiting = list(
+                EncodingJob.objects
+                .select_for_update(skip_locked=True)
+                .claimable(now)
+                .filter(priority__gt=candidates[0].priority)
+                .order_by('-priority', 'available_at')
+                [pending:pending + len(candidates)])
+            jobs = [job for job, waiting_job in zip(candidates, waiting)
+                    if waiting_job.priority > job.priority]
+            EncodingJob.objects.filter(
+                pk__in=[job.pk for job in jobs]).update(preempted=True)
+
+        for job in jobs:
+            logger.info("Worker %s preempts %s.", self.worker_id, job)
+            tokens[job.pk].cancel(
+                "Preempted by a job with a higher priority.", requeue=True)
+
+    def _heartbeat(self):
+        interval = settings.VIDEO_ENCODING_QUEUE_LEASE_TIME / 3.0
+        delay = interval
+        failures = 0
+        try:
+            while not self._heartbeat_stopped.wait(delay):
+                try:
+                    renew_leases(self.worker_id, list(self.running))
+                except DatabaseError as e:
+                    # retried before the leases expire
+                    failures += 1
+                    delay = _get_retry_delay(failures, interval)
+                    logger.warning("Worker %s failed to renew its leases, "
+                                   "retrying in %gs: %s", self.worker_id,
+                                   delay, e)
+                    close_old_connections()
+                else:
+                    failures = 0
+                    delay = interval
+        finally:
+            connections.close_all()